@@ -0,0 +1,300 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Benchmark of the Spatial Data API against a local PostGIS stand-in for both databases.
+#
+#   docker compose -f docker-compose.benchmark.yml up -d
+#   python benchmark_api.py --setup --ids 20000
+#   python benchmark_api.py --output results.json
+#   python benchmark_api.py --baseline results.json   # exits 1 on a regression
+#
+# The app runs in-process through Flask's test client, so the numbers cover the
+# API and database layers without HTTP overhead; pass --url to measure a running server.
+
+DB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db_setup')
+
+# Local stand-in from docker-compose.benchmark.yml; any SPATIAL_POSTGIS_* / SPATIAL_ATTRIBUTES_*
+# variable already set in the environment takes precedence
+STAND_IN = {"HOST": "localhost", "PORT": "54329", "DATABASE": "spatial_bench",
+            "USER": "postgres", "PASSWORD": "postgres"}
+
+# Synthetic buildings are spread over central Tokyo
+AREA = (139.69, 35.64, 139.79, 35.72)
+
+WORKLOADS = ("get", "update", "viewport", "bbox")
+
+def configure_environment(args):
+    # Must run before the API modules are imported, since they read settings at import time
+    for database in ("POSTGIS", "ATTRIBUTES"):
+        for key, value in STAND_IN.items():
+            os.environ.setdefault(f"SPATIAL_{database}_{key}", value)
+    os.environ["SPATIAL_CACHE_ENABLED"] = "1" if args.cache else "0"
+    os.environ.setdefault("SPATIAL_TILE_CACHE_ENABLED", "0")
+    os.environ.setdefault("SPATIAL_DB_POOL_MAX_SIZE", str(max(args.concurrency, 10)))
+    sys.path.append(DB_DIR)
+
+def tile_of(lon, lat, zoom):
+    """Return the x/y web map tile containing a point"""
+    n = 2 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return x, y
+
+def generate_dataset(count, zoom_levels, seed):
+    """Return count distinct SpatialID voxels, always the same ones for a given seed"""
+    from spatial_id import SpatialID
+
+    rng = random.Random(seed)
+    seen = set()
+    buildings = []
+    while len(buildings) < count:
+        zoom = zoom_levels[len(buildings) % len(zoom_levels)]
+        x, y = tile_of(rng.uniform(AREA[0], AREA[2]), rng.uniform(AREA[1], AREA[3]), zoom)
+        voxel = SpatialID(zoom, rng.randrange(0, 4), x, y)
+        if voxel not in seen:
+            seen.add(voxel)
+            buildings.append(voxel)
+    return buildings
+
+def load_dataset(args):
+    """Recreate the stand-in tables and fill them with the synthetic dataset"""
+    from psycopg2.extras import execute_values
+    from query_spatial_data import connect_to_postgis_db
+
+    buildings = generate_dataset(args.ids, args.zoom_levels, args.seed)
+    rng = random.Random(args.seed)
+
+    conn = connect_to_postgis_db()
+    if conn is None:
+        sys.exit("Cannot connect to the benchmark database, is docker-compose.benchmark.yml running?")
+    try:
+        cursor = conn.cursor()
+        with open(os.path.join(DB_DIR, 'create_benchmark_tables.sql')) as f:
+            cursor.execute(f.read())
+
+        started = time.perf_counter()
+        geometry_rows = []
+        attribute_rows = []
+        for voxel in buildings:
+            west, south, east, north = voxel.bounds()
+            floor, _ = voxel.altitude_range()
+            spatial_id = str(voxel)
+            geometry_rows.append((spatial_id, west, south, east, north,
+                                  json.dumps({"usage": rng.choice(["residential", "office", "retail"])}), floor))
+            attribute_rows.append((spatial_id, voxel.z, json.dumps({
+                "name": f"Building {spatial_id}",
+                "height": rng.randint(3, 200),
+                "tags": rng.sample(["mr", "landmark", "station", "park", "school"], 2)
+            })))
+
+        execute_values(cursor, """INSERT INTO bldg_spatial_ids (spatial_id, geom, attributes, altitude) VALUES %s""",
+                       geometry_rows, template="(%s, ST_MakeEnvelope(%s, %s, %s, %s, 4326), %s::jsonb, %s)",
+                       page_size=1000)
+        execute_values(cursor, """INSERT INTO spatial_attributes (spatial_id, zoom_level, attributes) VALUES %s""",
+                       attribute_rows, template="(%s, %s, %s::jsonb)", page_size=1000)
+        cursor.execute("ANALYZE bldg_spatial_ids")
+        cursor.execute("ANALYZE spatial_attributes")
+        conn.commit()
+        cursor.close()
+        print(f"Loaded {len(buildings)} spatial IDs at zoom levels {args.zoom_levels} "
+              f"in {time.perf_counter() - started:.1f}s")
+    finally:
+        conn.close()
+
+class HttpClient:
+    """Minimal stand-in for Flask's test client that talks to a running server"""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def get(self, path):
+        return self.session.get(self.base_url + path)
+
+    def post(self, path, json=None):
+        return self.session.post(self.base_url + path, json=json)
+
+def make_client_factory(args):
+    if args.url:
+        return lambda: HttpClient(args.url)
+    from spatial_api import create_app
+    app = create_app()
+    return app.test_client
+
+def make_request(workload, client, buildings, rng, args):
+    """Issue one request of a workload and return its HTTP status"""
+    voxel = rng.choice(buildings)
+    if workload == "get":
+        return client.get(f"/api/spatial/{voxel}?zoom_level={voxel.z}").status_code
+    if workload == "update":
+        return client.post(f"/api/attributes/{voxel}", json={
+            "zoom_level": voxel.z,
+            "attributes": {"name": f"Building {voxel}", "visits": rng.randint(0, 10000)}
+        }).status_code
+    if workload == "viewport":
+        ids = [str(other) for other in rng.sample(buildings, args.viewport_size)]
+        return client.post("/api/spatial/batch", json={"spatial_ids": ids, "zoom_level": voxel.z}).status_code
+    # A bounding box of about 500 m around a building, one page of results
+    west, south, east, north = voxel.bounds()
+    lon, lat = (west + east) / 2, (south + north) / 2
+    return client.get(f"/api/spatial?bbox={lon - 0.003},{lat - 0.002},{lon + 0.003},{lat + 0.002}"
+                      f"&zoom_level={voxel.z}&limit=100").status_code
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+def run_workload(workload, client_factory, buildings, args):
+    per_worker = math.ceil(args.requests / args.concurrency)
+
+    def worker(index):
+        client = client_factory()
+        rng = random.Random(args.seed * 1000 + index)
+        # Warm-up requests open pooled connections and are not measured
+        for _ in range(args.warmup):
+            make_request(workload, client, buildings, rng, args)
+        latencies = []
+        errors = 0
+        for _ in range(per_worker):
+            started = time.perf_counter()
+            status = make_request(workload, client, buildings, rng, args)
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors += 1
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        outcomes = list(executor.map(worker, range(args.concurrency)))
+    duration = time.perf_counter() - started
+
+    latencies = sorted(latency for worker_latencies, _ in outcomes for latency in worker_latencies)
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in outcomes),
+        # Includes each worker's warm-up, so it slightly understates steady-state throughput
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(latencies) / duration, 1),
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3),
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3),
+        },
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare_with_baseline(results, baseline, max_regression):
+    """Return a description of every workload that got slower than the baseline allows"""
+    regressions = []
+    for workload, current in results["workloads"].items():
+        previous = baseline.get("workloads", {}).get(workload)
+        if not previous:
+            continue
+        for metric in ("p50", "p95", "p99"):
+            before, after = previous["latency_ms"][metric], current["latency_ms"][metric]
+            if before and after > before * (1 + max_regression):
+                regressions.append(f"{workload} {metric}: {before:.2f} ms -> {after:.2f} ms")
+        before, after = previous["throughput_rps"], current["throughput_rps"]
+        if before and after < before * (1 - max_regression):
+            regressions.append(f"{workload} throughput: {before:.1f} -> {after:.1f} req/s")
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the Spatial Data API against a local PostGIS stand-in")
+    parser.add_argument("--setup", action="store_true", help="recreate the stand-in tables and load the dataset")
+    parser.add_argument("--ids", type=int, default=10000, help="number of synthetic spatial IDs")
+    parser.add_argument("--zoom-levels", type=lambda v: [int(z) for z in v.split(",")], default=[18, 20, 22, 25],
+                        help="comma-separated zoom levels the IDs are spread over")
+    parser.add_argument("--seed", type=int, default=42, help="seed for the dataset and request mix")
+    parser.add_argument("--workloads", type=lambda v: v.split(","), default=list(WORKLOADS),
+                        help=f"comma-separated subset of {','.join(WORKLOADS)}")
+    parser.add_argument("--requests", type=int, default=2000, help="measured requests per workload")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per client before timing")
+    parser.add_argument("--viewport-size", type=int, default=100, help="spatial IDs per viewport batch")
+    parser.add_argument("--cache", action="store_true", help="enable the in-process cache (off by default)")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--output", help="write results as JSON to this file instead of stdout")
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed relative slowdown against the baseline (default 0.2)")
+    args = parser.parse_args()
+
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+    return args
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+
+    if args.setup:
+        load_dataset(args)
+
+    # Regenerate the same IDs that were loaded instead of reading them back
+    buildings = generate_dataset(args.ids, args.zoom_levels, args.seed)
+    client_factory = make_client_factory(args)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "target": args.url or "in-process",
+            "ids": args.ids,
+            "zoom_levels": args.zoom_levels,
+            "seed": args.seed,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "viewport_size": args.viewport_size,
+            "cache_enabled": args.cache,
+        },
+        "workloads": {},
+    }
+    for workload in args.workloads:
+        print(f"Running {workload} ({args.requests} requests, {args.concurrency} clients)...", file=sys.stderr)
+        results["workloads"][workload] = run_workload(workload, client_factory, buildings, args)
+        summary = results["workloads"][workload]
+        print(f"  {summary['throughput_rps']} req/s, p50 {summary['latency_ms']['p50']} ms, "
+              f"p95 {summary['latency_ms']['p95']} ms, p99 {summary['latency_ms']['p99']} ms, "
+              f"{summary['errors']} errors", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    failed = any(summary["errors"] for summary in results["workloads"].values())
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_with_baseline(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
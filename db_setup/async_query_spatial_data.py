@@ -0,0 +1,500 @@
+import asyncio
+import logging
+import os
+import re
+import sys
+import time
+
+import asyncpg
+
+# Make sibling modules (spatial_cache, metrics, ...) importable by their top-level names
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Connection settings, timeouts and SQL builders are shared with the psycopg2 implementation.
+# Imported under the name the web apps use: a top-level "query_spatial_data" import would load a
+# second copy with its own circuit breaker, caches and tile cache listener.
+from db_setup.query_spatial_data import (POSTGIS_DB_CONFIG, ATTRIBUTES_DB_CONFIG, POOL_MIN_SIZE, POOL_MAX_SIZE,
+                                         POSTGIS_QUERY_TIMEOUT, ATTRIBUTES_QUERY_TIMEOUT, POSTGIS_GEOMETRY_SRID,
+                                         _postgis_lookup_query, _postgis_zoom_clause, _postgis_row_to_dict,
+                                         _geometry_key_suffix, _leg_errors, _geometry_version_query, _ATTRIBUTES_VERSION_QUERY,
+                                         _cached_geometry_version, _note_attributes_version,
+                                         _patch_update_query, _patch_failure, PATCH_FAILED_SQLSTATE,
+                                         _resolve_query, _resolution_params, _resolution_result, _RESOLVE_VERSION_QUERY,
+                                         _ROLLUP_QUERY, _rollup_result, _DESCENDANTS_QUERY, _descendants_params,
+                                         _descendants_result, POSTGIS_CONNECT_TIMEOUT, POSTGIS_DEGRADED_MODE,
+                                         POSTGIS_REPLICA_DB_CONFIG, postgis_breaker, DegradedRows, _degraded_rows,
+                                         _last_known_geometry, _remember_geometry, VersionedRawJSON, _result_version)
+import spatial_cache
+from spatial_cache import MISS, geometry_cache, geometry_fallback, attributes_cache, invalidate_attributes
+from geometry_encoding import DEFAULT_GEOMETRY_FORMAT, geometry_sql, decode_geometry
+from metrics import timed
+from circuit_breaker import CircuitOpenError
+import serialization
+from serialization import RawJSON, decode_raw
+
+logger = logging.getLogger(__name__)
+
+# asyncpg pools, one per database, created by init_pools() inside the running event loop
+_postgis_pool = None
+_attributes_pool = None
+# Pool for POSTGIS_REPLICA_DB_CONFIG, used only in degraded mode
+_postgis_replica_pool = None
+
+
+def _to_asyncpg(query):
+    """Rewrite psycopg2-style %s placeholders as asyncpg's $1, $2, ..."""
+    counter = iter(range(1, 10000))
+    return re.sub(r"%s", lambda _: f"${next(counter)}", query)
+
+
+def _asyncpg_kwargs(config):
+    kwargs = dict(config)
+    kwargs["port"] = int(kwargs["port"])
+    return kwargs
+
+
+def _postgis_pool_kwargs(config):
+    # asyncpg spellings of POSTGIS_CONNECT_OPTIONS: connect timeout and server-side statement timeout
+    return dict(_asyncpg_kwargs(config), min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                init=_init_postgis_connection, timeout=POSTGIS_CONNECT_TIMEOUT,
+                server_settings={"statement_timeout": str(int(POSTGIS_QUERY_TIMEOUT * 1000))})
+
+
+# asyncpg counterpart of _postgis_unavailable: connection failures, timeouts and cancelled statements
+def _asyncpg_unavailable(e):
+    return isinstance(e, (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError,
+                          asyncpg.QueryCanceledError, asyncpg.InterfaceError, CircuitOpenError))
+
+
+def _postgis_guard():
+    return postgis_breaker.guard(is_failure=_asyncpg_unavailable)
+
+
+async def _init_attributes_connection(conn):
+    # Attribute documents come back undecoded as RawJSON and are decoded only when a caller needs them;
+    # parameters are encoded once with the configured serializer
+    await conn.set_type_codec("jsonb", encoder=serialization.dumps, decoder=RawJSON, schema="pg_catalog")
+
+
+async def _init_postgis_connection(conn):
+    # Decode JSONB to Python objects like psycopg2 does
+    await conn.set_type_codec("jsonb", encoder=serialization.dumps, decoder=serialization.loads,
+                              schema="pg_catalog")
+    try:
+        # Return geometry as hex EWKB text, matching what psycopg2 hands back
+        await conn.set_type_codec("geometry", encoder=str, decoder=str, schema="public", format="text")
+    except ValueError:
+        pass
+
+
+async def init_pools():
+    """Create both connection pools; call once from the event loop before serving"""
+    global _postgis_pool, _attributes_pool, _postgis_replica_pool
+    if _postgis_pool is None:
+        try:
+            _postgis_pool = await asyncpg.create_pool(**_postgis_pool_kwargs(POSTGIS_DB_CONFIG))
+        except Exception as e:
+            if not _asyncpg_unavailable(e):
+                raise
+            # Start anyway and serve attributes (and degraded geometry); connections open on demand
+            print(f"PostGIS is unavailable at startup: {e}")
+            postgis_breaker.record_failure(e)
+            _postgis_pool = await asyncpg.create_pool(**dict(_postgis_pool_kwargs(POSTGIS_DB_CONFIG), min_size=0))
+    if _postgis_replica_pool is None and POSTGIS_REPLICA_DB_CONFIG is not None:
+        _postgis_replica_pool = await asyncpg.create_pool(**dict(_postgis_pool_kwargs(POSTGIS_REPLICA_DB_CONFIG),
+                                                                 min_size=0))
+    if _attributes_pool is None:
+        _attributes_pool = await asyncpg.create_pool(min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                                                     init=_init_attributes_connection,
+                                                     **_asyncpg_kwargs(ATTRIBUTES_DB_CONFIG))
+
+
+async def close_pools():
+    """Close both pools, waiting for checked-out connections to be released"""
+    global _postgis_pool, _attributes_pool, _postgis_replica_pool
+    for pool in (_postgis_pool, _attributes_pool, _postgis_replica_pool):
+        if pool is not None:
+            await pool.close()
+    _postgis_pool = _attributes_pool = _postgis_replica_pool = None
+
+
+def pool_stats():
+    """Return ConnectionPool.stats()-shaped dicts for the asyncpg pools"""
+    return [
+        {
+            "name": name,
+            "min_size": pool.get_min_size(),
+            "max_size": pool.get_max_size(),
+            "idle": pool.get_idle_size(),
+            "in_use": pool.get_size() - pool.get_idle_size(),
+        }
+        for name, pool in (("postgis", _postgis_pool), ("attributes", _attributes_pool),
+                           ("postgis_replica", _postgis_replica_pool))
+        if pool is not None
+    ]
+
+
+# Fetch PostGIS rows for many spatial IDs in one query, keyed by spatial ID
+async def fetch_postgis_rows(spatial_ids, zoom_level=None, geometry_format=DEFAULT_GEOMETRY_FORMAT,
+                             tolerance=None):
+    if not spatial_ids:
+        return {}
+    query, params = _postgis_lookup_query(spatial_ids, zoom_level, geometry_format, tolerance)
+    try:
+        # asyncpg acquires inside fetch(), so the stage includes waiting for a connection
+        with _postgis_guard(), timed("postgis"):
+            rows = await _postgis_pool.fetch(_to_asyncpg(query), *params)
+    except Exception as e:
+        if not POSTGIS_DEGRADED_MODE or not _asyncpg_unavailable(e):
+            raise
+        return await _fetch_postgis_rows_degraded(spatial_ids, zoom_level, geometry_format, tolerance, e)
+    rows = {row[0]: _postgis_row_to_dict(row, geometry_format) for row in rows}
+    _remember_geometry(rows, zoom_level, geometry_format, tolerance)
+    return rows
+
+
+# Degraded-mode geometry lookup, like the synchronous _fetch_postgis_rows_degraded
+async def _fetch_postgis_rows_degraded(spatial_ids, zoom_level, geometry_format, tolerance, error):
+    if _postgis_replica_pool is not None:
+        query, params = _postgis_lookup_query(spatial_ids, zoom_level, geometry_format, tolerance)
+        try:
+            with timed("postgis_replica"):
+                rows = await _postgis_replica_pool.fetch(_to_asyncpg(query), *params)
+            return _degraded_rows({row[0]: _postgis_row_to_dict(row, geometry_format) for row in rows})
+        except Exception as e:
+            print(f"Error querying PostGIS replica: {e}")
+    return _last_known_geometry(spatial_ids, zoom_level, geometry_format, tolerance, error)
+
+
+# Fetch attributes for many spatial IDs at one zoom level, keyed by spatial ID, as VersionedRawJSON documents
+async def fetch_attributes_rows(spatial_ids, zoom_level):
+    if not spatial_ids:
+        return {}
+    with timed("attributes"):
+        rows = await _attributes_pool.fetch(
+            """SELECT spatial_id, attributes, extract(epoch FROM updated_at::timestamptz)::float8
+               FROM spatial_attributes WHERE spatial_id = ANY($1::varchar[]) AND zoom_level = $2""",
+            list(spatial_ids), zoom_level)
+    return {row[0]: VersionedRawJSON(row[1].raw, row[2]) for row in rows}
+
+
+async def _wait_for_leg(awaitable, timeout, label, breaker=None):
+    try:
+        return await asyncio.wait_for(awaitable, timeout), None
+    except asyncio.TimeoutError:
+        logger.warning("Timed out after %ss waiting for %s data", timeout, label)
+        # Cancelling the query gives the breaker no verdict, so the timeout is counted here
+        if breaker is not None:
+            breaker.record_failure(f"{label} query timed out after {timeout}s")
+        return None, "timeout"
+    except CircuitOpenError as e:
+        logger.warning("Skipped %s query: %s", label, e)
+        return None, "unavailable"
+    except Exception as e:
+        logger.error("Error querying %s data: %s", label, e)
+        return None, "error"
+
+
+async def _read_through_many(cache, spatial_ids, zoom_level, fetch_rows, key_suffix=()):
+    if not spatial_cache.CACHE_ENABLED:
+        return await fetch_rows(spatial_ids, zoom_level)
+
+    rows = {}
+    missing_ids = []
+    for spatial_id in spatial_ids:
+        value = cache.get((spatial_id, zoom_level) + key_suffix)
+        if value is MISS:
+            missing_ids.append(spatial_id)
+        elif value is not None:
+            rows[spatial_id] = value
+    if not missing_ids:
+        return rows
+
+    fetched_at = time.monotonic()
+    fetched = await fetch_rows(missing_ids, zoom_level)
+    if isinstance(fetched, DegradedRows):
+        # Neither stale rows nor IDs degraded mode could not answer may be cached
+        fetched.update(rows)
+        return fetched
+    for spatial_id in missing_ids:
+        cache.put((spatial_id, zoom_level) + key_suffix, fetched.get(spatial_id), fetched_at)
+    rows.update(fetched)
+    return rows
+
+
+# Get combined data for many spatial IDs; both databases are queried concurrently
+async def get_combined_data_batch(spatial_ids, zoom_level, geometry_format=DEFAULT_GEOMETRY_FORMAT,
+                                  tolerance=None, raw_attributes=False):
+    unique_ids = list(dict.fromkeys(spatial_ids))
+
+    async def fetch_geometry(ids, zoom):
+        return await fetch_postgis_rows(ids, zoom, geometry_format, tolerance)
+
+    (postgis_rows, postgis_error), (attributes_rows, attributes_error) = await asyncio.gather(
+        _wait_for_leg(_read_through_many(geometry_cache, unique_ids, zoom_level, fetch_geometry,
+                                         _geometry_key_suffix(geometry_format, tolerance)),
+                      POSTGIS_QUERY_TIMEOUT, "PostGIS", postgis_breaker),
+        _wait_for_leg(_read_through_many(attributes_cache, unique_ids, zoom_level, fetch_attributes_rows),
+                      ATTRIBUTES_QUERY_TIMEOUT, "attributes"),
+    )
+    postgis_rows = postgis_rows or {}
+    attributes_rows = attributes_rows or {}
+
+    with timed("merge"):
+        results = []
+        for spatial_id in unique_ids:
+            attributes = attributes_rows.get(spatial_id)
+            result = {
+                "spatial_id": spatial_id,
+                "zoom_level": zoom_level,
+                "attributes": attributes if raw_attributes else decode_raw(attributes)
+            }
+            postgis_data = postgis_rows.get(spatial_id)
+            if postgis_data:
+                result["geometry"] = postgis_data["geometry"]
+                result["altitude"] = postgis_data["altitude"]
+                if postgis_data.get("degraded"):
+                    result["degraded"] = True
+                version = _result_version(postgis_data, attributes)
+                if version is not None:
+                    result["version"] = version
+            results.append(result)
+
+    return results, _leg_errors(postgis_error, attributes_error)
+
+
+# Get combined data for one spatial ID, with the same shape as the synchronous version
+async def get_combined_data(spatial_id, zoom_level, geometry_format=DEFAULT_GEOMETRY_FORMAT, tolerance=None,
+                            raw_attributes=False, resolve=None):
+    if resolve not in (None, "exact"):
+        return await _get_resolved_data(spatial_id, zoom_level, geometry_format, tolerance, raw_attributes, resolve)
+    results, errors = await get_combined_data_batch([spatial_id], zoom_level, geometry_format, tolerance,
+                                                    raw_attributes)
+    result = results[0]
+    if errors:
+        result["partial"] = True
+        result["errors"] = errors
+    return result
+
+
+# Resolve attributes through the zoom hierarchy with one query, like the synchronous version
+async def resolve_attributes(spatial_id, zoom_level, mode="nearest"):
+    query = _resolve_query(mode)
+    with timed("attributes"):
+        rows = await _attributes_pool.fetch(_to_asyncpg(query), *_resolution_params(spatial_id, zoom_level))
+    return _resolution_result(rows, mode)
+
+
+# get_combined_data with resolve: the geometry leg goes through the cache, the resolved
+# attributes do not (a write to any level of the chain changes them)
+async def _get_resolved_data(spatial_id, zoom_level, geometry_format, tolerance, raw_attributes, resolve):
+    async def fetch_geometry(ids, zoom):
+        return await fetch_postgis_rows(ids, zoom, geometry_format, tolerance)
+
+    (postgis_rows, postgis_error), (resolved, attributes_error) = await asyncio.gather(
+        _wait_for_leg(_read_through_many(geometry_cache, [spatial_id], zoom_level, fetch_geometry,
+                                         _geometry_key_suffix(geometry_format, tolerance)),
+                      POSTGIS_QUERY_TIMEOUT, "PostGIS", postgis_breaker),
+        _wait_for_leg(resolve_attributes(spatial_id, zoom_level, resolve), ATTRIBUTES_QUERY_TIMEOUT, "attributes"))
+
+    with timed("merge"):
+        attributes = resolved["attributes"] if resolved else None
+        result = {
+            "spatial_id": spatial_id,
+            "zoom_level": zoom_level,
+            "attributes": attributes if raw_attributes else decode_raw(attributes),
+            "attributes_sources": resolved["sources"] if resolved else [],
+        }
+        postgis_data = (postgis_rows or {}).get(spatial_id)
+        if postgis_data:
+            result["geometry"] = postgis_data["geometry"]
+            result["altitude"] = postgis_data["altitude"]
+            if postgis_data.get("degraded"):
+                result["degraded"] = True
+            version = _result_version(postgis_data, None)
+            if version is not None:
+                version["attributes_updated_at"], version["attributes_sources"] = (
+                    resolved["chain_version"] if resolved else (None, 0))
+                result["version"] = version
+        if postgis_error or attributes_error:
+            result["partial"] = True
+            result["errors"] = _leg_errors(postgis_error, attributes_error)
+    return result
+
+
+# Aggregated attributes of the child voxels of spatial_id, like the synchronous version
+async def get_attribute_rollup(spatial_id, zoom_level):
+    with timed("attributes"):
+        rows = await _attributes_pool.fetch(_to_asyncpg(_ROLLUP_QUERY), spatial_id, zoom_level)
+    return _rollup_result(spatial_id, zoom_level, rows)
+
+
+# Attributes of a voxel and every voxel inside it, like the synchronous query_descendant_attributes
+async def query_descendant_attributes(spatial_id, zoom_level, limit=100, after=None, raw_attributes=False):
+    params = _descendants_params(spatial_id, zoom_level, limit, after)
+    with timed("attributes"):
+        rows = await _attributes_pool.fetch(_to_asyncpg(_DESCENDANTS_QUERY), *params)
+    records, last_spatial_id = _descendants_result(rows, zoom_level, limit)
+    if not raw_attributes:
+        for record in records:
+            record["attributes"] = decode_raw(record["attributes"])
+    return records, last_spatial_id
+
+
+# Validators for a combined lookup without fetching its data, like the synchronous get_data_version
+async def get_data_version(spatial_id, zoom_level, geometry_format=DEFAULT_GEOMETRY_FORMAT, tolerance=None,
+                           resolve=None):
+    exact = resolve in (None, "exact")
+
+    async def fetch_geometry_version():
+        with _postgis_guard(), timed("postgis_version"):
+            return await _postgis_pool.fetchval(_to_asyncpg(query), *params)
+
+    async def fetch_attributes_version():
+        with timed("attributes_version"):
+            if exact:
+                return await _attributes_pool.fetchval(_to_asyncpg(_ATTRIBUTES_VERSION_QUERY), spatial_id, zoom_level)
+            return await _attributes_pool.fetchrow(_to_asyncpg(_RESOLVE_VERSION_QUERY),
+                                                   *_resolution_params(spatial_id, zoom_level))
+
+    geometry_version = _cached_geometry_version(spatial_id, zoom_level, geometry_format, tolerance)
+    if geometry_version is MISS:
+        query, params = _geometry_version_query(spatial_id, zoom_level)
+        geometry_version, updated_at = await asyncio.gather(
+            asyncio.wait_for(fetch_geometry_version(), POSTGIS_QUERY_TIMEOUT), fetch_attributes_version())
+    else:
+        updated_at = await fetch_attributes_version()
+
+    if geometry_version is None:
+        return None
+    if not exact:
+        return {"geometry": geometry_version, "attributes_updated_at": updated_at[0], "attributes_sources": updated_at[1]}
+    _note_attributes_version(spatial_id, zoom_level, updated_at)
+    return {"geometry": geometry_version, "attributes_updated_at": updated_at}
+
+
+# Return the subset of spatial IDs that exist in PostGIS
+async def postgis_existing_ids(spatial_ids, zoom_level=None):
+    if not spatial_ids:
+        return set()
+    zoom_sql, zoom_params = _postgis_zoom_clause(zoom_level)
+    with _postgis_guard():
+        rows = await _postgis_pool.fetch(
+            _to_asyncpg(f"SELECT spatial_id FROM bldg_spatial_ids WHERE spatial_id = ANY(%s::varchar[]){zoom_sql}"),
+            list(spatial_ids), *zoom_params)
+    return {row[0] for row in rows}
+
+
+async def postgis_record_exists(spatial_id, zoom_level=None):
+    if spatial_cache.CACHE_ENABLED:
+        cached = geometry_cache.get((spatial_id, zoom_level))
+        if cached is not MISS:
+            return cached is not None
+    try:
+        return spatial_id in await postgis_existing_ids([spatial_id], zoom_level)
+    except Exception as e:
+        # In degraded mode, geometry read before the outage still proves the ID exists
+        if (POSTGIS_DEGRADED_MODE and _asyncpg_unavailable(e)
+                and geometry_fallback.get((spatial_id, zoom_level)) not in (MISS, None)):
+            return True
+        raise
+
+
+# Insert or update attributes and return the stored document
+async def upsert_attributes(spatial_id, zoom_level, attributes, raw=False):
+    stored = await _attributes_pool.fetchval(
+        """INSERT INTO spatial_attributes (spatial_id, zoom_level, attributes)
+           VALUES ($1, $2, $3)
+           ON CONFLICT (spatial_id, zoom_level)
+           DO UPDATE SET attributes = EXCLUDED.attributes, updated_at = CURRENT_TIMESTAMP
+           RETURNING attributes""",
+        spatial_id, zoom_level, attributes)
+    invalidate_attributes(spatial_id, zoom_level)
+    return stored if raw else decode_raw(stored)
+
+
+# Apply a merge patch or JSON Patch in one UPDATE, with the same results as the synchronous version
+async def patch_attributes(spatial_id, zoom_level, patch, patch_format="merge", expected_updated_at=None):
+    query, document = _patch_update_query(patch_format, patch)
+    try:
+        row = await _attributes_pool.fetchrow(_to_asyncpg(query), document, spatial_id, zoom_level,
+                                              expected_updated_at, expected_updated_at)
+    except asyncpg.PostgresError as e:
+        if e.sqlstate != PATCH_FAILED_SQLSTATE:
+            raise
+        return {"success": False, "error": "patch_failed", "message": e.message}
+    if row is None:
+        current = await _attributes_pool.fetchval(_to_asyncpg(_ATTRIBUTES_VERSION_QUERY), spatial_id, zoom_level)
+        return _patch_failure(current, expected_updated_at)
+
+    invalidate_attributes(spatial_id, zoom_level)
+    return {"success": True, "attributes": row[0], "updated_at": row[1]}
+
+
+# Upsert many items in one statement and one transaction, reporting per item
+async def upsert_attributes_batch(items):
+    if not items:
+        return []
+
+    # ON CONFLICT cannot touch the same row twice in one statement, so the last item per key wins
+    rows = {}
+    for item in items:
+        rows[(item["spatial_id"], item["zoom_level"])] = item["attributes"]
+    reports = [{"spatial_id": item["spatial_id"], "zoom_level": item["zoom_level"]} for item in items]
+
+    try:
+        written = await _attributes_pool.fetch(
+            """INSERT INTO spatial_attributes (spatial_id, zoom_level, attributes)
+               SELECT * FROM unnest($1::varchar[], $2::integer[], $3::jsonb[])
+               ON CONFLICT (spatial_id, zoom_level)
+               DO UPDATE SET attributes = EXCLUDED.attributes, updated_at = CURRENT_TIMESTAMP
+               RETURNING spatial_id, zoom_level""",
+            [key[0] for key in rows], [key[1] for key in rows], list(rows.values()))
+    except Exception as e:
+        print(f"Error updating attributes in bulk: {e}")
+        for report in reports:
+            report["success"] = False
+            report["error"] = "Database error, no items were written"
+        return reports
+
+    written = {(row[0], row[1]) for row in written}
+    for spatial_id, zoom_level in written:
+        invalidate_attributes(spatial_id, zoom_level)
+    for report in reports:
+        report["success"] = (report["spatial_id"], report["zoom_level"]) in written
+        if not report["success"]:
+            report["error"] = "Row was not written"
+    return reports
+
+
+# Page through the records whose geometry intersects a bounding box (keyset pagination)
+async def query_bbox_data(min_x, min_y, max_x, max_y, zoom_level, limit=100, after=None,
+                          geometry_format=DEFAULT_GEOMETRY_FORMAT, tolerance=None, raw_attributes=False):
+    geom_sql, geom_params = geometry_sql(geometry_format, tolerance)
+    zoom_sql, zoom_params = _postgis_zoom_clause(zoom_level)
+    query = f"""SELECT spatial_id, {geom_sql}, attributes, altitude FROM bldg_spatial_ids
+              WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, %s){zoom_sql}
+              AND (%s::varchar IS NULL OR spatial_id > %s::varchar)
+              ORDER BY spatial_id
+              LIMIT %s"""
+    with _postgis_guard(), timed("postgis"):
+        rows = await _postgis_pool.fetch(
+            _to_asyncpg(query),
+            *(geom_params + (min_x, min_y, max_x, max_y, POSTGIS_GEOMETRY_SRID) + zoom_params
+              + (after, after, limit + 1)))
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    attributes = await fetch_attributes_rows([row[0] for row in rows], zoom_level)
+
+    records = []
+    for row in rows:
+        row_attributes = attributes.get(row[0])
+        records.append({
+            "spatial_id": row[0],
+            "zoom_level": zoom_level,
+            "geometry": decode_geometry(row[1], geometry_format),
+            "attributes": row_attributes if raw_attributes else decode_raw(row_attributes),
+            "altitude": row[3]
+        })
+
+    return records, (rows[-1][0] if has_more else None)
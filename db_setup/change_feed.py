@@ -0,0 +1,370 @@
+import asyncio
+import itertools
+import os
+import queue
+import select
+import threading
+
+import psycopg2
+
+import serialization
+import spatial_cache
+from spatial_cache import TTLCache, invalidate_all_attributes, invalidate_attributes
+
+# Change feed settings; override through the environment
+CHANGE_FEED_ENABLED = os.environ.get("SPATIAL_CHANGE_FEED_ENABLED", "1") not in ("0", "false", "False")
+# Events buffered per subscriber; a subscriber that falls further behind gets a resync event
+CHANGE_FEED_QUEUE_SIZE = int(os.environ.get("SPATIAL_CHANGE_FEED_QUEUE_SIZE", "1000"))
+# Seconds between keep-alive comments on idle event streams
+CHANGE_FEED_KEEPALIVE = float(os.environ.get("SPATIAL_CHANGE_FEED_KEEPALIVE", "15"))
+
+# Channel notified by the triggers in create_change_feed_trigger.sql
+CHANNEL = "spatial_attributes_changed"
+
+# Longest wait for notifications before the listener checks whether it should stop
+_POLL_INTERVAL = 1.0
+_MAX_RECONNECT_DELAY = 30.0
+
+# Queued by close() to wake a consumer blocked on an empty queue
+_CLOSED = object()
+
+# Last event of a stream whose subscription was closed; consumers end the stream after it
+SHUTDOWN_EVENT = {"event": "shutdown", "data": {"reason": "server shutting down"}}
+
+
+def _intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class _BaseSubscription:
+    """Filter for change events: a set of spatial IDs, a bounding box, or both.
+
+    Events match if their spatial ID is in spatial_ids or their geometry intersects
+    bbox (min_x, min_y, max_x, max_y); with neither, every event matches. zoom_level
+    further restricts events to one zoom level.
+    """
+
+    def __init__(self, spatial_ids=None, bbox=None, zoom_level=None):
+        self.spatial_ids = frozenset(spatial_ids) if spatial_ids is not None else None
+        self.bbox = tuple(bbox) if bbox is not None else None
+        self.zoom_level = zoom_level
+        # Set when events were dropped because the subscriber fell behind
+        self.lost = False
+        # Set by close(); the next get() returns SHUTDOWN_EVENT
+        self.closed = False
+
+    def matches(self, spatial_id, zoom_level, bounds):
+        if self.zoom_level is not None and zoom_level != self.zoom_level:
+            return False
+        if self.spatial_ids is None and self.bbox is None:
+            return True
+        if self.spatial_ids is not None and spatial_id in self.spatial_ids:
+            return True
+        return self.bbox is not None and bounds is not None and _intersects(self.bbox, bounds)
+
+    def _take_pending(self):
+        if self.closed:
+            return SHUTDOWN_EVENT
+        if not self.lost:
+            return None
+        self.lost = False
+        return {"event": "resync", "data": {"reason": "subscriber fell behind"}}
+
+
+class Subscription(_BaseSubscription):
+    """Subscription consumed from a thread, e.g. a WSGI response generator"""
+
+    def __init__(self, spatial_ids=None, bbox=None, zoom_level=None, maxsize=CHANGE_FEED_QUEUE_SIZE):
+        super().__init__(spatial_ids, bbox, zoom_level)
+        self._queue = queue.Queue(maxsize)
+
+    def deliver(self, event):
+        # Called on the listener thread, which must never block on a slow subscriber
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.lost = True
+
+    def close(self):
+        self.closed = True
+        try:
+            self._queue.put_nowait(_CLOSED)
+        except queue.Full:
+            # The consumer is not waiting, and sees closed on its next get()
+            pass
+
+    def get(self, timeout=None):
+        """Return the next event, or None if none arrived within timeout seconds"""
+        pending = self._take_pending()
+        if pending:
+            return pending
+        try:
+            event = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return SHUTDOWN_EVENT if event is _CLOSED else event
+
+
+class AsyncSubscription(_BaseSubscription):
+    """Subscription consumed from an asyncio event loop (the ASGI app)"""
+
+    def __init__(self, spatial_ids=None, bbox=None, zoom_level=None, maxsize=CHANGE_FEED_QUEUE_SIZE):
+        super().__init__(spatial_ids, bbox, zoom_level)
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize)
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            if event is not _CLOSED:
+                self.lost = True
+
+    def deliver(self, event):
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The loop has shut down; the subscriber is gone
+            pass
+
+    def close(self):
+        self.closed = True
+        self.deliver(_CLOSED)
+
+    async def get(self, timeout=None):
+        pending = self._take_pending()
+        if pending:
+            return pending
+        try:
+            event = await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return SHUTDOWN_EVENT if event is _CLOSED else event
+
+
+def format_sse(event):
+    """Encode an event as a Server-Sent Events message, or a keep-alive comment for None"""
+    if event is None:
+        return ": keep-alive\n\n"
+    lines = []
+    if "id" in event:
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['event']}")
+    lines.append(f"data: {serialization.dumps(event['data'])}")
+    return "\n".join(lines) + "\n\n"
+
+
+class ChangeFeed:
+    """One LISTEN connection per process, fanned out to any number of subscriptions.
+
+    A daemon thread listens on CHANNEL. Each batch of notifications invalidates the
+    cached attributes of the changed keys (so edits made by other processes are seen
+    at once), then, if anyone is subscribed, the current attributes are fetched once
+    for the whole batch and delivered as "change" events to the matching subscriptions.
+    After a reconnect or a bulk write, subscribers get a "resync" event instead, since
+    individual changes may have been missed. stop() closes every subscription, so open
+    event streams end with a "shutdown" event instead of holding their worker.
+
+    fetch_attributes(spatial_ids, zoom_level) returns {spatial_id: attributes};
+    fetch_bounds(spatial_ids) returns {spatial_id: (min_x, min_y, max_x, max_y)} and
+    is only called when a subscription has a bounding box.
+    """
+
+    def __init__(self, connect_kwargs, fetch_attributes, fetch_bounds):
+        self.connect_kwargs = dict(connect_kwargs)
+        self.fetch_attributes = fetch_attributes
+        self.fetch_bounds = fetch_bounds
+        self._bounds_cache = TTLCache("change_feed_bounds", spatial_cache.CACHE_MAX_ENTRIES,
+                                      spatial_cache.GEOMETRY_CACHE_TTL)
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        # Set by stop() so streams opened while the worker drains are closed at once
+        self._closed = False
+        self._event_ids = itertools.count(1)
+
+    # Lifecycle
+
+    def start(self):
+        """Start the listener thread if it is not running; a no-op when the feed is disabled"""
+        if not CHANGE_FEED_ENABLED:
+            return
+        with self._lock:
+            self._closed = False
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="spatial-change-feed", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop listening and close every subscription; safe to call more than once"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            subscriptions, self._subscriptions = self._subscriptions, set()
+            self._closed = True
+        self._stop.set()
+        for subscription in subscriptions:
+            subscription.close()
+        if thread is not None:
+            thread.join(timeout)
+
+    def reset_after_fork(self):
+        """Forget the parent's listener thread and subscriptions in a forked child"""
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._closed = False
+        self._subscriptions = set()
+
+    # Subscriptions
+
+    def subscribe(self, subscription):
+        if self._closed:
+            subscription.close()
+            return subscription
+        self.start()
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": CHANGE_FEED_ENABLED,
+                "listening": self._thread is not None and self._thread.is_alive(),
+                "subscribers": len(self._subscriptions),
+            }
+
+    # Listener thread
+
+    def _run(self):
+        delay = 1.0
+        connected_before = False
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.connect_kwargs)
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {CHANNEL}")
+                cursor.close()
+                if connected_before:
+                    # Notifications sent while disconnected are lost
+                    self._resync("listener reconnected")
+                connected_before = True
+                delay = 1.0
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], _POLL_INTERVAL) == ([], [], []):
+                        continue
+                    conn.poll()
+                    notifies = list(conn.notifies)
+                    del conn.notifies[:]
+                    if notifies:
+                        self._handle(notifies)
+            except Exception as e:
+                print(f"Change feed listener error, reconnecting in {delay:.0f}s: {e}")
+                self._stop.wait(delay)
+                delay = min(delay * 2, _MAX_RECONNECT_DELAY)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _resync(self, reason):
+        # Keeps in-flight reads from caching what they read before the missed writes
+        invalidate_all_attributes()
+        self._broadcast(lambda subscription: True, {"event": "resync", "data": {"reason": reason}})
+
+    def _broadcast(self, predicate, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        event = dict(event, id=next(self._event_ids))
+        for subscription in subscriptions:
+            if predicate(subscription):
+                subscription.deliver(event)
+
+    def _handle(self, notifies):
+        # Collapse the batch to the last operation per key, in arrival order
+        changes = {}
+        for notify in notifies:
+            try:
+                payload = serialization.loads(notify.payload)
+            except ValueError:
+                continue
+            if payload.get("op") == "bulk":
+                self._resync(f"bulk write of {payload.get('count')} rows")
+                changes.clear()
+                continue
+            key = (payload["spatial_id"], payload["zoom_level"])
+            changes.pop(key, None)
+            changes[key] = payload["op"]
+
+        for spatial_id, zoom_level in changes:
+            invalidate_attributes(spatial_id, zoom_level)
+
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        if not changes or not subscriptions:
+            return
+
+        attributes = self._fetch_attributes(changes)
+        bounds = {}
+        if any(subscription.bbox is not None for subscription in subscriptions):
+            bounds = self._bounds({spatial_id for spatial_id, _ in changes})
+
+        for (spatial_id, zoom_level), op in changes.items():
+            data = {"op": op, "spatial_id": spatial_id, "zoom_level": zoom_level}
+            key = (spatial_id, zoom_level)
+            if op != "delete" and attributes is not None:
+                # None when the row was deleted again before we read it
+                data["attributes"] = attributes.get(key)
+            event = {"id": next(self._event_ids), "event": "change", "data": data}
+            for subscription in subscriptions:
+                if subscription.matches(spatial_id, zoom_level, bounds.get(spatial_id)):
+                    subscription.deliver(event)
+
+    def _fetch_attributes(self, changes):
+        """Current attributes of the changed keys, or None if they could not be read"""
+        by_zoom = {}
+        for (spatial_id, zoom_level), op in changes.items():
+            if op != "delete":
+                by_zoom.setdefault(zoom_level, []).append(spatial_id)
+        try:
+            attributes = {}
+            for zoom_level, spatial_ids in by_zoom.items():
+                for spatial_id, document in self.fetch_attributes(spatial_ids, zoom_level).items():
+                    attributes[(spatial_id, zoom_level)] = document
+            return attributes
+        except Exception as e:
+            # Events still go out without attributes; subscribers fetch them themselves
+            print(f"Error reading changed attributes: {e}")
+            return None
+
+    def _bounds(self, spatial_ids):
+        bounds = {}
+        missing = []
+        for spatial_id in spatial_ids:
+            cached = self._bounds_cache.get(spatial_id)
+            if cached is spatial_cache.MISS:
+                missing.append(spatial_id)
+            elif cached is not None:
+                bounds[spatial_id] = cached
+        if missing:
+            try:
+                fetched = self.fetch_bounds(missing)
+            except Exception as e:
+                print(f"Error reading geometry bounds for the change feed: {e}")
+                return bounds
+            for spatial_id in missing:
+                self._bounds_cache.put(spatial_id, fetched.get(spatial_id))
+            bounds.update(fetched)
+        return bounds
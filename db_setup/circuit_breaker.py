@@ -0,0 +1,151 @@
+import threading
+import time
+from contextlib import contextmanager
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open"""
+
+
+class CircuitBreaker:
+    """Fail fast while a dependency is down instead of waiting on it in every request.
+
+    closed:    calls go through; failure_threshold consecutive failures open the circuit.
+    open:      calls raise CircuitOpenError at once for reset_timeout seconds.
+    half_open: up to half_open_max_calls probe calls go through while the rest are still
+               rejected; a successful probe closes the circuit, a failed one reopens it.
+
+    is_failure(exc) decides which exceptions count against the dependency; any other
+    exception (a SQL error, say) means it answered, and counts as a success.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, half_open_max_calls=1,
+                 is_failure=None):
+        if failure_threshold < 1 or half_open_max_calls < 1:
+            raise ValueError(f"Invalid circuit breaker settings for {name}")
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.is_failure = is_failure or (lambda exc: True)
+
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._last_error = None
+        self.opened_total = 0
+        self.rejected_total = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            self._advance()
+            return self._state
+
+    def _advance(self):
+        # Called with the lock held: an open circuit turns half-open once reset_timeout has passed
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+
+    def _open(self):
+        # Called with the lock held
+        if self._state != OPEN:
+            self.opened_total += 1
+            print(f"{self.name} circuit opened after {self._failures} failures: {self._last_error}")
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+
+    def retry_after(self):
+        """Seconds until an open circuit lets a probe through, 0 when calls are allowed"""
+        with self._lock:
+            self._advance()
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def _acquire(self):
+        """Admit a call; returns whether it is a half-open probe, raises CircuitOpenError if rejected"""
+        with self._lock:
+            self._advance()
+            if self._state == CLOSED:
+                return False
+            if self._state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return True
+            self.rejected_total += 1
+            if self._state == OPEN:
+                retry = self._opened_at + self.reset_timeout - time.monotonic()
+                raise CircuitOpenError(f"{self.name} circuit is open, next probe in {retry:.1f}s")
+            raise CircuitOpenError(f"{self.name} circuit is half-open and already probing")
+
+    def _release(self, probe, succeeded):
+        """Record a call's outcome: True, False, or None when it was abandoned before finishing"""
+        with self._lock:
+            if probe:
+                self._probes -= 1
+            if succeeded:
+                if self._state != CLOSED:
+                    print(f"{self.name} circuit closed")
+                self._state = CLOSED
+                self._failures = 0
+            elif succeeded is not None:
+                self._failures += 1
+                if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                    self._open()
+
+    def record_failure(self, error=None):
+        """Count a failure observed outside guard(), e.g. a caller giving up on a slow call"""
+        with self._lock:
+            self._last_error = error
+            self._advance()
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._open()
+
+    @contextmanager
+    def guard(self, is_failure=None):
+        """Run the block as one call to the dependency; raises CircuitOpenError when rejected.
+
+        is_failure overrides the breaker's predicate, for callers whose driver raises
+        different exception types.
+        """
+        probe = self._acquire()
+        try:
+            yield
+        except Exception as e:
+            failed = (is_failure or self.is_failure)(e)
+            if failed:
+                with self._lock:
+                    self._last_error = e
+            self._release(probe, not failed)
+            raise
+        except BaseException:
+            # Cancelled or abandoned (GeneratorExit): no verdict on the dependency
+            self._release(probe, None)
+            raise
+        else:
+            self._release(probe, True)
+
+    def reset_after_fork(self):
+        """Start a forked child with a fresh lock, keeping the parent's view of the dependency"""
+        self._lock = threading.Lock()
+        self._probes = 0
+
+    def stats(self):
+        with self._lock:
+            self._advance()
+            return {
+                "name": self.name,
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "opened_total": self.opened_total,
+                "rejected_total": self.rejected_total,
+                "last_error": str(self._last_error) if self._last_error is not None else None,
+            }
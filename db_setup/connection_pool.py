@@ -0,0 +1,220 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from metrics import timed
+
+
+class PoolError(Exception):
+    """Raised when a connection cannot be checked out of a pool"""
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections for one database.
+
+    Connections are opened lazily: nothing is opened until the first checkout,
+    at which point the pool is warmed up to min_size. The pool never holds more
+    than max_size connections; callers block for up to checkout_timeout seconds
+    when all of them are in use.
+    """
+
+    def __init__(self, name, connect_kwargs, min_size=1, max_size=10,
+                 checkout_timeout=10.0, health_check_interval=30.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size for {name}: min={min_size}, max={max_size}")
+
+        self.name = name
+        self.connect_kwargs = dict(connect_kwargs)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+
+        self._idle = []  # list of (connection, last_used_timestamp)
+        self._in_use = 0
+        self._warmed_up = False
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _open(self):
+        return psycopg2.connect(**self.connect_kwargs)
+
+    def _warm_up(self):
+        # Called with the lock held on the first checkout
+        self._warmed_up = True
+        while len(self._idle) + self._in_use < self.min_size:
+            try:
+                self._idle.append((self._open(), time.monotonic()))
+            except Exception as e:
+                print(f"Error warming up {self.name} pool: {e}")
+                break
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        # Only ping connections that have been idle long enough to have been dropped
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self):
+        """Check out a healthy connection, opening a new one if needed"""
+        with timed(f"{self.name}_connect"):
+            return self._checkout()
+
+    def _checkout(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise PoolError(f"{self.name} pool is closed")
+                if not self._warmed_up:
+                    self._warm_up()
+
+                while not self._idle and self._in_use >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        raise PoolError(
+                            f"Timed out after {self.checkout_timeout}s waiting for a {self.name} connection"
+                        )
+
+                # Reserve the slot before releasing the lock to ping or connect
+                self._in_use += 1
+                idle = self._idle.pop() if self._idle else None
+
+            if idle is None:
+                try:
+                    return self._open()
+                except Exception:
+                    self._release_slot()
+                    raise
+
+            conn, last_used = idle
+            if self._is_healthy(conn, last_used):
+                return conn
+            self._discard(conn)
+            self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool, rolling back any open transaction"""
+        if not discard and not conn.closed:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed or self._closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks a connection out and always returns it"""
+        conn = self.getconn()
+        try:
+            yield conn
+        except BaseException:
+            # A failed statement may have left the connection unusable; GeneratorExit from an
+            # abandoned streaming generator lands here too, and putconn rolls its transaction back
+            self.putconn(conn, discard=conn.closed != 0)
+            raise
+        else:
+            self.putconn(conn)
+
+    def warm_up(self):
+        """Open min_size connections now instead of on the first checkout"""
+        with self._cond:
+            if not self._warmed_up and not self._closed:
+                self._warm_up()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "name": self.name,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+            }
+
+    def close(self):
+        """Close all idle connections; checked-out ones are closed on return"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+
+# Registry of pools shared by every module in the process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name, connect_kwargs, **options):
+    """Return the pool registered under name, creating it on first use"""
+    pool = _pools.get(name)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = ConnectionPool(name, connect_kwargs, **options)
+            _pools[name] = pool
+        return pool
+
+
+def pool_stats():
+    """Return stats() for every registered pool"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
+
+
+def reset_pools_after_fork():
+    """Forget pools inherited from a parent process without closing them.
+
+    Closing would send a terminate message on sockets the parent still owns, so
+    the child just drops its references and opens its own connections on demand.
+    """
+    global _pools_lock
+    _pools.clear()
+    _pools_lock = threading.Lock()
+
+
+def close_all_pools():
+    """Close every registered pool (e.g. on shutdown)"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
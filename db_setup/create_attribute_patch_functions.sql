@@ -0,0 +1,87 @@
+-- Apply partial updates to spatial_attributes.attributes inside the database, so clients
+-- send only the change (PATCH /api/attributes/<spatial_id>, patch_attributes()).
+--
+--   psql -d spatial_attributes_db -f db_setup/create_attribute_patch_functions.sql
+
+-- JSON Merge Patch (RFC 7396): objects are merged recursively, null removes a member and
+-- any other value replaces the target. Patches without nested objects or nulls are applied
+-- with a plain `attributes || patch` instead.
+CREATE OR REPLACE FUNCTION jsonb_merge_patch(target JSONB, patch JSONB)
+RETURNS JSONB AS $$
+    SELECT CASE
+        WHEN jsonb_typeof(patch) <> 'object' THEN patch
+        ELSE (
+            SELECT coalesce(jsonb_object_agg(key,
+                       CASE WHEN p.value IS NULL THEN t.value ELSE jsonb_merge_patch(t.value, p.value) END),
+                   '{}'::jsonb)
+            FROM jsonb_each(CASE WHEN jsonb_typeof(target) = 'object' THEN target ELSE '{}'::jsonb END) t
+            FULL JOIN jsonb_each(patch) p USING (key)
+            WHERE p.value IS NULL OR jsonb_typeof(p.value) <> 'null'
+        )
+    END
+$$ LANGUAGE sql IMMUTABLE;
+
+-- JSON Patch (RFC 6902) with paths already split into text arrays by the API, e.g.
+-- [{"op": "replace", "path": ["mr_annotations", "3", "color"], "value": "#ff0000"}].
+-- Raises invalid_parameter_value (22023) when an operation does not apply to the document;
+-- the UPDATE calling it then fails and nothing is written.
+CREATE OR REPLACE FUNCTION jsonb_apply_patch(doc JSONB, operations JSONB)
+RETURNS JSONB AS $$
+DECLARE
+    operation JSONB;
+    path TEXT[];
+    source TEXT[];
+    parent_path TEXT[];
+    parent JSONB;
+    last_key TEXT;
+    value JSONB;
+BEGIN
+    FOR operation IN SELECT jsonb_array_elements(operations) LOOP
+        path := ARRAY(SELECT jsonb_array_elements_text(operation->'path'));
+
+        IF operation->>'op' IN ('remove', 'replace') AND doc #> path IS NULL THEN
+            RAISE EXCEPTION 'path % does not exist', array_to_string(path, '/') USING ERRCODE = '22023';
+        END IF;
+
+        IF operation->>'op' IN ('move', 'copy') THEN
+            source := ARRAY(SELECT jsonb_array_elements_text(operation->'from'));
+            value := doc #> source;
+            IF value IS NULL THEN
+                RAISE EXCEPTION 'path % does not exist', array_to_string(source, '/') USING ERRCODE = '22023';
+            END IF;
+            IF operation->>'op' = 'move' THEN
+                doc := doc #- source;
+            END IF;
+        ELSE
+            value := operation->'value';
+        END IF;
+
+        CASE operation->>'op'
+        WHEN 'remove' THEN
+            doc := doc #- path;
+        WHEN 'replace' THEN
+            doc := jsonb_set(doc, path, value, false);
+        WHEN 'test' THEN
+            IF doc #> path IS DISTINCT FROM value THEN
+                RAISE EXCEPTION 'test failed at %', array_to_string(path, '/') USING ERRCODE = '22023';
+            END IF;
+        ELSE
+            -- add, and the target half of move and copy
+            parent_path := path[1:array_length(path, 1) - 1];
+            last_key := path[array_length(path, 1)];
+            parent := doc #> parent_path;
+            IF jsonb_typeof(parent) = 'object' THEN
+                doc := jsonb_set(doc, path, value, true);
+            ELSIF jsonb_typeof(parent) = 'array' AND last_key = '-' THEN
+                doc := jsonb_set(doc, parent_path, parent || jsonb_build_array(value), false);
+            ELSIF jsonb_typeof(parent) = 'array' AND last_key ~ '^(0|[1-9][0-9]*)$'
+                    AND last_key::bigint <= jsonb_array_length(parent) THEN
+                doc := jsonb_insert(doc, path, value);
+            ELSE
+                RAISE EXCEPTION 'cannot add at %', array_to_string(path, '/') USING ERRCODE = '22023';
+            END IF;
+        END CASE;
+    END LOOP;
+    RETURN doc;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
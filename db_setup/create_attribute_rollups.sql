@@ -0,0 +1,141 @@
+-- Aggregated attributes of the child voxels of every parent voxel, kept up to date by
+-- triggers on spatial_attributes (GET /api/rollup/<spatial_id>, get_attribute_rollup()).
+-- Only hierarchical 'z/f/x/y' spatial IDs have a parent; opaque IDs are not rolled up.
+-- Running the script again rebuilds the rollups from spatial_attributes.
+--
+--   psql -d spatial_attributes_db -f db_setup/create_attribute_rollups.sql
+
+-- Parent voxel of a 'z/f/x/y' spatial ID, matching SpatialID.parent(); NULL for opaque IDs
+-- and zoom level 0. >> on bigint is an arithmetic shift, so negative floors round down.
+CREATE OR REPLACE FUNCTION spatial_id_parent(p_spatial_id TEXT)
+RETURNS TEXT AS $$
+    SELECT CASE WHEN p[1]::int > 0 THEN
+               concat_ws('/', p[1]::int - 1, p[2]::bigint >> 1, p[3]::bigint >> 1, p[4]::bigint >> 1)
+           END
+    FROM (SELECT regexp_match(p_spatial_id, '^(\d+)/(-?\d+)/(\d+)/(\d+)$') AS p) parts
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Children with attributes per parent voxel. zoom_level is that of the child rows.
+CREATE TABLE IF NOT EXISTS spatial_attribute_rollups (
+    parent_spatial_id VARCHAR(255) NOT NULL,
+    zoom_level INTEGER NOT NULL,
+    child_count INTEGER NOT NULL,
+    PRIMARY KEY (parent_spatial_id, zoom_level)
+);
+
+-- Per attribute key: how many children set it, and count and sum of its numeric values.
+-- Only invertible aggregates are kept so deletes and updates can be applied as deltas.
+CREATE TABLE IF NOT EXISTS spatial_attribute_rollup_keys (
+    parent_spatial_id VARCHAR(255) NOT NULL,
+    zoom_level INTEGER NOT NULL,
+    attribute_key TEXT NOT NULL,
+    value_count INTEGER NOT NULL,
+    numeric_count INTEGER NOT NULL,
+    numeric_sum DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (parent_spatial_id, zoom_level, attribute_key)
+);
+
+-- Replaced by spatial_attribute_rollup_statements(), which never builds arrays of rows
+DROP FUNCTION IF EXISTS spatial_attribute_rollup_apply(VARCHAR[], INTEGER[], JSONB[], INTEGER);
+
+-- Statements that apply a set of child rows to the rollups. p_deltas is a query returning
+-- (spatial_id, zoom_level, attributes, sign), with sign 1 for rows added and -1 for rows
+-- removed. Each statement aggregates the rows set-based, grouped by parent, so every rollup row
+-- gets one upsert per statement however many of its children changed, and large imports can
+-- spill to disk instead of being held in memory. They are run with EXECUTE by the caller, since
+-- only the trigger function itself can see its transition tables.
+CREATE OR REPLACE FUNCTION spatial_attribute_rollup_statements(p_deltas TEXT)
+RETURNS TEXT[] AS $$
+    SELECT ARRAY[
+        format($sql$
+            INSERT INTO spatial_attribute_rollups AS r (parent_spatial_id, zoom_level, child_count)
+            SELECT spatial_id_parent(d.spatial_id), d.zoom_level, sum(d.sign)
+            FROM (%s) d
+            WHERE spatial_id_parent(d.spatial_id) IS NOT NULL
+            GROUP BY 1, 2
+            ON CONFLICT (parent_spatial_id, zoom_level)
+            DO UPDATE SET child_count = r.child_count + EXCLUDED.child_count
+        $sql$, p_deltas),
+        format($sql$
+            INSERT INTO spatial_attribute_rollup_keys AS k
+                (parent_spatial_id, zoom_level, attribute_key, value_count, numeric_count, numeric_sum)
+            SELECT spatial_id_parent(d.spatial_id), d.zoom_level, e.key,
+                   sum(d.sign),
+                   coalesce(sum(d.sign) FILTER (WHERE jsonb_typeof(e.value) = 'number'), 0),
+                   coalesce(sum(d.sign * (e.value #>> '{}')::float8) FILTER (WHERE jsonb_typeof(e.value) = 'number'), 0)
+            FROM (%s) d, jsonb_each(d.attributes) e
+            WHERE spatial_id_parent(d.spatial_id) IS NOT NULL
+            GROUP BY 1, 2, 3
+            ON CONFLICT (parent_spatial_id, zoom_level, attribute_key)
+            DO UPDATE SET value_count = k.value_count + EXCLUDED.value_count,
+                          numeric_count = k.numeric_count + EXCLUDED.numeric_count,
+                          numeric_sum = k.numeric_sum + EXCLUDED.numeric_sum
+        $sql$, p_deltas),
+        -- Parents and keys whose last child went away
+        format($sql$
+            DELETE FROM spatial_attribute_rollup_keys WHERE value_count <= 0
+                AND (parent_spatial_id, zoom_level) IN (
+                    SELECT spatial_id_parent(d.spatial_id), d.zoom_level FROM (%s) d WHERE d.sign < 0)
+        $sql$, p_deltas),
+        format($sql$
+            DELETE FROM spatial_attribute_rollups WHERE child_count <= 0
+                AND (parent_spatial_id, zoom_level) IN (
+                    SELECT spatial_id_parent(d.spatial_id), d.zoom_level FROM (%s) d WHERE d.sign < 0)
+        $sql$, p_deltas)
+    ]
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Statement-level, like the change feed triggers: a bulk import updates each rollup row once
+-- instead of once per imported row. An UPDATE subtracts the old rows and adds the new ones in
+-- the same statements, so children whose attributes did not change cancel out.
+CREATE OR REPLACE FUNCTION maintain_spatial_attribute_rollups()
+RETURNS TRIGGER AS $$
+DECLARE
+    deltas TEXT;
+    statement TEXT;
+BEGIN
+    deltas := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT spatial_id, zoom_level, attributes, 1 AS sign FROM new_rows'
+        WHEN 'DELETE' THEN 'SELECT spatial_id, zoom_level, attributes, -1 AS sign FROM old_rows'
+        ELSE 'SELECT spatial_id, zoom_level, attributes, -1 AS sign FROM old_rows
+              UNION ALL
+              SELECT spatial_id, zoom_level, attributes, 1 AS sign FROM new_rows'
+    END;
+    FOREACH statement IN ARRAY spatial_attribute_rollup_statements(deltas) LOOP
+        EXECUTE statement;
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS spatial_attributes_rollup_insert ON spatial_attributes;
+CREATE TRIGGER spatial_attributes_rollup_insert
+    AFTER INSERT ON spatial_attributes
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_spatial_attribute_rollups();
+
+DROP TRIGGER IF EXISTS spatial_attributes_rollup_update ON spatial_attributes;
+CREATE TRIGGER spatial_attributes_rollup_update
+    AFTER UPDATE ON spatial_attributes
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_spatial_attribute_rollups();
+
+DROP TRIGGER IF EXISTS spatial_attributes_rollup_delete ON spatial_attributes;
+CREATE TRIGGER spatial_attributes_rollup_delete
+    AFTER DELETE ON spatial_attributes
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION maintain_spatial_attribute_rollups();
+
+-- Recompute every rollup from the current rows, for existing databases, with the same
+-- set-based statements the triggers use
+TRUNCATE spatial_attribute_rollups, spatial_attribute_rollup_keys;
+DO $$
+DECLARE
+    statement TEXT;
+BEGIN
+    FOREACH statement IN ARRAY spatial_attribute_rollup_statements(
+            'SELECT spatial_id, zoom_level, attributes, 1 AS sign FROM spatial_attributes') LOOP
+        EXECUTE statement;
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,29 @@
+-- Tables for the local benchmark stand-in (benchmark_api.py).
+-- Both databases are stood in by one PostGIS database with the production layout.
+
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+DROP TABLE IF EXISTS bldg_spatial_ids;
+DROP TABLE IF EXISTS spatial_attributes;
+
+-- Same columns the API reads from the remote spatial_id_db
+CREATE TABLE bldg_spatial_ids (
+    spatial_id VARCHAR(255) NOT NULL,
+    geom GEOMETRY(Polygon, 4326) NOT NULL,
+    attributes JSONB,
+    altitude DOUBLE PRECISION
+);
+
+CREATE INDEX idx_bldg_spatial_ids_spatial_id ON bldg_spatial_ids(spatial_id);
+CREATE INDEX idx_bldg_spatial_ids_geom ON bldg_spatial_ids USING GIST(geom);
+
+-- Same definition as setup_second_db.sql
+CREATE TABLE spatial_attributes (
+    id SERIAL PRIMARY KEY,
+    spatial_id VARCHAR(255) NOT NULL,
+    zoom_level INTEGER NOT NULL,
+    attributes JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT spatial_attributes_spatial_id_zoom_key UNIQUE (spatial_id, zoom_level) INCLUDE (updated_at)
+);
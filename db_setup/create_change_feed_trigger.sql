@@ -0,0 +1,60 @@
+-- Publish every write to spatial_attributes on the spatial_attributes_changed channel,
+-- so API processes can push edits to subscribers and drop stale cache entries
+-- (db_setup/change_feed.py). Notifications are delivered when the writing transaction
+-- commits, whichever client wrote the row: the API, MRAuthoringSystem or a bulk import.
+--
+--   psql -d spatial_attributes_db -f db_setup/create_change_feed_trigger.sql
+--
+-- Payloads are {"op": "insert"|"update"|"delete", "spatial_id": ..., "zoom_level": ...}.
+-- Statements touching more than 1000 rows send a single {"op": "bulk", "count": ...}
+-- instead, which listeners treat as "resynchronize everything".
+
+CREATE OR REPLACE FUNCTION notify_spatial_attributes_changes()
+RETURNS TRIGGER AS $$
+DECLARE
+    changed_count BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        SELECT count(*) INTO changed_count FROM old_rows;
+    ELSE
+        SELECT count(*) INTO changed_count FROM new_rows;
+    END IF;
+
+    IF changed_count = 0 THEN
+        RETURN NULL;
+    ELSIF changed_count > 1000 THEN
+        PERFORM pg_notify('spatial_attributes_changed',
+                          json_build_object('op', 'bulk', 'count', changed_count)::text);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('spatial_attributes_changed',
+                          json_build_object('op', 'delete', 'spatial_id', spatial_id, 'zoom_level', zoom_level)::text)
+        FROM old_rows;
+    ELSE
+        PERFORM pg_notify('spatial_attributes_changed',
+                          json_build_object('op', lower(TG_OP), 'spatial_id', spatial_id, 'zoom_level', zoom_level)::text)
+        FROM new_rows;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level triggers see all rows of a statement at once through transition tables,
+-- which PostgreSQL only allows on single-event triggers. An ON CONFLICT upsert fires the
+-- INSERT trigger for new rows and the UPDATE trigger for existing ones.
+DROP TRIGGER IF EXISTS spatial_attributes_notify_insert ON spatial_attributes;
+CREATE TRIGGER spatial_attributes_notify_insert
+    AFTER INSERT ON spatial_attributes
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_spatial_attributes_changes();
+
+DROP TRIGGER IF EXISTS spatial_attributes_notify_update ON spatial_attributes;
+CREATE TRIGGER spatial_attributes_notify_update
+    AFTER UPDATE ON spatial_attributes
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_spatial_attributes_changes();
+
+DROP TRIGGER IF EXISTS spatial_attributes_notify_delete ON spatial_attributes;
+CREATE TRIGGER spatial_attributes_notify_delete
+    AFTER DELETE ON spatial_attributes
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_spatial_attributes_changes();
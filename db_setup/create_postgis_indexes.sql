@@ -0,0 +1,9 @@
+-- Indexes on the PostGIS database (spatial_id_db) used by the Spatial Data API
+
+-- Exact and batch lookups by spatial ID (WHERE spatial_id = ... / = ANY(...))
+CREATE INDEX IF NOT EXISTS idx_bldg_spatial_ids_spatial_id ON bldg_spatial_ids(spatial_id);
+
+-- Bounding-box queries (WHERE geom && ST_MakeEnvelope(...))
+CREATE INDEX IF NOT EXISTS idx_bldg_spatial_ids_geom ON bldg_spatial_ids USING GIST(geom);
+
+ANALYZE bldg_spatial_ids;
@@ -0,0 +1,50 @@
+-- Sortable tile keys for hierarchical 'z/f/x/y' spatial IDs, matching SpatialID.tile_key() in
+-- spatial_id.py, stored in generated columns of spatial_attributes and indexed with a B-tree.
+-- A voxel and all of its descendants occupy the contiguous key range SpatialID.key_range()
+-- returns, so "everything inside this voxel" is one index range scan instead of string matching
+-- (query_descendant_attributes()). Opaque IDs like 'building1' get NULL keys and stay out of the
+-- partial index.
+--
+--   psql -d spatial_attributes_db -f db_setup/create_spatial_tile_keys.sql
+--
+-- Adding the stored columns rewrites spatial_attributes once; run it outside peak hours on
+-- existing databases. Running the script again is a no-op.
+
+-- (z, f, x, y) of a valid 'z/f/x/y' spatial ID, like SpatialID.parse(); all NULL for opaque IDs
+-- and out-of-range components. Digit counts are capped so the casts can never fail an insert.
+CREATE OR REPLACE FUNCTION spatial_id_voxel(p_spatial_id TEXT,
+                                            OUT z INTEGER, OUT f BIGINT, OUT x BIGINT, OUT y BIGINT) AS $$
+    SELECT p[1]::int, p[2]::bigint, p[3]::bigint, p[4]::bigint
+    FROM (SELECT regexp_match(p_spatial_id, '^(\d{1,2})/(-?\d{1,9})/(\d{1,9})/(\d{1,9})$') AS p) parts
+    WHERE p[1]::int <= 25
+      AND p[3]::bigint < (1::bigint << p[1]::int) AND p[4]::bigint < (1::bigint << p[1]::int)
+      AND p[2]::bigint >= -(1::bigint << p[1]::int) AND p[2]::bigint < (1::bigint << p[1]::int)
+$$ LANGUAGE sql IMMUTABLE;
+
+-- SpatialID.tile_key(): x/y scaled to zoom 25 and Morton-interleaved (x on the odd bits), with
+-- the zoom level in the low 5 bits. The shift and bitwise operators share one precedence level
+-- in SQL, hence the parentheses.
+CREATE OR REPLACE FUNCTION spatial_id_tile_key(p_spatial_id TEXT)
+RETURNS BIGINT AS $$
+    SELECT ((SELECT bit_or(((((v.x << (25 - v.z)) >> b) & 1) << (2 * b + 1))
+                           | ((((v.y << (25 - v.z)) >> b) & 1) << (2 * b)))
+             FROM generate_series(0, 24) AS b) << 5) | v.z
+    FROM spatial_id_voxel(p_spatial_id) v
+$$ LANGUAGE sql IMMUTABLE;
+
+-- The floor index, which the tile key does not encode
+CREATE OR REPLACE FUNCTION spatial_id_floor(p_spatial_id TEXT)
+RETURNS INTEGER AS $$
+    SELECT f::int FROM spatial_id_voxel(p_spatial_id)
+$$ LANGUAGE sql IMMUTABLE;
+
+ALTER TABLE spatial_attributes
+    ADD COLUMN IF NOT EXISTS tile_key BIGINT GENERATED ALWAYS AS (spatial_id_tile_key(spatial_id)) STORED,
+    ADD COLUMN IF NOT EXISTS tile_floor INTEGER GENERATED ALWAYS AS (spatial_id_floor(spatial_id)) STORED;
+
+-- Ordered like the descendant query's keyset pagination, so pages are read straight off the index
+CREATE INDEX IF NOT EXISTS idx_spatial_attributes_tile_key
+    ON spatial_attributes (tile_key, tile_floor, spatial_id) INCLUDE (zoom_level)
+    WHERE tile_key IS NOT NULL;
+
+ANALYZE spatial_attributes;
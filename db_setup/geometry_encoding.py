@@ -0,0 +1,104 @@
+import base64
+
+from serialization import loads
+
+# Geometry encodings the API can return:
+#   ewkb      - hex-encoded EWKB string, exactly as stored (default)
+#   geojson   - GeoJSON geometry object built by ST_AsGeoJSON
+#   wkb       - base64-encoded binary WKB from ST_AsBinary (a third smaller than hex)
+#   quantized - GeoJSON with integer, delta-encoded coordinates
+GEOMETRY_FORMATS = ("ewkb", "geojson", "wkb", "quantized")
+DEFAULT_GEOMETRY_FORMAT = "ewkb"
+
+# Decimal places kept by ST_AsGeoJSON and by quantization (1e-7 degrees is about 1 cm)
+COORDINATE_PRECISION = 7
+
+# Tile size used to turn a zoom level into a per-pixel simplification tolerance
+TILE_PIXELS = 256
+
+# Length of the Web Mercator world in metres, for projected SRIDs
+_WEB_MERCATOR_EXTENT = 40075016.685578488
+
+
+def simplify_tolerance(zoom_level, srid=4326):
+    """Return the size of one tile pixel at zoom_level, in the units of srid.
+
+    Geometry detail below this size is invisible at that zoom, so it is a safe
+    tolerance for ST_SimplifyPreserveTopology.
+    """
+    world = _WEB_MERCATOR_EXTENT if srid == 3857 else 360.0
+    return world / (TILE_PIXELS << max(zoom_level, 0))
+
+
+def geometry_sql(geometry_format=DEFAULT_GEOMETRY_FORMAT, tolerance=None, column="geom"):
+    """Return (sql, params) selecting column in the requested encoding"""
+    if geometry_format not in GEOMETRY_FORMATS:
+        raise ValueError(f"Unknown geometry format '{geometry_format}'")
+
+    expression = column
+    params = ()
+    if tolerance:
+        expression = f"ST_SimplifyPreserveTopology({column}, %s)"
+        params = (tolerance,)
+
+    if geometry_format in ("geojson", "quantized"):
+        return f"ST_AsGeoJSON({expression}, {COORDINATE_PRECISION})", params
+    if geometry_format == "wkb":
+        return f"ST_AsBinary({expression})", params
+    return expression, params
+
+
+def decode_geometry(value, geometry_format=DEFAULT_GEOMETRY_FORMAT):
+    """Turn the selected column value into its JSON-serializable form"""
+    if value is None:
+        return None
+    if geometry_format == "geojson":
+        return loads(value)
+    if geometry_format == "quantized":
+        return quantize_geojson(loads(value))
+    if geometry_format == "wkb":
+        return base64.b64encode(bytes(value)).decode("ascii")
+    return value
+
+
+def _delta_encode(positions, scale):
+    encoded = []
+    previous = None
+    for position in positions:
+        current = [round(coordinate * scale) for coordinate in position]
+        if previous is None:
+            encoded.append(current)
+        else:
+            encoded.append([c - p for c, p in zip(current, previous)])
+        previous = current
+    return encoded
+
+
+def _quantize_coordinates(coordinates, scale):
+    # A position is a list of numbers; anything deeper is a list of lists
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        return _delta_encode([coordinates], scale)[0]
+    if coordinates and coordinates[0] and isinstance(coordinates[0][0], (int, float)):
+        return _delta_encode(coordinates, scale)
+    return [_quantize_coordinates(part, scale) for part in coordinates]
+
+
+def quantize_geojson(geometry, precision=COORDINATE_PRECISION):
+    """Quantize a GeoJSON geometry to integers and delta-encode each position list.
+
+    Each line or ring keeps its first position as absolute integers and stores the
+    rest as differences from the previous position; divide by "scale" after a
+    running sum to recover the coordinates.
+    """
+    scale = 10 ** precision
+    if geometry["type"] == "GeometryCollection":
+        return {
+            "type": "GeometryCollection",
+            "scale": scale,
+            "geometries": [quantize_geojson(part, precision) for part in geometry["geometries"]],
+        }
+    return {
+        "type": geometry["type"],
+        "scale": scale,
+        "coordinates": _quantize_coordinates(geometry["coordinates"], scale),
+    }
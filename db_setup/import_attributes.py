@@ -0,0 +1,243 @@
+import argparse
+import csv
+import io
+import os
+import re
+import sys
+import time
+
+# Make sibling modules importable both as a script and as db_setup.import_attributes
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from query_spatial_data import connect_to_attributes_db
+import serialization
+
+# Bulk import of attribute documents into spatial_attributes.
+#
+#   python db_setup/import_attributes.py annotations.ndjson
+#   python db_setup/import_attributes.py annotations.csv --chunk-size 100000
+#   python db_setup/query_spatial_data.py export | python db_setup/import_attributes.py - --format ndjson
+#
+# NDJSON lines are {"spatial_id": ..., "zoom_level": ..., "attributes": {...}} objects (as written
+# by the export); CSV files have a spatial_id,zoom_level,attributes header with attributes as JSON
+# text. Records whose attributes are null (geometry-only rows of an export) have nothing to write
+# and are skipped. Rows are streamed into a temporary table with COPY one chunk at a time, then written with
+# one set-based upsert, all in a single transaction: either the whole file is imported or nothing.
+
+SPATIAL_ID_PATTERN = re.compile(r'^[A-Za-z0-9_/.-]+$')
+
+# Invalid rows are reported individually up to this many, then only counted
+MAX_REPORTED_ERRORS = 20
+
+def _validate(spatial_id, zoom_level, attributes):
+    """Return why a row cannot be imported, or None if it is valid"""
+    if not isinstance(spatial_id, str) or not 0 < len(spatial_id) <= 255 or not SPATIAL_ID_PATTERN.match(spatial_id):
+        return "invalid spatial_id"
+    if isinstance(zoom_level, bool) or not isinstance(zoom_level, int):
+        return "zoom_level must be an integer"
+    if not isinstance(attributes, dict):
+        return "attributes must be a JSON object"
+    return None
+
+def iter_ndjson_rows(stream):
+    """Yield (line_number, spatial_id, zoom_level, attributes_json) or (line_number, error) per line.
+
+    Records with "attributes": null yield (line_number,) and are skipped.
+    """
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = serialization.loads(line)
+        except ValueError:
+            yield line_number, "invalid JSON"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, "expected a JSON object"
+            continue
+        spatial_id, zoom_level, attributes = record.get("spatial_id"), record.get("zoom_level"), record.get("attributes")
+        if attributes is None and "attributes" in record:
+            yield (line_number,)
+            continue
+        error = _validate(spatial_id, zoom_level, attributes)
+        if error:
+            yield line_number, error
+        else:
+            yield line_number, spatial_id, zoom_level, serialization.dumps(attributes)
+
+def iter_csv_rows(stream):
+    """Like iter_ndjson_rows for CSV input with a spatial_id,zoom_level,attributes header"""
+    reader = csv.DictReader(stream)
+    missing = {"spatial_id", "zoom_level", "attributes"} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"CSV header is missing {', '.join(sorted(missing))}")
+
+    for row in reader:
+        line_number = reader.line_num
+        try:
+            zoom_level = int(row["zoom_level"])
+        except (TypeError, ValueError):
+            yield line_number, "zoom_level must be an integer"
+            continue
+        try:
+            attributes = serialization.loads(row["attributes"] or "")
+        except ValueError:
+            yield line_number, "attributes must be valid JSON"
+            continue
+        if attributes is None:
+            yield (line_number,)
+            continue
+        error = _validate(row["spatial_id"], zoom_level, attributes)
+        if error:
+            yield line_number, error
+        else:
+            # The document was only parsed to validate it; COPY gets the original text
+            yield line_number, row["spatial_id"], zoom_level, row["attributes"]
+
+def import_rows(conn, rows, chunk_size=50000, progress=None):
+    """Import validated rows into spatial_attributes in one transaction.
+
+    rows are tuples from iter_ndjson_rows / iter_csv_rows. When a spatial ID and zoom
+    level appear more than once, the last row wins. progress(stats) is called after
+    every chunk, then before and after the upsert (stats["stage"] is "copy", "upsert"
+    or "done"). Returns the import statistics; raises on database errors, after
+    rolling back.
+    """
+    stats = {"read": 0, "invalid": 0, "skipped": 0, "copied": 0, "inserted": 0, "updated": 0, "errors": [],
+             "stage": "copy"}
+    started = time.monotonic()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""CREATE TEMP TABLE attributes_import (
+                              line BIGINT,
+                              spatial_id VARCHAR(255),
+                              zoom_level INTEGER,
+                              attributes JSONB
+                          ) ON COMMIT DROP""")
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffered = 0
+
+        def copy_chunk():
+            buffer.seek(0)
+            cursor.copy_expert("COPY attributes_import (line, spatial_id, zoom_level, attributes) "
+                               "FROM STDIN WITH (FORMAT csv)", buffer, size=1 << 16)
+            buffer.seek(0)
+            buffer.truncate()
+            stats["copied"] += buffered
+            stats["elapsed"] = time.monotonic() - started
+            if progress:
+                progress(stats)
+
+        for row in rows:
+            stats["read"] += 1
+            if len(row) == 1:
+                stats["skipped"] += 1
+                continue
+            if len(row) == 2:
+                stats["invalid"] += 1
+                if len(stats["errors"]) < MAX_REPORTED_ERRORS:
+                    stats["errors"].append({"line": row[0], "error": row[1]})
+                continue
+            writer.writerow(row)
+            buffered += 1
+            if buffered >= chunk_size:
+                copy_chunk()
+                buffered = 0
+        if buffered:
+            copy_chunk()
+
+        stats["stage"] = "upsert"
+        stats["elapsed"] = time.monotonic() - started
+        if progress:
+            progress(stats)
+        # Temporary tables are never auto-analyzed; statistics help plan the sort below
+        cursor.execute("ANALYZE attributes_import")
+        # One statement for the whole file; (xmax = 0) tells fresh inserts from updates
+        cursor.execute("""WITH upserted AS (
+                              INSERT INTO spatial_attributes (spatial_id, zoom_level, attributes)
+                              SELECT DISTINCT ON (spatial_id, zoom_level) spatial_id, zoom_level, attributes
+                              FROM attributes_import
+                              ORDER BY spatial_id, zoom_level, line DESC
+                              ON CONFLICT (spatial_id, zoom_level)
+                              DO UPDATE SET attributes = EXCLUDED.attributes, updated_at = CURRENT_TIMESTAMP
+                              RETURNING (xmax = 0) AS inserted
+                          )
+                          SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+                          FROM upserted""")
+        stats["inserted"], stats["updated"] = cursor.fetchone()
+        conn.commit()
+        stats["stage"] = "done"
+        stats["upsert_elapsed"] = time.monotonic() - started - stats["elapsed"]
+        if progress:
+            progress(stats)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    stats["elapsed"] = time.monotonic() - started
+    stats["rows_per_second"] = stats["copied"] / stats["elapsed"] if stats["elapsed"] else 0.0
+    return stats
+
+def _print_progress(stats):
+    if stats["stage"] == "upsert":
+        print(f"Upserting {stats['copied']} copied rows into spatial_attributes...", file=sys.stderr)
+        return
+    if stats["stage"] == "done":
+        print(f"Upserted {stats['inserted'] + stats['updated']} rows in {stats['upsert_elapsed']:.1f}s",
+              file=sys.stderr)
+        return
+    rate = stats["copied"] / stats["elapsed"] if stats["elapsed"] else 0.0
+    print(f"Copied {stats['copied']} rows ({stats['invalid']} invalid) in {stats['elapsed']:.1f}s, "
+          f"{rate:,.0f} rows/s", file=sys.stderr)
+
+def _strict(rows):
+    """Stop at the first invalid row; the open transaction is then rolled back. Skipped rows pass."""
+    for row in rows:
+        if len(row) == 2:
+            raise ValueError(f"line {row[0]}: {row[1]}")
+        yield row
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import attribute documents into spatial_attributes")
+    parser.add_argument("path", help="NDJSON or CSV file to import, or - for stdin")
+    parser.add_argument("--format", choices=("ndjson", "csv"),
+                        help="input format (default: from the file extension, .csv or NDJSON)")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="rows sent per COPY (default 50000)")
+    parser.add_argument("--strict", action="store_true", help="import nothing if any row is invalid")
+    parser.add_argument("--quiet", action="store_true", help="do not report progress")
+    args = parser.parse_args(argv)
+
+    input_format = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+    stream = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+
+    conn = connect_to_attributes_db()
+    if conn is None:
+        sys.exit(1)
+
+    try:
+        rows = iter_csv_rows(stream) if input_format == "csv" else iter_ndjson_rows(stream)
+        if args.strict:
+            rows = _strict(rows)
+        stats = import_rows(conn, rows, args.chunk_size, None if args.quiet else _print_progress)
+    except Exception as e:
+        print(f"Import failed, nothing was written: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        conn.close()
+        if stream is not sys.stdin:
+            stream.close()
+
+    for error in stats["errors"]:
+        print(f"Skipped line {error['line']}: {error['error']}", file=sys.stderr)
+    if stats["invalid"] > len(stats["errors"]):
+        print(f"... and {stats['invalid'] - len(stats['errors'])} more invalid rows", file=sys.stderr)
+    print(f"Copied {stats['copied']} rows and upserted {stats['inserted'] + stats['updated']} "
+          f"({stats['inserted']} inserted, {stats['updated']} updated, {stats['invalid']} invalid skipped, "
+          f"{stats['skipped']} without attributes skipped) "
+          f"in {stats['elapsed']:.1f}s, {stats['rows_per_second']:,.0f} rows/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+# Metrics settings; override through the environment
+METRICS_ENABLED = os.environ.get("SPATIAL_METRICS_ENABLED", "1") not in ("0", "false", "False")
+# Directory shared by the worker processes of one server. When set, each worker writes its
+# histograms there every METRICS_FLUSH_INTERVAL seconds and /metrics reports the sum over all
+# workers, live and exited, instead of only the worker that answered the scrape.
+METRICS_DIR = os.environ.get("SPATIAL_METRICS_DIR") or None
+METRICS_FLUSH_INTERVAL = float(os.environ.get("SPATIAL_METRICS_FLUSH_INTERVAL", "5"))
+
+# Upper bounds in seconds, from sub-millisecond cache hits to remote queries near their timeout
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Thread-safe Prometheus-style histogram with a fixed set of label names"""
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self):
+        """Copy of the series as {label values: (per-bucket counts, sum)}"""
+        with self._lock:
+            return {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+
+    def merge(self, series, other):
+        """Add the series of other (a snapshot of this histogram in another process) into series"""
+        for label_values, (counts, total) in other.items():
+            if len(counts) != len(self.buckets) + 1:
+                continue  # written with different buckets
+            current = series.get(label_values)
+            if current is None:
+                series[label_values] = (list(counts), total)
+            else:
+                series[label_values] = ([a + b for a, b in zip(current[0], counts)], current[1] + total)
+
+    def render(self, series=None):
+        if series is None:
+            series = self.snapshot()
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(list(zip(self.label_names, label_values)) + [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(list(zip(self.label_names, label_values)))
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def _gauge(name, documentation, samples, metric_type="gauge"):
+    """Render (label_pairs, value) samples as one Prometheus metric"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return lines
+
+
+# Time spent in each stage of serving a lookup: "<pool>_connect" (pool checkout, including
+# opening a connection), "postgis" and "attributes" queries (or one "fdw" join), "merge" and "serialize";
+# conditional GETs add the "postgis_version" and "attributes_version" probes, and geometry
+# lookups answered from the replica in degraded mode are timed as "postgis_replica"
+stage_duration = Histogram("spatial_stage_duration_seconds",
+                           "Time spent in each stage of serving spatial data", ("stage",))
+
+# End-to-end request latency per Flask endpoint
+request_duration = Histogram("spatial_api_request_duration_seconds",
+                             "Time spent handling API requests", ("endpoint", "method", "status"))
+
+
+class _StageTimer:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe_stage(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(stage):
+    """Context manager recording how long its block took under stage; a no-op when disabled"""
+    if not METRICS_ENABLED:
+        return _NULL_TIMER
+    return _StageTimer(stage)
+
+
+def observe_stage(stage, seconds):
+    if METRICS_ENABLED:
+        if METRICS_DIR is not None and _flusher_pid != os.getpid():
+            _start_flusher()
+        stage_duration.observe(seconds, stage)
+
+
+def observe_request(endpoint, method, status, seconds):
+    if METRICS_ENABLED:
+        if METRICS_DIR is not None and _flusher_pid != os.getpid():
+            _start_flusher()
+        request_duration.observe(seconds, endpoint, method, status)
+
+
+_HISTOGRAMS = (stage_duration, request_duration)
+
+# Multi-process aggregation: each process owns one '<pid>-<start>.json' file in METRICS_DIR, so
+# a recycled pid never overwrites the counts of the process that had it before. Files of exited
+# workers are kept (or folded into the archive) so the totals never go backwards.
+_ARCHIVE_FILE = "archived.json"
+_process_file = None
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _read_series(path):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}  # removed by child_exit meanwhile, or not written completely
+    return {name: {tuple(labels): (counts, total) for labels, counts, total in series}
+            for name, series in data.items()}
+
+
+def _write_series(path, series_by_name):
+    data = {name: [[list(labels), counts, total] for labels, (counts, total) in series.items()]
+            for name, series in series_by_name.items()}
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+    # Readers see either the previous or the new file, never a partial one
+    os.replace(temp_path, path)
+
+
+def flush_process_metrics():
+    """Write this process's histograms to METRICS_DIR for the other workers' /metrics"""
+    if METRICS_DIR is None or _process_file is None:
+        return
+    try:
+        _write_series(os.path.join(METRICS_DIR, _process_file), {h.name: h.snapshot() for h in _HISTOGRAMS})
+    except OSError as e:
+        print(f"Error writing metrics to {METRICS_DIR}: {e}")
+
+
+def _flush_forever():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush_process_metrics()
+
+
+def _start_flusher():
+    # Started by the first observation in each process, so forked workers get their own thread
+    global _process_file, _flusher_pid
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        _process_file = f"{_flusher_pid}-{time.time_ns()}.json"
+        threading.Thread(target=_flush_forever, name="metrics-flush", daemon=True).start()
+
+
+def _aggregated_series():
+    """Histogram series summed over this process (live) and every file in METRICS_DIR"""
+    merged = {h.name: h.snapshot() for h in _HISTOGRAMS}
+    try:
+        filenames = os.listdir(METRICS_DIR)
+    except OSError as e:
+        print(f"Error reading metrics from {METRICS_DIR}: {e}")
+        return merged
+    for filename in filenames:
+        if not filename.endswith(".json") or filename == _process_file:
+            continue
+        files_series = _read_series(os.path.join(METRICS_DIR, filename))
+        for histogram in _HISTOGRAMS:
+            histogram.merge(merged[histogram.name], files_series.get(histogram.name, {}))
+    return merged
+
+
+def mark_process_dead(pid):
+    """Fold the files of an exited worker into the archive; call from the server's master only.
+
+    Optional: files of exited workers are summed either way, this keeps METRICS_DIR from
+    growing with every worker restart.
+    """
+    if METRICS_DIR is None:
+        return
+    prefix = f"{pid}-"
+    paths = [os.path.join(METRICS_DIR, name) for name in os.listdir(METRICS_DIR)
+             if name.startswith(prefix) and name.endswith(".json")]
+    if not paths:
+        return
+    archive_path = os.path.join(METRICS_DIR, _ARCHIVE_FILE)
+    archived = _read_series(archive_path)
+    for path in paths:
+        files_series = _read_series(path)
+        for histogram in _HISTOGRAMS:
+            histogram.merge(archived.setdefault(histogram.name, {}), files_series.get(histogram.name, {}))
+    _write_series(archive_path, archived)
+    for path in paths:
+        os.remove(path)
+
+
+def clear_process_metrics():
+    """Empty METRICS_DIR before a server starts, so totals of a previous run are not carried over"""
+    if METRICS_DIR is None:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith((".json", ".json.tmp")):
+            os.remove(os.path.join(METRICS_DIR, name))
+
+
+# Numeric values of CircuitBreaker states for the spatial_circuit_state gauge
+_CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def render_metrics(pool_stats=(), cache_stats=None, breaker_stats=()):
+    """Render all metrics in the Prometheus text exposition format.
+
+    pool_stats is a list of ConnectionPool.stats()-shaped dicts, cache_stats the
+    dict returned by spatial_cache.cache_stats(), breaker_stats a list of
+    CircuitBreaker.stats() dicts. With METRICS_DIR set the histograms are summed over all
+    worker processes; the gauges and cache counters always describe the answering process.
+    """
+    if METRICS_DIR is None:
+        lines = stage_duration.render() + request_duration.render()
+    else:
+        series = _aggregated_series()
+        lines = [line for histogram in _HISTOGRAMS for line in histogram.render(series[histogram.name])]
+
+    pool_stats = list(pool_stats)
+    for field, documentation in (("in_use", "Connections checked out of the pool"),
+                                 ("idle", "Open connections waiting in the pool"),
+                                 ("max_size", "Maximum number of connections in the pool")):
+        lines += _gauge(f"spatial_db_pool_{field}", documentation,
+                        [((("pool", stats["name"]),), stats[field]) for stats in pool_stats])
+
+    breaker_stats = list(breaker_stats)
+    if breaker_stats:
+        lines += _gauge("spatial_circuit_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open",
+                        [((("circuit", stats["name"]),), _CIRCUIT_STATES[stats["state"]]) for stats in breaker_stats])
+        for field, documentation in (("opened_total", "Times the circuit opened"),
+                                     ("rejected_total", "Calls failed fast while the circuit was open")):
+            lines += _gauge(f"spatial_circuit_{field}", documentation,
+                            [((("circuit", stats["name"]),), stats[field]) for stats in breaker_stats], "counter")
+
+    if cache_stats is not None:
+        caches = [cache_stats[name] for name in ("geometry", "attributes")]
+        lines += _gauge("spatial_cache_enabled", "Whether the combined data cache is enabled",
+                        [((), int(cache_stats["enabled"]))])
+        for field, documentation in (("hits", "Cache lookups answered from the cache"),
+                                     ("misses", "Cache lookups that went to the database"),
+                                     ("evictions", "Entries evicted to stay within max_entries"),
+                                     ("expirations", "Entries dropped after their TTL")):
+            lines += _gauge(f"spatial_cache_{field}_total", documentation,
+                            [((("cache", stats["name"]),), stats[field]) for stats in caches], "counter")
+        lines += _gauge("spatial_cache_hit_ratio", "Share of cache lookups answered from the cache",
+                        [((("cache", stats["name"]),), stats["hit_ratio"]) for stats in caches])
+        lines += _gauge("spatial_cache_size", "Entries currently held by the cache",
+                        [((("cache", stats["name"]),), stats["size"]) for stats in caches])
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,24 @@
+-- Replace the overlapping spatial_attributes indexes with one covering unique index.
+--
+-- Every lookup filters on (spatial_id, zoom_level), so idx_spatial_id, idx_zoom_level
+-- and idx_spatial_id_zoom only duplicate the unique constraint added by
+-- add_unique_constraint.sql while slowing down every upsert. The replacement
+-- constraint INCLUDEs updated_at so version checks are answered by index-only scans.
+-- attributes is deliberately not included: large JSONB documents would exceed the
+-- B-tree row size limit and make upserts fail.
+
+BEGIN;
+
+ALTER TABLE spatial_attributes DROP CONSTRAINT IF EXISTS spatial_attributes_unique_spatial_id_zoom;
+DROP INDEX IF EXISTS idx_spatial_id;
+DROP INDEX IF EXISTS idx_zoom_level;
+DROP INDEX IF EXISTS idx_spatial_id_zoom;
+
+-- Also serves as the arbiter for ON CONFLICT (spatial_id, zoom_level)
+ALTER TABLE spatial_attributes ADD CONSTRAINT spatial_attributes_spatial_id_zoom_key
+    UNIQUE (spatial_id, zoom_level) INCLUDE (updated_at);
+
+COMMIT;
+
+-- Refresh statistics and the visibility map so index-only scans can skip the heap
+VACUUM ANALYZE spatial_attributes;
@@ -1,6 +1,9 @@
 import psycopg2
 import json
-from query_spatial_data import connect_to_postgis_db, connect_to_attributes_db, query_postgis_data, query_attributes_data, get_combined_data
+from query_spatial_data import (connect_to_postgis_db, connect_to_attributes_db, query_postgis_data, query_attributes_data,
+                                get_combined_data, fetch_attributes_rows, iter_postgis_rows, invalidate_attributes,
+                                upsert_attributes_batch)
+import serialization
 
 class MRAuthoringSystem:
     def __init__(self):
@@ -51,16 +54,25 @@ class MRAuthoringSystem:
             query = """INSERT INTO spatial_attributes (spatial_id, zoom_level, attributes)
                       VALUES (%s, %s, %s)
                       ON CONFLICT (spatial_id, zoom_level) 
-                      DO UPDATE SET attributes = %s, updated_at = CURRENT_TIMESTAMP"""
-            cursor.execute(query, (spatial_id, zoom_level, json.dumps(attributes), json.dumps(attributes)))
+                      DO UPDATE SET attributes = EXCLUDED.attributes, updated_at = CURRENT_TIMESTAMP"""
+            cursor.execute(query, (spatial_id, zoom_level, serialization.dumps(attributes)))
             self.attributes_conn.commit()
             cursor.close()
+            invalidate_attributes(spatial_id, zoom_level)
             return True
         except Exception as e:
             print(f"Error saving attributes: {e}")
             self.attributes_conn.rollback()
             return False
     
+    def save_mr_attributes_batch(self, items):
+        """Save many MR attribute documents in a single transaction.
+        
+        items is a list of {"spatial_id", "zoom_level", "attributes"} dicts;
+        returns one success report per item.
+        """
+        return upsert_attributes_batch(items, conn=self.attributes_conn)
+    
     def get_combined_mr_data(self, spatial_id, zoom_level):
         """Get combined spatial and MR attribute data"""
         # Use the get_combined_data function which handles both databases
@@ -74,16 +86,43 @@ class MRAuthoringSystem:
             "mr_attributes": combined_data.get("attributes") or {}
         }
     
-    def get_viewport_data(self, viewport_spatial_ids, zoom_level):
-        """Get data for multiple spatial IDs in a viewport"""
-        results = []
+    def iter_viewport_data(self, viewport_spatial_ids, zoom_level):
+        """Stream data for multiple spatial IDs in a viewport.
         
-        for spatial_id in viewport_spatial_ids:
-            data = self.get_combined_mr_data(spatial_id, zoom_level)
-            if data["geometry"] is not None:  # Only include if geometry exists
-                results.append(data)
+        Attributes for the whole viewport are loaded with one query, then the
+        geometries are streamed from PostGIS through a server-side cursor and
+        each record is yielded as soon as it is joined, in database order.
+        """
+        spatial_ids = list(dict.fromkeys(viewport_spatial_ids))
+        if not spatial_ids:
+            return
+        
+        try:
+            attributes = fetch_attributes_rows(spatial_ids, zoom_level, conn=self.attributes_conn)
+        finally:
+            # End the read transaction so the connection is not left idle in transaction
+            self.attributes_conn.rollback()
         
-        return results
+        try:
+            for spatial_id, postgis_data in iter_postgis_rows(self.postgis_conn, spatial_ids, zoom_level):
+                if postgis_data["geometry"] is None:  # Only include if geometry exists
+                    continue
+                yield {
+                    "spatial_id": spatial_id,
+                    "zoom_level": zoom_level,
+                    "geometry": postgis_data["geometry"],
+                    "mr_attributes": attributes.get(spatial_id) or {}
+                }
+        finally:
+            self.postgis_conn.rollback()
+    
+    def get_viewport_data(self, viewport_spatial_ids, zoom_level):
+        """Get data for multiple spatial IDs in a viewport"""
+        try:
+            return list(self.iter_viewport_data(viewport_spatial_ids, zoom_level))
+        except Exception as e:
+            print(f"Error querying viewport data: {e}")
+            return []
 
 # Example usage for MR Authoring
 def main():
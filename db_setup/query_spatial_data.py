@@ -1,16 +1,163 @@
+import argparse
 import psycopg2
+from psycopg2.extras import execute_values, register_default_json, register_default_jsonb
 import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
+from functools import partial
+
+# Make sibling modules importable both as a script and as db_setup.query_spatial_data
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from connection_pool import PoolError, get_pool, reset_pools_after_fork, close_all_pools
+from circuit_breaker import CLOSED, CircuitBreaker, CircuitOpenError
+from metrics import timed, flush_process_metrics
+import spatial_cache
+from spatial_cache import (MISS, geometry_cache, geometry_fallback, attributes_cache, attributes_versions,
+                           invalidate_attributes)
+from tile_cache import tile_cache, set_bounds_lookup, TILE_CACHE_ENABLED
+from change_feed import ChangeFeed
+from spatial_id import MAX_ZOOM, SpatialID, parse_spatial_id
+from geometry_encoding import DEFAULT_GEOMETRY_FORMAT, GEOMETRY_FORMATS, geometry_sql, decode_geometry, simplify_tolerance
+import serialization
+from serialization import RawJSON, decode_raw
+
+logger = logging.getLogger(__name__)
+
+# Connection settings for the PostGIS database (remote)
+POSTGIS_DB_CONFIG = {
+    "host": os.environ.get("SPATIAL_POSTGIS_HOST", "1337.tlab.cloud"),
+    "port": os.environ.get("SPATIAL_POSTGIS_PORT", "1337"),
+    "database": os.environ.get("SPATIAL_POSTGIS_DATABASE", "spatial_id_db"),
+    "user": os.environ.get("SPATIAL_POSTGIS_USER", "postgres"),
+    "password": os.environ.get("SPATIAL_POSTGIS_PASSWORD", "tlab")
+}
+
+# Connection settings for the attributes database (local)
+ATTRIBUTES_DB_CONFIG = {
+    "host": os.environ.get("SPATIAL_ATTRIBUTES_HOST", "localhost"),  # Local PostgreSQL server
+    "port": os.environ.get("SPATIAL_ATTRIBUTES_PORT", "5432"),      # Default PostgreSQL port
+    "database": os.environ.get("SPATIAL_ATTRIBUTES_DATABASE", "spatial_attributes_db"),
+    "user": os.environ.get("SPATIAL_ATTRIBUTES_USER", "postgres"),  # Default PostgreSQL username
+    "password": os.environ.get("SPATIAL_ATTRIBUTES_PASSWORD", "admin")  # Password we confirmed works
+}
+
+# Pool sizing, shared by both databases; override through the environment
+POOL_MIN_SIZE = int(os.environ.get("SPATIAL_DB_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.environ.get("SPATIAL_DB_POOL_MAX_SIZE", "10"))
+POOL_CHECKOUT_TIMEOUT = float(os.environ.get("SPATIAL_DB_POOL_CHECKOUT_TIMEOUT", "10"))
+POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get("SPATIAL_DB_POOL_HEALTH_CHECK_INTERVAL", "30"))
+
+# Fan-out of combined lookups: bounded worker threads and per-leg timeouts in seconds
+FANOUT_MAX_WORKERS = int(os.environ.get("SPATIAL_DB_FANOUT_MAX_WORKERS", str(2 * POOL_MAX_SIZE)))
+POSTGIS_QUERY_TIMEOUT = float(os.environ.get("SPATIAL_DB_POSTGIS_TIMEOUT", "10"))
+ATTRIBUTES_QUERY_TIMEOUT = float(os.environ.get("SPATIAL_DB_ATTRIBUTES_TIMEOUT", "5"))
+
+# Bounds on the remote PostGIS server: connection attempts give up after
+# SPATIAL_DB_POSTGIS_CONNECT_TIMEOUT seconds (libpq rounds up to at least 2) and the server
+# cancels statements running longer than the PostGIS leg timeout. TCP keepalives notice a
+# dead link on idle pooled connections.
+POSTGIS_CONNECT_TIMEOUT = int(os.environ.get("SPATIAL_DB_POSTGIS_CONNECT_TIMEOUT", "3"))
+POSTGIS_CONNECT_OPTIONS = {
+    "connect_timeout": POSTGIS_CONNECT_TIMEOUT,
+    "options": f"-c statement_timeout={int(POSTGIS_QUERY_TIMEOUT * 1000)}",
+    "keepalives": 1,
+    "keepalives_idle": 30,
+    "keepalives_interval": 10,
+    "keepalives_count": 3,
+}
+
+# Circuit breaker around PostGIS: after SPATIAL_DB_POSTGIS_BREAKER_THRESHOLD consecutive
+# connection failures or timeouts, PostGIS calls fail at once for
+# SPATIAL_DB_POSTGIS_BREAKER_RESET seconds, then a single probe decides whether to resume
+POSTGIS_BREAKER_THRESHOLD = int(os.environ.get("SPATIAL_DB_POSTGIS_BREAKER_THRESHOLD", "5"))
+POSTGIS_BREAKER_RESET = float(os.environ.get("SPATIAL_DB_POSTGIS_BREAKER_RESET", "30"))
+
+# Degraded mode: while PostGIS is unavailable, geometry lookups are answered from the replica
+# below when one is configured, else from the last known geometry (geometry_fallback), and
+# flagged "degraded"; attributes are served as usual
+POSTGIS_DEGRADED_MODE = os.environ.get("SPATIAL_DB_POSTGIS_DEGRADED_MODE", "1") not in ("0", "false", "False")
+
+# Optional read replica (or local copy) of bldg_spatial_ids for degraded mode; unset
+# settings default to those of the primary
+POSTGIS_REPLICA_DB_CONFIG = None
+if os.environ.get("SPATIAL_POSTGIS_REPLICA_HOST"):
+    POSTGIS_REPLICA_DB_CONFIG = {
+        "host": os.environ["SPATIAL_POSTGIS_REPLICA_HOST"],
+        "port": os.environ.get("SPATIAL_POSTGIS_REPLICA_PORT", POSTGIS_DB_CONFIG["port"]),
+        "database": os.environ.get("SPATIAL_POSTGIS_REPLICA_DATABASE", POSTGIS_DB_CONFIG["database"]),
+        "user": os.environ.get("SPATIAL_POSTGIS_REPLICA_USER", POSTGIS_DB_CONFIG["user"]),
+        "password": os.environ.get("SPATIAL_POSTGIS_REPLICA_PASSWORD", POSTGIS_DB_CONFIG["password"])
+    }
+
+# Column of bldg_spatial_ids holding the zoom level (e.g. "zoom_level" for the mock
+# spatial_data layout). Leave empty when the zoom is encoded in the spatial ID itself,
+# as in the remote bldg_spatial_ids table, and no column filter is applied.
+POSTGIS_ZOOM_COLUMN = os.environ.get("SPATIAL_DB_POSTGIS_ZOOM_COLUMN", "")
+if POSTGIS_ZOOM_COLUMN and not re.match(r'^[a-z_][a-z0-9_]*$', POSTGIS_ZOOM_COLUMN):
+    raise ValueError(f"Invalid SPATIAL_DB_POSTGIS_ZOOM_COLUMN: {POSTGIS_ZOOM_COLUMN!r}")
+
+# How combined lookups join the two databases:
+#   fanout - query both databases concurrently and merge in Python (default)
+#   fdw    - one query on the attributes database joining the postgres_fdw foreign table
+#            <FDW_SCHEMA>.bldg_spatial_ids (see setup_postgis_fdw.sql)
+JOIN_STRATEGIES = ("fanout", "fdw")
+JOIN_STRATEGY = os.environ.get("SPATIAL_DB_JOIN_STRATEGY", "fanout")
+if JOIN_STRATEGY not in JOIN_STRATEGIES:
+    raise ValueError(f"Invalid SPATIAL_DB_JOIN_STRATEGY: {JOIN_STRATEGY!r}")
+FDW_SCHEMA = os.environ.get("SPATIAL_DB_FDW_SCHEMA", "remote")
+if not re.match(r'^[a-z_][a-z0-9_]*$', FDW_SCHEMA):
+    raise ValueError(f"Invalid SPATIAL_DB_FDW_SCHEMA: {FDW_SCHEMA!r}")
+
+# SRID of bldg_spatial_ids.geom, used to build bounding-box envelopes
+POSTGIS_GEOMETRY_SRID = int(os.environ.get("SPATIAL_DB_GEOMETRY_SRID", "4326"))
+
+# Rows fetched per round trip when streaming through server-side cursors
+STREAM_ITERSIZE = int(os.environ.get("SPATIAL_DB_STREAM_ITERSIZE", "200"))
+
+# Optional file of spatial IDs (one per line) loaded into the cache when a worker starts
+CACHE_WARM_IDS_FILE = os.environ.get("SPATIAL_CACHE_WARM_IDS_FILE", "")
+CACHE_WARM_ZOOM_LEVEL = int(os.environ.get("SPATIAL_CACHE_WARM_ZOOM_LEVEL", "25"))
+
+# Decode json/jsonb columns with the configured serializer (orjson when installed)
+register_default_json(loads=serialization.loads, globally=True)
+register_default_jsonb(loads=serialization.loads, globally=True)
+
+def _new_fanout_executor():
+    return ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix="spatial-fanout")
+
+_fanout_executor = _new_fanout_executor()
+
+# Connection failures and statement timeouts from the remote server count against the PostGIS
+# circuit. SQL errors mean the server answered, and a PoolError (no free connection in this
+# process's pool) is local load: counting it would let a burst of requests open the circuit.
+def _postgis_failure(e):
+    return isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+# Errors that leave a request without PostGIS data, answered from the fallback in degraded mode:
+# remote failures, calls rejected by the open circuit, and no free pooled connection
+def _postgis_unavailable(e):
+    return _postgis_failure(e) or isinstance(e, (PoolError, CircuitOpenError))
+
+# Through postgres_fdw, only connection errors (SQLSTATE class 08) and cancelled statements
+# point at the remote server; anything else comes from the attributes database itself
+def _fdw_remote_failure(e):
+    return (isinstance(e, psycopg2.extensions.QueryCanceledError)
+            or (getattr(e, "pgcode", None) or "").startswith("08"))
+
+postgis_breaker = CircuitBreaker("postgis", POSTGIS_BREAKER_THRESHOLD, POSTGIS_BREAKER_RESET,
+                                 is_failure=_postgis_failure)
 
 # Function to connect to the PostGIS database (using remote database)
 def connect_to_postgis_db():
     try:
-        conn = psycopg2.connect(
-            host="1337.tlab.cloud",
-            port="1337",
-            database="spatial_id_db",
-            user="postgres",
-            password="tlab"
-        )
+        with postgis_breaker.guard():
+            conn = psycopg2.connect(**POSTGIS_DB_CONFIG, **POSTGIS_CONNECT_OPTIONS)
         return conn
     except Exception as e:
         print(f"Error connecting to PostGIS database: {e}")
@@ -19,131 +166,1301 @@ def connect_to_postgis_db():
 # Function to connect to the attributes database
 def connect_to_attributes_db():
     try:
-        conn = psycopg2.connect(
-            host="localhost",  # Local PostgreSQL server
-            port="5432",      # Default PostgreSQL port
-            database="spatial_attributes_db",
-            user="postgres",  # Default PostgreSQL username
-            password="admin"  # Password we confirmed works
-        )
+        conn = psycopg2.connect(**ATTRIBUTES_DB_CONFIG)
         return conn
     except Exception as e:
         print(f"Error connecting to attributes database: {e}")
         return None
 
-# Function to query spatial data from PostGIS
-def query_postgis_data(spatial_id, zoom_level=None):
-    conn = connect_to_postgis_db()
-    if not conn:
-        return None
-    
+def _pool_options():
+    return {
+        "min_size": POOL_MIN_SIZE,
+        "max_size": POOL_MAX_SIZE,
+        "checkout_timeout": POOL_CHECKOUT_TIMEOUT,
+        "health_check_interval": POOL_HEALTH_CHECK_INTERVAL
+    }
+
+# Connection pools, created on first use and shared across requests
+def postgis_pool():
+    return get_pool("postgis", dict(POSTGIS_DB_CONFIG, **POSTGIS_CONNECT_OPTIONS), **_pool_options())
+
+def postgis_replica_pool():
+    return get_pool("postgis_replica", dict(POSTGIS_REPLICA_DB_CONFIG, **POSTGIS_CONNECT_OPTIONS), **_pool_options())
+
+def breaker_stats():
+    return [postgis_breaker.stats()]
+
+# Check out a PostGIS connection through the circuit breaker: raises CircuitOpenError at once
+# while the circuit is open, and failures inside the block count against it
+@contextmanager
+def postgis_connection():
+    with postgis_breaker.guard(), postgis_pool().connection() as conn:
+        yield conn
+
+def attributes_pool():
+    return get_pool("attributes", ATTRIBUTES_DB_CONFIG, **_pool_options())
+
+# Return (sql, params) restricting a bldg_spatial_ids query to a zoom level;
+# alias qualifies the column when the query joins other tables
+def _postgis_zoom_clause(zoom_level, alias=None):
+    if not POSTGIS_ZOOM_COLUMN or zoom_level is None:
+        return "", ()
+    column = f"{alias}.{POSTGIS_ZOOM_COLUMN}" if alias else POSTGIS_ZOOM_COLUMN
+    return f" AND {column} = %s", (zoom_level,)
+
+# Digest of the stored geometry and altitude, computed where the row lives. bldg_spatial_ids
+# has no modification time, so this is the geometry part of the HTTP validators.
+def _geometry_version_sql(alias=None):
+    prefix = f"{alias}." if alias else ""
+    return f"md5(ST_AsEWKB({prefix}geom) || convert_to(coalesce({prefix}altitude::text, ''), 'UTF8'))"
+
+def _postgis_row_to_dict(row, geometry_format=DEFAULT_GEOMETRY_FORMAT):
+    data = {"geometry": decode_geometry(row[1], geometry_format), "attributes": row[2], "altitude": row[3]}
+    # Lookup queries also select the geometry version, so cached rows carry their own
+    if len(row) > 4:
+        data["version"] = row[4]
+    return data
+
+# Build the (spatial_id, zoom_level) lookup shared by single, batch and streaming reads
+def _postgis_lookup_query(spatial_ids, zoom_level, geometry_format=DEFAULT_GEOMETRY_FORMAT, tolerance=None):
+    geom_sql, geom_params = geometry_sql(geometry_format, tolerance)
+    zoom_sql, zoom_params = _postgis_zoom_clause(zoom_level)
+    query = f"""SELECT spatial_id, {geom_sql}, attributes, altitude, {_geometry_version_sql()} FROM bldg_spatial_ids 
+              WHERE spatial_id = ANY(%s){zoom_sql}"""
+    return query, geom_params + (list(spatial_ids),) + zoom_params
+
+# Version-only probes behind get_data_version. updated_at is read through timestamptz so the
+# epoch is computed in the session time zone CURRENT_TIMESTAMP was stored in.
+def _geometry_version_query(spatial_id, zoom_level):
+    zoom_sql, zoom_params = _postgis_zoom_clause(zoom_level)
+    query = f"""SELECT {_geometry_version_sql()} FROM bldg_spatial_ids
+              WHERE spatial_id = %s{zoom_sql} LIMIT 1"""
+    return query, (spatial_id,) + zoom_params
+
+_ATTRIBUTES_VERSION_QUERY = """SELECT extract(epoch FROM updated_at::timestamptz)::float8 FROM spatial_attributes
+                             WHERE spatial_id = %s AND zoom_level = %s"""
+
+# Undecoded attributes document that also carries the spatial_attributes.updated_at (epoch
+# seconds) it was read at. Raw reads return these, so a lookup served from the rows or the cache
+# can build its HTTP validators without a separate version probe.
+class VersionedRawJSON(RawJSON):
+    __slots__ = ("updated_at",)
+
+    def __init__(self, raw, updated_at):
+        super().__init__(raw)
+        self.updated_at = updated_at
+
+# Rows served in degraded mode; the read-through helpers never cache them, so fresh data is
+# fetched again as soon as PostGIS is back
+class DegradedRows(dict):
+    pass
+
+def _remember_geometry(rows, zoom_level, geometry_format, tolerance):
+    if not POSTGIS_DEGRADED_MODE or not spatial_cache.CACHE_ENABLED:
+        return
+    key_suffix = _geometry_key_suffix(geometry_format, tolerance)
+    for spatial_id, row in rows.items():
+        geometry_fallback.put((spatial_id, zoom_level) + key_suffix, row)
+
+def _degraded_rows(rows):
+    return DegradedRows((spatial_id, dict(row, degraded=True)) for spatial_id, row in rows.items())
+
+# The last known geometry of the requested IDs; IDs without one are left out, and when none
+# of them has one the original error is raised again
+def _last_known_geometry(spatial_ids, zoom_level, geometry_format, tolerance, error):
+    key_suffix = _geometry_key_suffix(geometry_format, tolerance)
+    rows = {}
+    for spatial_id in spatial_ids:
+        row = geometry_fallback.get((spatial_id, zoom_level) + key_suffix)
+        if row is not MISS and row is not None:
+            rows[spatial_id] = row
+    if not rows:
+        raise error
+    return _degraded_rows(rows)
+
+# Answer a geometry lookup while PostGIS is unavailable: from the replica when one is
+# configured and reachable, else from the last known geometry
+def _fetch_postgis_rows_degraded(spatial_ids, zoom_level, geometry_format, tolerance, error):
+    if POSTGIS_REPLICA_DB_CONFIG is not None:
+        try:
+            with postgis_replica_pool().connection() as conn:
+                cursor = conn.cursor()
+                with timed("postgis_replica"):
+                    cursor.execute(*_postgis_lookup_query(spatial_ids, zoom_level, geometry_format, tolerance))
+                    rows = {row[0]: _postgis_row_to_dict(row, geometry_format) for row in cursor.fetchall()}
+                cursor.close()
+            return _degraded_rows(rows)
+        except Exception as e:
+            print(f"Error querying PostGIS replica: {e}")
+    return _last_known_geometry(spatial_ids, zoom_level, geometry_format, tolerance, error)
+
+# Fetch PostGIS rows for many spatial IDs in one query, keyed by spatial ID.
+# geometry_format is one of GEOMETRY_FORMATS; tolerance simplifies the geometry server-side.
+def fetch_postgis_rows(spatial_ids, zoom_level=None, conn=None,
+                       geometry_format=DEFAULT_GEOMETRY_FORMAT, tolerance=None):
+    if not spatial_ids:
+        return {}
+    if conn is None:
+        try:
+            with postgis_connection() as pooled_conn:
+                rows = fetch_postgis_rows(spatial_ids, zoom_level, pooled_conn, geometry_format, tolerance)
+        except Exception as e:
+            if not POSTGIS_DEGRADED_MODE or not _postgis_unavailable(e):
+                raise
+            return _fetch_postgis_rows_degraded(spatial_ids, zoom_level, geometry_format, tolerance, e)
+        _remember_geometry(rows, zoom_level, geometry_format, tolerance)
+        return rows
+
+    cursor = conn.cursor()
+    with timed("postgis"):
+        cursor.execute(*_postgis_lookup_query(spatial_ids, zoom_level, geometry_format, tolerance))
+        rows = {row[0]: _postgis_row_to_dict(row, geometry_format) for row in cursor.fetchall()}
+    cursor.close()
+    return rows
+
+# Stream PostGIS rows for many spatial IDs through a server-side cursor.
+# Yields (spatial_id, row) pairs as they arrive; the caller owns conn and its transaction.
+def iter_postgis_rows(conn, spatial_ids, zoom_level=None, itersize=STREAM_ITERSIZE,
+                      geometry_format=DEFAULT_GEOMETRY_FORMAT, tolerance=None):
+    if not spatial_ids:
+        return
+
+    cursor = conn.cursor(name=f"postgis_stream_{id(conn)}")
+    cursor.itersize = itersize
     try:
-        cursor = conn.cursor()
-        
-        # The remote database has bldg_spatial_ids table
-        query = """SELECT geom, attributes, altitude FROM bldg_spatial_ids 
-                  WHERE spatial_id = %s"""
-        cursor.execute(query, (spatial_id,))
-            
-        result = cursor.fetchone()
+        cursor.execute(*_postgis_lookup_query(spatial_ids, zoom_level, geometry_format, tolerance))
+        for row in cursor:
+            yield row[0], _postgis_row_to_dict(row, geometry_format)
+    finally:
         cursor.close()
-        conn.close()
-        
-        if result:
-            # Return a dictionary with all the data
-            return {
-                "geometry": result[0],  # geom
-                "attributes": result[1],  # attributes (jsonb)
-                "altitude": result[2]  # altitude
-            }
+
+# Fetch attributes for many spatial IDs at one zoom level, keyed by spatial ID.
+# With raw=True the JSONB documents are returned undecoded as VersionedRawJSON, for callers that only
+# forward them.
+def fetch_attributes_rows(spatial_ids, zoom_level, conn=None, raw=False):
+    if not spatial_ids:
+        return {}
+    if conn is None:
+        with attributes_pool().connection() as pooled_conn:
+            return fetch_attributes_rows(spatial_ids, zoom_level, pooled_conn, raw)
+
+    cursor = conn.cursor()
+    if raw:
+        register_default_jsonb(conn_or_curs=cursor, loads=str)
+        query = """SELECT spatial_id, attributes, extract(epoch FROM updated_at::timestamptz)::float8
+                  FROM spatial_attributes WHERE spatial_id = ANY(%s) AND zoom_level = %s"""
+    else:
+        query = """SELECT spatial_id, attributes FROM spatial_attributes 
+                  WHERE spatial_id = ANY(%s) AND zoom_level = %s"""
+    with timed("attributes"):
+        cursor.execute(query, (list(spatial_ids), zoom_level))
+        if raw:
+            rows = {row[0]: VersionedRawJSON(row[1], row[2]) for row in cursor.fetchall()}
         else:
-            return None
+            rows = dict(cursor.fetchall())
+    cursor.close()
+    return rows
+
+# Fetch the PostGIS row for a spatial ID and zoom level; raises on database errors
+def fetch_postgis_row(spatial_id, zoom_level=None, geometry_format=DEFAULT_GEOMETRY_FORMAT, tolerance=None):
+    rows = fetch_postgis_rows([spatial_id], zoom_level, geometry_format=geometry_format, tolerance=tolerance)
+    return rows.get(spatial_id)
+
+# Fetch the attributes for a spatial ID and zoom level; raises on database errors
+def fetch_attributes(spatial_id, zoom_level, raw=False):
+    return fetch_attributes_rows([spatial_id], zoom_level, raw=raw).get(spatial_id)
+
+# Function to query spatial data from PostGIS
+def query_postgis_data(spatial_id, zoom_level=None):
+    try:
+        return fetch_postgis_row(spatial_id, zoom_level)
     except Exception as e:
         print(f"Error querying PostGIS data: {e}")
-        if conn:
-            conn.close()
         return None
 
 # Function to query attributes from the second database
 def query_attributes_data(spatial_id, zoom_level):
-    conn = connect_to_attributes_db()
-    if not conn:
-        return None
-    
     try:
-        cursor = conn.cursor()
-        query = """SELECT attributes FROM spatial_attributes 
-                  WHERE spatial_id = %s AND zoom_level = %s"""
-        cursor.execute(query, (spatial_id, zoom_level))
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
-        if result:
-            return result[0]  # Assuming attributes is the first column
-        return None
+        return fetch_attributes(spatial_id, zoom_level)
     except Exception as e:
         print(f"Error querying attributes data: {e}")
-        if conn:
-            conn.close()
         return None
 
-# Function to insert or update attributes in the second database
-def update_attributes(spatial_id, zoom_level, attributes):
-    conn = connect_to_attributes_db()
-    if not conn:
-        return False
-    
+# Check that a spatial ID exists in PostGIS without fetching its geometry; raises on database errors
+def postgis_record_exists(spatial_id, zoom_level=None):
+    if spatial_cache.CACHE_ENABLED:
+        cached = geometry_cache.get((spatial_id, zoom_level))
+        if cached is not MISS:
+            return cached is not None
+
+    try:
+        with postgis_connection() as conn:
+            cursor = conn.cursor()
+            zoom_sql, zoom_params = _postgis_zoom_clause(zoom_level)
+            with timed("postgis"):
+                cursor.execute(f"SELECT 1 FROM bldg_spatial_ids WHERE spatial_id = %s{zoom_sql} LIMIT 1",
+                               (spatial_id,) + zoom_params)
+                exists = cursor.fetchone() is not None
+            cursor.close()
+    except Exception as e:
+        # In degraded mode, geometry read before the outage still proves the ID exists
+        if (POSTGIS_DEGRADED_MODE and _postgis_unavailable(e)
+                and geometry_fallback.get((spatial_id, zoom_level)) not in (MISS, None)):
+            return True
+        raise
+    return exists
+
+# Insert or update attributes and return the stored document, or None on failure
+def upsert_attributes(spatial_id, zoom_level, attributes):
+    try:
+        with attributes_pool().connection() as conn:
+            cursor = conn.cursor()
+            query = """INSERT INTO spatial_attributes (spatial_id, zoom_level, attributes)
+                      VALUES (%s, %s, %s)
+                      ON CONFLICT (spatial_id, zoom_level) 
+                      DO UPDATE SET attributes = EXCLUDED.attributes, updated_at = CURRENT_TIMESTAMP
+                      RETURNING attributes"""
+            cursor.execute(query, (spatial_id, zoom_level, serialization.dumps(attributes)))
+            stored = cursor.fetchone()[0]
+            conn.commit()
+            cursor.close()
+        invalidate_attributes(spatial_id, zoom_level)
+        return stored
+    except Exception as e:
+        # The pool rolls back the failed transaction when the connection is returned
+        print(f"Error updating attributes: {e}")
+        return None
+
+# Return the subset of spatial IDs that exist in PostGIS, with one query; raises on database errors
+def postgis_existing_ids(spatial_ids, zoom_level=None):
+    if not spatial_ids:
+        return set()
+    with postgis_connection() as conn:
+        cursor = conn.cursor()
+        zoom_sql, zoom_params = _postgis_zoom_clause(zoom_level)
+        with timed("postgis"):
+            cursor.execute(f"SELECT spatial_id FROM bldg_spatial_ids WHERE spatial_id = ANY(%s){zoom_sql}",
+                           (list(spatial_ids),) + zoom_params)
+            existing = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+    return existing
+
+# Upsert many (spatial_id, zoom_level, attributes) items in one statement and one transaction.
+# Returns one {"spatial_id", "zoom_level", "success", "error"?} report per input item.
+def upsert_attributes_batch(items, conn=None):
+    if not items:
+        return []
+    if conn is None:
+        with attributes_pool().connection() as pooled_conn:
+            return upsert_attributes_batch(items, pooled_conn)
+
+    # ON CONFLICT cannot touch the same row twice in one statement, so the last item per key wins
+    rows = {}
+    for item in items:
+        key = (item["spatial_id"], item["zoom_level"])
+        rows[key] = (item["spatial_id"], item["zoom_level"], serialization.dumps(item["attributes"]))
+
+    reports = [{"spatial_id": item["spatial_id"], "zoom_level": item["zoom_level"]} for item in items]
     try:
         cursor = conn.cursor()
         query = """INSERT INTO spatial_attributes (spatial_id, zoom_level, attributes)
-                  VALUES (%s, %s, %s)
+                  VALUES %s
                   ON CONFLICT (spatial_id, zoom_level) 
-                  DO UPDATE SET attributes = %s, updated_at = CURRENT_TIMESTAMP"""
-        cursor.execute(query, (spatial_id, zoom_level, json.dumps(attributes), json.dumps(attributes)))
+                  DO UPDATE SET attributes = EXCLUDED.attributes, updated_at = CURRENT_TIMESTAMP
+                  RETURNING spatial_id, zoom_level"""
+        written = execute_values(cursor, query, list(rows.values()),
+                                 template="(%s, %s, %s::jsonb)", page_size=len(rows), fetch=True)
         conn.commit()
         cursor.close()
-        conn.close()
-        return True
     except Exception as e:
-        print(f"Error updating attributes: {e}")
-        if conn:
+        print(f"Error updating attributes in bulk: {e}")
+        conn.rollback()
+        for report in reports:
+            report["success"] = False
+            report["error"] = "Database error, no items were written"
+        return reports
+
+    written = set(map(tuple, written))
+    for spatial_id, zoom_level in written:
+        invalidate_attributes(spatial_id, zoom_level)
+    for report in reports:
+        report["success"] = (report["spatial_id"], report["zoom_level"]) in written
+        if not report["success"]:
+            report["error"] = "Row was not written"
+    return reports
+
+# Function to insert or update attributes in the second database
+def update_attributes(spatial_id, zoom_level, attributes):
+    return upsert_attributes(spatial_id, zoom_level, attributes) is not None
+
+# Partial updates: "merge" is JSON Merge Patch (RFC 7396), "json-patch" is JSON Patch (RFC 6902)
+PATCH_FORMATS = ("merge", "json-patch")
+_JSON_PATCH_OPS = ("add", "remove", "replace", "move", "copy", "test")
+
+def _parse_json_pointer(pointer):
+    """Split an RFC 6901 JSON pointer into keys; the whole document ("") cannot be targeted"""
+    if not isinstance(pointer, str) or not pointer.startswith("/"):
+        raise ValueError(f"Invalid JSON pointer {pointer!r}, expected a path starting with '/'")
+    return [part.replace("~1", "/").replace("~0", "~") for part in pointer[1:].split("/")]
+
+def _normalize_json_patch(operations):
+    """Validate a JSON Patch and split its pointers into key arrays for jsonb_apply_patch"""
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("A JSON Patch must be a non-empty array of operations")
+    normalized = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get("op") not in _JSON_PATCH_OPS:
+            raise ValueError(f"Operation {index} must be an object with 'op' one of {', '.join(_JSON_PATCH_OPS)}")
+        op = operation["op"]
+        try:
+            item = {"op": op, "path": _parse_json_pointer(operation.get("path"))}
+            if op in ("move", "copy"):
+                item["from"] = _parse_json_pointer(operation.get("from"))
+        except ValueError as e:
+            raise ValueError(f"Operation {index}: {e}") from None
+        if op in ("add", "replace", "test"):
+            if "value" not in operation:
+                raise ValueError(f"Operation {index} ({op}) requires a 'value'")
+            item["value"] = operation["value"]
+        if op == "move" and len(item["path"]) > len(item["from"]) and item["path"][:len(item["from"])] == item["from"]:
+            raise ValueError(f"Operation {index} moves a value into itself")
+        normalized.append(item)
+    return normalized
+
+# Build the single UPDATE applying a patch. Returns (query, document): the query's parameters
+# are the patch document (JSONB), spatial_id, zoom_level and expected_updated_at twice.
+# Raises ValueError for malformed patches, before anything is sent to the database.
+def _patch_update_query(patch_format, patch):
+    if patch_format == "merge":
+        if not isinstance(patch, dict):
+            raise ValueError("A merge patch of attributes must be a JSON object")
+        # Without nested objects or deletions a merge patch is a plain top-level merge
+        if any(value is None or isinstance(value, dict) for value in patch.values()):
+            expression, document = "jsonb_merge_patch(attributes, %s::jsonb)", patch
+        else:
+            expression, document = "attributes || %s::jsonb", patch
+    elif patch_format == "json-patch":
+        expression, document = "jsonb_apply_patch(attributes, %s::jsonb)", _normalize_json_patch(patch)
+    else:
+        raise ValueError(f"Unknown patch format '{patch_format}', expected one of {', '.join(PATCH_FORMATS)}")
+
+    query = f"""UPDATE spatial_attributes SET attributes = {expression}, updated_at = CURRENT_TIMESTAMP
+              WHERE spatial_id = %s AND zoom_level = %s
+              AND (%s::float8 IS NULL OR extract(epoch FROM updated_at::timestamptz)::float8 = %s)
+              RETURNING attributes, extract(epoch FROM updated_at::timestamptz)::float8"""
+    return query, document
+
+# SQLSTATE raised by jsonb_apply_patch when an operation does not apply to the document
+PATCH_FAILED_SQLSTATE = "22023"
+
+# Report for a patch that did not apply: "not_found" when no attributes are stored for the key,
+# otherwise a "conflict" with the current updated_at
+def _patch_failure(current_updated_at, expected_updated_at):
+    if current_updated_at is None:
+        return {"success": False, "error": "not_found", "message": "No attributes are stored for this spatial ID and zoom level"}
+    return {"success": False, "error": "conflict", "updated_at": current_updated_at,
+            "message": f"Attributes were modified since {expected_updated_at}"}
+
+# Apply a merge patch or JSON Patch to stored attributes with one UPDATE, so only the change
+# travels to the database. With expected_updated_at (epoch seconds, as returned here and by
+# get_data_version) the row is only written if nobody else wrote it since.
+# Returns {"success": True, "attributes": RawJSON, "updated_at"} or {"success": False, "error":
+# "not_found" | "conflict" | "patch_failed", "message"}; raises ValueError for malformed patches
+# and on database errors.
+def patch_attributes(spatial_id, zoom_level, patch, patch_format="merge", expected_updated_at=None):
+    query, document = _patch_update_query(patch_format, patch)
+    with attributes_pool().connection() as conn:
+        cursor = conn.cursor()
+        register_default_jsonb(conn_or_curs=cursor, loads=RawJSON)
+        try:
+            cursor.execute(query, (serialization.dumps(document), spatial_id, zoom_level,
+                                   expected_updated_at, expected_updated_at))
+        except psycopg2.DataError as e:
             conn.rollback()
-            conn.close()
-        return False
-
-# Function to get combined data from both databases
-def get_combined_data(spatial_id, zoom_level):
-    postgis_data = query_postgis_data(spatial_id, zoom_level)
-    attributes = query_attributes_data(spatial_id, zoom_level)
-    
-    result = {
-        "spatial_id": spatial_id,
-        "zoom_level": zoom_level,
-        # Only use attributes from the second database, return null if not found
-        "attributes": attributes
+            if e.pgcode != PATCH_FAILED_SQLSTATE:
+                raise
+            return {"success": False, "error": "patch_failed", "message": e.diag.message_primary}
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute(_ATTRIBUTES_VERSION_QUERY, (spatial_id, zoom_level))
+            current = cursor.fetchone()
+            conn.rollback()
+            cursor.close()
+            return _patch_failure(current[0] if current else None, expected_updated_at)
+        conn.commit()
+        cursor.close()
+
+    invalidate_attributes(spatial_id, zoom_level)
+    return {"success": True, "attributes": row[0], "updated_at": row[1]}
+
+# Attribute resolution modes: "exact" only reads the requested key, "nearest" falls back to the
+# closest coarser zoom level with attributes, "merge" overlays every level found
+RESOLVE_MODES = ("exact", "nearest", "merge")
+
+# Keys tried when resolving attributes for (spatial_id, zoom_level), nearest first: the key
+# itself, then each coarser zoom level down to 0. At every level the same spatial ID is tried
+# first, then, for 'z/f/x/y' IDs, the ancestor voxel at that zoom level.
+def _resolution_chain(spatial_id, zoom_level):
+    chain = [(spatial_id, zoom_level)]
+    voxel = parse_spatial_id(spatial_id)
+    for level in range(min(zoom_level, MAX_ZOOM + 1) - 1, -1, -1):
+        chain.append((spatial_id, level))
+        if voxel is not None and level < voxel.z:
+            chain.append((str(voxel.parent(voxel.z - level)), level))
+    return chain
+
+# The chain is passed as two arrays and joined against the unique (spatial_id, zoom_level) index,
+# one index probe per level, in a single round trip
+_RESOLVE_CHAIN_SQL = """FROM unnest(%s::varchar[], %s::int[]) WITH ORDINALITY AS c(spatial_id, zoom_level, depth)
+                      JOIN spatial_attributes a ON a.spatial_id = c.spatial_id AND a.zoom_level = c.zoom_level"""
+
+# The window columns are computed over the whole chain before any LIMIT, so even "nearest"
+# returns the same version _RESOLVE_VERSION_QUERY would
+_RESOLVE_QUERY = f"""SELECT a.spatial_id, a.zoom_level, a.attributes,
+                            extract(epoch FROM a.updated_at::timestamptz)::float8,
+                            max(extract(epoch FROM a.updated_at::timestamptz)::float8) OVER (), count(*) OVER ()
+                     {_RESOLVE_CHAIN_SQL}
+                     ORDER BY c.depth"""
+
+_RESOLVE_VERSION_QUERY = f"""SELECT max(extract(epoch FROM a.updated_at::timestamptz)::float8), count(*)
+                             {_RESOLVE_CHAIN_SQL}"""
+
+def _resolution_params(spatial_id, zoom_level):
+    chain = _resolution_chain(spatial_id, zoom_level)
+    return [key[0] for key in chain], [key[1] for key in chain]
+
+# Shape the rows of _RESOLVE_QUERY (nearest first) into the result of resolve_attributes
+def _resolution_result(rows, mode):
+    if not rows:
+        return None
+    if mode == "nearest":
+        attributes = rows[0][2]
+    else:
+        attributes = {}
+        for row in reversed(rows):
+            document = decode_raw(row[2])
+            if isinstance(document, dict):
+                attributes.update(document)
+    return {
+        "attributes": attributes,
+        "sources": [{"spatial_id": row[0], "zoom_level": row[1]} for row in rows],
+        "updated_at": max(row[3] for row in rows),
+        # (newest updated_at, levels with attributes) along the whole chain, as the version probe reads them
+        "chain_version": (rows[0][4], rows[0][5]),
     }
-    
-    # Handle data from the remote database
-    if postgis_data:
-        result["geometry"] = postgis_data["geometry"]
-        # Add altitude if available
-        if "altitude" in postgis_data:
-            result["altitude"] = postgis_data["altitude"]
-    
+
+def _resolve_query(mode):
+    if mode not in ("nearest", "merge"):
+        raise ValueError(f"Unknown resolution mode '{mode}'")
+    return _RESOLVE_QUERY + (" LIMIT 1" if mode == "nearest" else "")
+
+# Resolve attributes through the zoom hierarchy with one query. "nearest" returns the first
+# document found along the chain, "merge" overlays all of them from the coarsest to the nearest,
+# so top-level keys of finer levels win. Returns {"attributes", "sources": [{"spatial_id",
+# "zoom_level"}, ...] nearest first, "updated_at": newest write among them, "chain_version"}, or
+# None when no level has attributes; raises on database errors.
+def resolve_attributes(spatial_id, zoom_level, mode="nearest"):
+    query = _resolve_query(mode)
+    with attributes_pool().connection() as conn:
+        cursor = conn.cursor()
+        register_default_jsonb(conn_or_curs=cursor, loads=RawJSON)
+        with timed("attributes"):
+            cursor.execute(query, _resolution_params(spatial_id, zoom_level))
+            rows = cursor.fetchall()
+        cursor.close()
+    return _resolution_result(rows, mode)
+
+_ROLLUP_QUERY = """SELECT r.child_count, k.attribute_key, k.value_count, k.numeric_count, k.numeric_sum
+                   FROM spatial_attribute_rollups r
+                   LEFT JOIN spatial_attribute_rollup_keys k USING (parent_spatial_id, zoom_level)
+                   WHERE r.parent_spatial_id = %s AND r.zoom_level = %s
+                   ORDER BY k.attribute_key"""
+
+def _rollup_result(spatial_id, zoom_level, rows):
+    if not rows:
+        return None
+    attributes = {}
+    for _, key, value_count, numeric_count, numeric_sum in rows:
+        if key is None:
+            continue
+        attributes[key] = {
+            "count": value_count,
+            "numeric_count": numeric_count,
+            "sum": numeric_sum if numeric_count else None,
+            "mean": numeric_sum / numeric_count if numeric_count else None,
+        }
+    return {"spatial_id": spatial_id, "zoom_level": zoom_level, "child_count": rows[0][0], "attributes": attributes}
+
+# Aggregated attributes of the child voxels of spatial_id, over children stored at zoom_level,
+# from the rollup tables kept current by create_attribute_rollups.sql. Per attribute key: how many
+# children set it, and the count, sum and mean of its numeric values.
+# Returns {"spatial_id", "zoom_level", "child_count", "attributes"}, or None when no child has
+# attributes; raises on database errors.
+def get_attribute_rollup(spatial_id, zoom_level):
+    with attributes_pool().connection() as conn:
+        cursor = conn.cursor()
+        with timed("attributes"):
+            cursor.execute(_ROLLUP_QUERY, (spatial_id, zoom_level))
+            rows = cursor.fetchall()
+        cursor.close()
+    return _rollup_result(spatial_id, zoom_level, rows)
+
+# Voxels inside a 'z/f/x/y' spatial ID, from one range scan of the tile_key index
+# (create_spatial_tile_keys.sql): a tile and its descendants occupy SpatialID.key_range(), and the
+# floor check keeps those under the same floor (the low 5 key bits are the row's own zoom, so the
+# shift is its depth below the voxel). Pages follow the index order, so each one stops after limit rows.
+_DESCENDANTS_QUERY = """SELECT spatial_id, attributes FROM spatial_attributes
+                        WHERE tile_key BETWEEN %s AND %s
+                          AND (tile_key, tile_floor, spatial_id) > (%s::bigint, %s::int, %s::varchar)
+                          AND tile_floor >> ((tile_key & 31)::int - %s) = %s
+                          AND zoom_level = %s
+                        ORDER BY tile_key, tile_floor, spatial_id
+                        LIMIT %s"""
+
+# Parameters of _DESCENDANTS_QUERY; the cursor is the last spatial ID of the previous page.
+# Raises ValueError for opaque spatial IDs or cursors.
+def _descendants_params(spatial_id, zoom_level, limit, after):
+    voxel = SpatialID.parse(spatial_id)
+    low, high = voxel.key_range()
+    if after is None:
+        position = (low - 1, 0, "")
+    else:
+        last = SpatialID.parse(after)
+        position = (last.tile_key(), last.f, after)
+    # One extra row tells whether another page exists
+    return (low, high) + position + (voxel.z, voxel.f, zoom_level, limit + 1)
+
+def _descendants_result(rows, zoom_level, limit):
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    records = [{"spatial_id": row[0], "zoom_level": zoom_level, "attributes": row[1]} for row in rows]
+    return records, (rows[-1][0] if has_more else None)
+
+# Attributes stored at zoom_level for a 'z/f/x/y' spatial ID and every voxel inside it, in tile key
+# order, paged like query_bbox_data. Returns (records, last_spatial_id), the latter None on the
+# last page; raises ValueError for opaque spatial IDs or cursors, and on database errors.
+def query_descendant_attributes(spatial_id, zoom_level, limit=100, after=None, raw_attributes=False):
+    params = _descendants_params(spatial_id, zoom_level, limit, after)
+    with attributes_pool().connection() as conn:
+        cursor = conn.cursor()
+        if raw_attributes:
+            register_default_jsonb(conn_or_curs=cursor, loads=RawJSON)
+        with timed("attributes"):
+            cursor.execute(_DESCENDANTS_QUERY, params)
+            rows = cursor.fetchall()
+        cursor.close()
+    return _descendants_result(rows, zoom_level, limit)
+
+# Fetch both legs for many spatial IDs with one query on the attributes database, joined with
+# the postgres_fdw foreign table so the spatial_id predicate runs on the remote server.
+# Returns (postgis_rows, attributes_rows) shaped like fetch_postgis_rows and
+# fetch_attributes_rows(raw=True); raises on database errors.
+def fetch_combined_rows_fdw(spatial_ids, zoom_level, geometry_format=DEFAULT_GEOMETRY_FORMAT, tolerance=None):
+    if not spatial_ids:
+        return {}, {}
+
+    geom_sql, geom_params = geometry_sql(geometry_format, tolerance, column="b.geom")
+    zoom_sql, zoom_params = _postgis_zoom_clause(zoom_level, alias="f")
+    # FULL JOIN keeps attribute rows without geometry, as the fan-out path does
+    query = f"""SELECT COALESCE(b.spatial_id, a.spatial_id), b.spatial_id IS NOT NULL, {geom_sql},
+                      b.attributes, b.altitude, {_geometry_version_sql("b")}, a.attributes, a.updated_at
+               FROM (SELECT f.spatial_id, f.geom, f.attributes, f.altitude
+                     FROM {FDW_SCHEMA}.bldg_spatial_ids f
+                     WHERE f.spatial_id = ANY(%s){zoom_sql}) b
+               FULL JOIN (SELECT spatial_id, attributes,
+                                 extract(epoch FROM updated_at::timestamptz)::float8 AS updated_at
+                          FROM spatial_attributes
+                          WHERE spatial_id = ANY(%s) AND zoom_level = %s) a
+               ON a.spatial_id = b.spatial_id"""
+    ids = list(spatial_ids)
+
+    with attributes_pool().connection() as conn:
+        cursor = conn.cursor()
+        register_default_jsonb(conn_or_curs=cursor, loads=RawJSON)
+        # One statement covers both databases, so it gets the longer of the two leg timeouts
+        timeout_ms = int(max(POSTGIS_QUERY_TIMEOUT, ATTRIBUTES_QUERY_TIMEOUT) * 1000)
+        cursor.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+        with timed("fdw"):
+            cursor.execute(query, geom_params + (ids,) + zoom_params + (ids, zoom_level))
+            rows = cursor.fetchall()
+        cursor.close()
+        conn.rollback()
+
+    postgis_rows = {}
+    attributes_rows = {}
+    for spatial_id, found, geometry, postgis_attributes, altitude, version, attributes, updated_at in rows:
+        if found:
+            postgis_rows[spatial_id] = {"geometry": decode_geometry(geometry, geometry_format),
+                                        "attributes": decode_raw(postgis_attributes), "altitude": altitude,
+                                        "version": version}
+        if attributes is not None:
+            attributes_rows[spatial_id] = VersionedRawJSON(attributes.raw, updated_at)
+    return postgis_rows, attributes_rows
+
+# Wait for one leg of a fan-out query until its deadline (a time.monotonic() value), returning
+# (value, error). Legs are waited on one after the other, so deadlines counted from the same
+# start keep the worst case at the longer of the two timeouts rather than their sum.
+def _wait_for_leg(future, deadline, label):
+    try:
+        return future.result(timeout=max(0, deadline - time.monotonic())), None
+    except FuturesTimeoutError:
+        # The query keeps running on its worker; we just stop waiting for it
+        logger.warning("Timed out waiting for %s data", label)
+        return None, "timeout"
+    except CircuitOpenError as e:
+        logger.warning("Skipped %s query: %s", label, e)
+        return None, "unavailable"
+    except Exception as e:
+        logger.error("Error querying %s data: %s", label, e)
+        return None, "error"
+
+def _fetch_and_cache(cache, key, fetch, *args):
+    fetched_at = time.monotonic()
+    value = fetch(*args)
+    if not (isinstance(value, dict) and value.get("degraded")):
+        cache.put(key, value, fetched_at)
+    return value
+
+# Return a future for one leg, resolved immediately on a cache hit
+def _read_through(cache, key, fetch, *args):
+    if not spatial_cache.CACHE_ENABLED:
+        return _fanout_executor.submit(fetch, *args)
+
+    value = cache.get(key)
+    if value is not MISS:
+        future = Future()
+        future.set_result(value)
+        return future
+    return _fanout_executor.submit(_fetch_and_cache, cache, key, fetch, *args)
+
+def _fetch_many_and_cache(cache, cached_rows, missing_ids, zoom_level, fetch_rows, key_suffix):
+    fetched_at = time.monotonic()
+    rows = fetch_rows(missing_ids, zoom_level)
+    if isinstance(rows, DegradedRows):
+        # Neither stale rows nor IDs degraded mode could not answer may be cached
+        rows.update(cached_rows)
+        return rows
+    for spatial_id in missing_ids:
+        # Absent IDs are cached as None so repeated misses stay cheap
+        cache.put((spatial_id, zoom_level) + key_suffix, rows.get(spatial_id), fetched_at)
+    rows.update(cached_rows)
+    return rows
+
+# Batch variant of _read_through: only IDs missing from the cache are queried
+def _read_through_many(cache, spatial_ids, zoom_level, fetch_rows, key_suffix=()):
+    if not spatial_cache.CACHE_ENABLED:
+        return _fanout_executor.submit(fetch_rows, spatial_ids, zoom_level)
+
+    cached_rows = {}
+    missing_ids = []
+    for spatial_id in spatial_ids:
+        value = cache.get((spatial_id, zoom_level) + key_suffix)
+        if value is MISS:
+            missing_ids.append(spatial_id)
+        elif value is not None:
+            cached_rows[spatial_id] = value
+
+    if not missing_ids:
+        future = Future()
+        future.set_result(cached_rows)
+        return future
+    return _fanout_executor.submit(_fetch_many_and_cache, cache, cached_rows, missing_ids, zoom_level,
+                                   fetch_rows, key_suffix)
+
+# Geometry is cached per encoding; the default encoding uses the plain (spatial_id, zoom_level) key
+def _geometry_key_suffix(geometry_format, tolerance):
+    if geometry_format == DEFAULT_GEOMETRY_FORMAT and not tolerance:
+        return ()
+    return (geometry_format, tolerance)
+
+# Resolve a "simplify" request into an ST_SimplifyPreserveTopology tolerance:
+# None/False for none, "auto" (or True) for the zoom level's pixel size, or an explicit number
+def resolve_tolerance(simplify, zoom_level):
+    if simplify in (None, False, "", "none"):
+        return None
+    if simplify in (True, "auto"):
+        return simplify_tolerance(zoom_level, POSTGIS_GEOMETRY_SRID)
+    tolerance = float(simplify)
+    if tolerance < 0:
+        raise ValueError("Simplification tolerance must not be negative")
+    return tolerance or None
+
+# fdw counterpart of the two _read_through_many legs: IDs cached in both caches are answered
+# from memory, the rest with one joined query. Returns (postgis_rows, attributes_rows, errors).
+def _read_through_fdw(spatial_ids, zoom_level, geometry_format, tolerance):
+    key_suffix = _geometry_key_suffix(geometry_format, tolerance)
+    postgis_rows = {}
+    attributes_rows = {}
+    missing_ids = []
+    for spatial_id in spatial_ids:
+        if spatial_cache.CACHE_ENABLED:
+            geometry = geometry_cache.get((spatial_id, zoom_level) + key_suffix)
+            attributes = attributes_cache.get((spatial_id, zoom_level))
+            if geometry is not MISS and attributes is not MISS:
+                if geometry is not None:
+                    postgis_rows[spatial_id] = geometry
+                if attributes is not None:
+                    attributes_rows[spatial_id] = attributes
+                continue
+        missing_ids.append(spatial_id)
+    if not missing_ids:
+        return postgis_rows, attributes_rows, {}
+
+    fetched_at = time.monotonic()
+    try:
+        # The foreign table reaches the same remote server, so its failures feed the PostGIS circuit
+        with postgis_breaker.guard(is_failure=_fdw_remote_failure):
+            fetched_postgis, fetched_attributes = fetch_combined_rows_fdw(missing_ids, zoom_level,
+                                                                          geometry_format, tolerance)
+    except CircuitOpenError as e:
+        print(f"Skipped combined query through postgres_fdw: {e}")
+        return postgis_rows, attributes_rows, {"postgis": "unavailable", "attributes": "unavailable"}
+    except psycopg2.extensions.QueryCanceledError as e:
+        print(f"Timed out querying combined data through postgres_fdw: {e}")
+        return postgis_rows, attributes_rows, {"postgis": "timeout", "attributes": "timeout"}
+    except Exception as e:
+        print(f"Error querying combined data through postgres_fdw: {e}")
+        return postgis_rows, attributes_rows, {"postgis": "error", "attributes": "error"}
+
+    # Keep degraded mode's last known geometry current on this path as well
+    _remember_geometry(fetched_postgis, zoom_level, geometry_format, tolerance)
+    if spatial_cache.CACHE_ENABLED:
+        for spatial_id in missing_ids:
+            geometry_cache.put((spatial_id, zoom_level) + key_suffix, fetched_postgis.get(spatial_id), fetched_at)
+            attributes_cache.put((spatial_id, zoom_level), fetched_attributes.get(spatial_id), fetched_at)
+    postgis_rows.update(fetched_postgis)
+    attributes_rows.update(fetched_attributes)
+    return postgis_rows, attributes_rows, {}
+
+# Validators of a combined result in get_data_version's shape, taken from the rows it was built
+# from: the geometry row's version and the updated_at its attributes document was read at.
+# None when either is unknown.
+def _result_version(postgis_data, attributes):
+    if not postgis_data or "version" not in postgis_data:
+        return None
+    if attributes is not None and not isinstance(attributes, VersionedRawJSON):
+        return None
+    return {"geometry": postgis_data["version"],
+            "attributes_updated_at": attributes.updated_at if attributes is not None else None}
+
+def _leg_errors(postgis_error, attributes_error):
+    return {
+        leg: error for leg, error in (("postgis", postgis_error), ("attributes", attributes_error))
+        if error
+    }
+
+# Fetch the geometry version of a spatial ID, or None if it does not exist; raises on database errors
+def fetch_geometry_version(spatial_id, zoom_level=None):
+    with postgis_connection() as conn:
+        cursor = conn.cursor()
+        with timed("postgis_version"):
+            cursor.execute(*_geometry_version_query(spatial_id, zoom_level))
+            row = cursor.fetchone()
+        cursor.close()
+    return row[0] if row else None
+
+# Return the version of the cached geometry row for a lookup (None if cached as absent), or MISS
+def _cached_geometry_version(spatial_id, zoom_level, geometry_format, tolerance):
+    if not spatial_cache.CACHE_ENABLED:
+        return MISS
+    row = geometry_cache.get((spatial_id, zoom_level) + _geometry_key_suffix(geometry_format, tolerance))
+    if row is MISS or row is None:
+        return row
+    return row.get("version", MISS)
+
+# Record the attributes version a probe saw. Cached attributes are only known to be at least as
+# new as the last probed version, so on any change they are dropped; otherwise a response could
+# pair the new validators with an older cached document.
+def _note_attributes_version(spatial_id, zoom_level, updated_at):
+    if not spatial_cache.CACHE_ENABLED:
+        return
+    key = (spatial_id, zoom_level)
+    if attributes_versions.get(key) != updated_at:
+        attributes_cache.invalidate(key)
+        attributes_versions.put(key, updated_at)
+
+# Validators for a combined lookup, read without fetching the data, for conditional requests (a
+# full fetch returns them as the result's "version"): the geometry version (from
+# the cached row when there is one) and spatial_attributes.updated_at as epoch seconds, which
+# the covering unique index answers with an index-only scan.
+# With a resolve mode other than "exact", the attributes part covers the whole resolution chain:
+# the newest updated_at along it plus the number of levels with attributes ("attributes_sources"),
+# so adding, changing or removing any level changes the version.
+# Returns {"geometry", "attributes_updated_at"}, or None when the spatial ID has no geometry;
+# raises on database errors.
+def get_data_version(spatial_id, zoom_level, geometry_format=DEFAULT_GEOMETRY_FORMAT, tolerance=None,
+                     resolve=None):
+    geometry_version = _cached_geometry_version(spatial_id, zoom_level, geometry_format, tolerance)
+    geometry_future = None
+    if geometry_version is MISS:
+        geometry_future = _fanout_executor.submit(fetch_geometry_version, spatial_id, zoom_level)
+
+    exact = resolve in (None, "exact")
+    with attributes_pool().connection() as conn:
+        cursor = conn.cursor()
+        with timed("attributes_version"):
+            if exact:
+                cursor.execute(_ATTRIBUTES_VERSION_QUERY, (spatial_id, zoom_level))
+            else:
+                cursor.execute(_RESOLVE_VERSION_QUERY, _resolution_params(spatial_id, zoom_level))
+            row = cursor.fetchone()
+        cursor.close()
+    updated_at = row[0] if row else None
+
+    if geometry_future is not None:
+        geometry_version = geometry_future.result(timeout=POSTGIS_QUERY_TIMEOUT)
+    if geometry_version is None:
+        return None
+    if not exact:
+        return {"geometry": geometry_version, "attributes_updated_at": updated_at, "attributes_sources": row[1]}
+    _note_attributes_version(spatial_id, zoom_level, updated_at)
+    return {"geometry": geometry_version, "attributes_updated_at": updated_at}
+
+# Function to get combined data from both databases.
+# The attributes cache holds undecoded documents; raw_attributes=True returns them as RawJSON
+# for callers that only serialize them again (the API), otherwise they are decoded.
+# resolve ("nearest" or "merge", see resolve_attributes) falls back to coarser zoom levels when
+# the exact key has no attributes and adds "attributes_sources"; resolved attributes bypass the
+# cache, since a write to any level of the chain changes them.
+# When geometry was found, "version" holds what get_data_version would return for the same
+# lookup, so callers can set HTTP validators without probing first.
+def get_combined_data(spatial_id, zoom_level, geometry_format=DEFAULT_GEOMETRY_FORMAT, tolerance=None,
+                      raw_attributes=False, join_strategy=None, resolve=None):
+    if resolve in (None, "exact"):
+        resolve = None
+    # While the PostGIS circuit is not closed the fan-out path is used, which can degrade
+    if (join_strategy or JOIN_STRATEGY) == "fdw" and resolve is None and postgis_breaker.state == CLOSED:
+        results, errors = get_combined_data_batch([spatial_id], zoom_level, geometry_format, tolerance,
+                                                  raw_attributes, join_strategy="fdw")
+        result = results[0]
+        if errors:
+            result["partial"] = True
+            result["errors"] = errors
+        return result
+
+    # Query both databases in parallel so latency is max(postgis, attributes);
+    # legs already in the cache are answered without touching the database
+    started = time.monotonic()
+    key = (spatial_id, zoom_level)
+    geometry_key = key + _geometry_key_suffix(geometry_format, tolerance)
+    postgis_future = _read_through(geometry_cache, geometry_key, fetch_postgis_row,
+                                   spatial_id, zoom_level, geometry_format, tolerance)
+    if resolve is None:
+        attributes_future = _read_through(attributes_cache, key, partial(fetch_attributes, raw=True),
+                                          spatial_id, zoom_level)
+    else:
+        attributes_future = _fanout_executor.submit(resolve_attributes, spatial_id, zoom_level, resolve)
+
+    postgis_data, postgis_error = _wait_for_leg(postgis_future, started + POSTGIS_QUERY_TIMEOUT, "PostGIS")
+    attributes, attributes_error = _wait_for_leg(attributes_future, started + ATTRIBUTES_QUERY_TIMEOUT, "attributes")
+
+    with timed("merge"):
+        sources = None
+        if resolve is not None:
+            version = _result_version(postgis_data, None)
+            if version is not None:
+                version["attributes_updated_at"], version["attributes_sources"] = (
+                    attributes["chain_version"] if attributes else (None, 0))
+            sources = attributes["sources"] if attributes else []
+            attributes = attributes["attributes"] if attributes else None
+        else:
+            version = _result_version(postgis_data, attributes)
+        result = {
+            "spatial_id": spatial_id,
+            "zoom_level": zoom_level,
+            # Only use attributes from the second database, return null if not found
+            "attributes": attributes if raw_attributes else decode_raw(attributes)
+        }
+        if sources is not None:
+            result["attributes_sources"] = sources
+
+        # Handle data from the remote database
+        if postgis_data:
+            result["geometry"] = postgis_data["geometry"]
+            # Add altitude if available
+            if "altitude" in postgis_data:
+                result["altitude"] = postgis_data["altitude"]
+            # Geometry came from the replica or the last known copy while PostGIS was unavailable
+            if postgis_data.get("degraded"):
+                result["degraded"] = True
+            if version is not None:
+                result["version"] = version
+
+        # Flag results where a leg failed so callers can tell them from a clean miss
+        if postgis_error or attributes_error:
+            result["partial"] = True
+            result["errors"] = _leg_errors(postgis_error, attributes_error)
+
     return result
 
+# Function to get combined data for many spatial IDs with one query per database,
+# or a single joined query with join_strategy="fdw" (defaults to SPATIAL_DB_JOIN_STRATEGY)
+def get_combined_data_batch(spatial_ids, zoom_level, geometry_format=DEFAULT_GEOMETRY_FORMAT, tolerance=None,
+                            raw_attributes=False, join_strategy=None):
+    # Preserve the caller's order but query each ID only once
+    unique_ids = list(dict.fromkeys(spatial_ids))
+
+    if (join_strategy or JOIN_STRATEGY) == "fdw" and postgis_breaker.state == CLOSED:
+        postgis_rows, attributes_rows, errors = _read_through_fdw(unique_ids, zoom_level, geometry_format, tolerance)
+    else:
+        started = time.monotonic()
+        fetch_geometry = partial(fetch_postgis_rows, geometry_format=geometry_format, tolerance=tolerance)
+        postgis_future = _read_through_many(geometry_cache, unique_ids, zoom_level, fetch_geometry,
+                                            _geometry_key_suffix(geometry_format, tolerance))
+        attributes_future = _read_through_many(attributes_cache, unique_ids, zoom_level,
+                                               partial(fetch_attributes_rows, raw=True))
+
+        postgis_rows, postgis_error = _wait_for_leg(postgis_future, started + POSTGIS_QUERY_TIMEOUT, "PostGIS")
+        attributes_rows, attributes_error = _wait_for_leg(attributes_future, started + ATTRIBUTES_QUERY_TIMEOUT,
+                                                          "attributes")
+        errors = _leg_errors(postgis_error, attributes_error)
+    postgis_rows = postgis_rows or {}
+    attributes_rows = attributes_rows or {}
+
+    with timed("merge"):
+        results = []
+        for spatial_id in unique_ids:
+            attributes = attributes_rows.get(spatial_id)
+            result = {
+                "spatial_id": spatial_id,
+                "zoom_level": zoom_level,
+                "attributes": attributes if raw_attributes else decode_raw(attributes)
+            }
+            postgis_data = postgis_rows.get(spatial_id)
+            if postgis_data:
+                result["geometry"] = postgis_data["geometry"]
+                result["altitude"] = postgis_data["altitude"]
+                if postgis_data.get("degraded"):
+                    result["degraded"] = True
+                version = _result_version(postgis_data, attributes)
+                if version is not None:
+                    result["version"] = version
+            results.append(result)
+
+    return results, errors
+
+# Page through the records whose geometry intersects a bounding box.
+# Uses the GiST index on geom via &&, orders by spatial_id and continues after
+# the `after` spatial ID (keyset pagination). Returns (records, last_spatial_id),
+# where last_spatial_id is None once there are no more pages; raises on database errors.
+def query_bbox_data(min_x, min_y, max_x, max_y, zoom_level, limit=100, after=None,
+                    geometry_format=DEFAULT_GEOMETRY_FORMAT, tolerance=None, raw_attributes=False):
+    with postgis_connection() as conn:
+        cursor = conn.cursor()
+        geom_sql, geom_params = geometry_sql(geometry_format, tolerance)
+        zoom_sql, zoom_params = _postgis_zoom_clause(zoom_level)
+        query = f"""SELECT spatial_id, {geom_sql}, attributes, altitude FROM bldg_spatial_ids 
+                  WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, %s){zoom_sql}
+                  AND (%s::varchar IS NULL OR spatial_id > %s)
+                  ORDER BY spatial_id
+                  LIMIT %s"""
+        # Fetch one extra row to learn whether another page exists
+        with timed("postgis"):
+            cursor.execute(query, geom_params + (min_x, min_y, max_x, max_y, POSTGIS_GEOMETRY_SRID) + zoom_params
+                           + (after, after, limit + 1))
+            rows = cursor.fetchall()
+        cursor.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    attributes = fetch_attributes_rows([row[0] for row in rows], zoom_level, raw=raw_attributes)
+
+    with timed("merge"):
+        records = []
+        for row in rows:
+            postgis_data = _postgis_row_to_dict(row, geometry_format)
+            records.append({
+                "spatial_id": row[0],
+                "zoom_level": zoom_level,
+                "geometry": postgis_data["geometry"],
+                "attributes": attributes.get(row[0]),
+                "altitude": postgis_data["altitude"]
+            })
+
+    return records, (rows[-1][0] if has_more else None)
+
+# Merge PostGIS rows (spatial_id, zoom_or_None, geometry, altitude) with attribute rows
+# (spatial_id, zoom_level, attributes), both sorted by spatial_id, into combined records.
+# Only the attribute rows of the current spatial ID are held in memory.
+def _merge_export_rows(postgis_rows, attribute_rows, zoom_level):
+    attribute_rows = iter(attribute_rows)
+    pending = next(attribute_rows, None)
+    group_id = None
+    group = {}
+
+    for spatial_id, row_zoom, geometry, altitude in postgis_rows:
+        if spatial_id != group_id:
+            # Python compares str by code point, the same order as COLLATE "C" on UTF-8
+            while pending is not None and pending[0] < spatial_id:
+                pending = next(attribute_rows, None)
+            group_id = spatial_id
+            group = {}
+            while pending is not None and pending[0] == spatial_id:
+                group[pending[1]] = pending[2]
+                pending = next(attribute_rows, None)
+
+        if row_zoom is not None:
+            matches = [(row_zoom, group.get(row_zoom))]
+        elif group:
+            # Without a zoom column the geometry is shared by every zoom level with attributes
+            matches = sorted(group.items())
+        else:
+            matches = [(zoom_level, None)]
+
+        for zoom, attributes in matches:
+            yield {
+                "spatial_id": spatial_id,
+                "zoom_level": zoom,
+                "geometry": geometry,
+                "attributes": attributes,
+                "altitude": altitude
+            }
+
+# Stream every combined record, optionally limited to one zoom level and a bounding box
+# (min_x, min_y, max_x, max_y). Both databases are read through server-side cursors in
+# spatial_id order and merge-joined, so memory use does not grow with the table size.
+# Records are dicts shaped like get_combined_data results; raises on database errors.
+def iter_export_records(zoom_level=None, bbox=None, geometry_format=DEFAULT_GEOMETRY_FORMAT, tolerance=None,
+                        raw_attributes=False, itersize=STREAM_ITERSIZE):
+    geom_sql, geom_params = geometry_sql(geometry_format, tolerance)
+    zoom_sql, zoom_params = _postgis_zoom_clause(zoom_level)
+    zoom_column = POSTGIS_ZOOM_COLUMN if POSTGIS_ZOOM_COLUMN else "NULL::integer"
+    bbox_sql, bbox_params = "", ()
+    if bbox is not None:
+        bbox_sql = " AND geom && ST_MakeEnvelope(%s, %s, %s, %s, %s)"
+        bbox_params = tuple(bbox) + (POSTGIS_GEOMETRY_SRID,)
+
+    # COLLATE "C" gives both servers the same byte-wise order regardless of their locales
+    postgis_query = f"""SELECT spatial_id, {zoom_column}, {geom_sql}, altitude FROM bldg_spatial_ids
+                      WHERE TRUE{bbox_sql}{zoom_sql}
+                      ORDER BY spatial_id COLLATE "C", {zoom_column}"""
+    attributes_query = """SELECT spatial_id, zoom_level, attributes FROM spatial_attributes
+                         WHERE (%s::integer IS NULL OR zoom_level = %s)
+                         ORDER BY spatial_id COLLATE "C", zoom_level"""
+
+    with postgis_connection() as postgis_conn, attributes_pool().connection() as attributes_conn:
+        postgis_cursor = postgis_conn.cursor(name=f"export_postgis_{id(postgis_conn)}")
+        postgis_cursor.itersize = itersize
+        attributes_cursor = attributes_conn.cursor(name=f"export_attributes_{id(attributes_conn)}")
+        attributes_cursor.itersize = itersize
+        if raw_attributes:
+            register_default_jsonb(conn_or_curs=attributes_cursor, loads=RawJSON)
+        # The pool rolls back each connection's transaction on return, which also closes
+        # the server-side cursors, whether the stream finished, failed or was abandoned
+        postgis_cursor.execute(postgis_query, geom_params + bbox_params + zoom_params)
+        attributes_cursor.execute(attributes_query, (zoom_level, zoom_level))
+
+        postgis_rows = ((row[0], row[1], decode_geometry(row[2], geometry_format), row[3])
+                        for row in postgis_cursor)
+        yield from _merge_export_rows(postgis_rows, attributes_cursor, zoom_level)
+
+# Stream export records as newline-delimited JSON, grouping lines into chunks of about chunk_size bytes
+def iter_export_ndjson(records, chunk_size=65536):
+    lines = []
+    size = 0
+    for record in records:
+        line = serialization.dumps_bytes(record) + b"\n"
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield b"".join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield b"".join(lines)
+
+# Build a Mapbox Vector Tile for tile z/x/y with one "buildings" layer.
+# Feature properties are the row's spatial_id and altitude merged with its attributes
+# from spatial_attributes at zoom_level; raises on database errors.
+def build_vector_tile(z, x, y, zoom_level):
+    envelope_sql = f"ST_Transform(ST_TileEnvelope(%s, %s, %s), {POSTGIS_GEOMETRY_SRID})"
+
+    with postgis_connection() as conn:
+        cursor = conn.cursor()
+        # Find the features first so their attributes can be fetched from the other database
+        cursor.execute(f"SELECT spatial_id FROM bldg_spatial_ids WHERE geom && {envelope_sql}", (z, x, y))
+        spatial_ids = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    if not spatial_ids:
+        return b""
+
+    # Documents go straight back into the tile query, so they are never decoded
+    attributes = fetch_attributes_rows(spatial_ids, zoom_level, raw=True)
+    ids_with_attributes = list(attributes.keys())
+
+    with postgis_connection() as conn:
+        cursor = conn.cursor()
+        # jsonb columns are expanded into feature properties by ST_AsMVT
+        query = f"""WITH bounds AS (SELECT ST_TileEnvelope(%s, %s, %s) AS geom),
+                  props AS (
+                      SELECT * FROM unnest(%s::varchar[], %s::jsonb[]) AS p(spatial_id, attributes)
+                  ),
+                  features AS (
+                      SELECT ST_AsMVTGeom(ST_Transform(t.geom, 3857), bounds.geom) AS geom,
+                             t.spatial_id, t.altitude, props.attributes
+                      FROM bldg_spatial_ids t
+                      CROSS JOIN bounds
+                      LEFT JOIN props ON props.spatial_id = t.spatial_id
+                      WHERE t.geom && {envelope_sql}
+                  )
+                  SELECT ST_AsMVT(features.*, 'buildings') FROM features"""
+        cursor.execute(query, (z, x, y, ids_with_attributes,
+                               [attributes[sid].raw for sid in ids_with_attributes], z, x, y))
+        tile = cursor.fetchone()[0]
+        cursor.close()
+
+    return bytes(tile) if tile is not None else b""
+
+# Return the vector tile for z/x/y, served from the on-disk tile cache when possible
+def get_vector_tile(z, x, y, zoom_level):
+    if TILE_CACHE_ENABLED:
+        cached = tile_cache.get(zoom_level, z, x, y)
+        if cached is not None:
+            return cached
+
+    built_at = time.time_ns()
+    tile = build_vector_tile(z, x, y, zoom_level)
+    if TILE_CACHE_ENABLED:
+        try:
+            tile_cache.put(zoom_level, z, x, y, tile, built_at)
+        except OSError as e:
+            print(f"Error writing tile {z}/{x}/{y} to the cache: {e}")
+    return tile
+
+# Bounding boxes of the geometry of many spatial IDs, keyed by spatial ID, for bbox
+# subscriptions of the change feed; raises on database errors
+def fetch_postgis_bounds(spatial_ids):
+    if not spatial_ids:
+        return {}
+    with postgis_connection() as conn:
+        cursor = conn.cursor()
+        with timed("postgis"):
+            cursor.execute("""SELECT spatial_id, ST_XMin(extent), ST_YMin(extent), ST_XMax(extent), ST_YMax(extent)
+                              FROM (SELECT spatial_id, ST_Extent(geom) AS extent FROM bldg_spatial_ids
+                                    WHERE spatial_id = ANY(%s) GROUP BY spatial_id) e""",
+                           (list(spatial_ids),))
+            bounds = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+        cursor.close()
+    return bounds
+
+# WGS84 bounds of the geometry of many spatial IDs, keyed by spatial ID, so the tile cache can
+# remove every tile an opaque spatial ID's feature is drawn in when its attributes change. Called
+# by the tile cache's background sweeper, one query per sweep; raises on database errors.
+def fetch_wgs84_bounds(spatial_ids):
+    if not spatial_ids:
+        return {}
+    with postgis_connection() as conn:
+        cursor = conn.cursor()
+        with timed("postgis"):
+            cursor.execute("""SELECT spatial_id, ST_XMin(extent), ST_YMin(extent), ST_XMax(extent), ST_YMax(extent)
+                              FROM (SELECT spatial_id, ST_Extent(ST_Transform(geom, 4326)) AS extent
+                                    FROM bldg_spatial_ids WHERE spatial_id = ANY(%s) GROUP BY spatial_id) e""",
+                           (list(spatial_ids),))
+            bounds = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+        cursor.close()
+    return bounds
+
+if TILE_CACHE_ENABLED:
+    set_bounds_lookup(fetch_wgs84_bounds)
+
+# Attribute changes pushed by the spatial_attributes triggers, shared by every subscriber in the
+# process; the listener starts with the worker (or on the first subscription) and also keeps
+# this process's attributes cache in step with writes made by other processes
+change_feed = ChangeFeed(ATTRIBUTES_DB_CONFIG, partial(fetch_attributes_rows, raw=True), fetch_postgis_bounds)
+
+# Prepare a freshly forked server worker: open its own pools and warm the cache
+def init_worker():
+    global _fanout_executor
+    # Pools and executor threads must not be shared across a fork
+    reset_pools_after_fork()
+    postgis_breaker.reset_after_fork()
+    _fanout_executor = _new_fanout_executor()
+    change_feed.reset_after_fork()
+    change_feed.start()
+
+    for pool in (postgis_pool(), attributes_pool()):
+        pool.warm_up()
+
+    if CACHE_WARM_IDS_FILE and spatial_cache.CACHE_ENABLED:
+        try:
+            with open(CACHE_WARM_IDS_FILE) as f:
+                spatial_ids = [line.strip() for line in f if line.strip()]
+        except OSError as e:
+            print(f"Error reading cache warm-up file: {e}")
+            return
+        # Reuse the batch path, which fills both caches, in chunks of one query per database
+        for start in range(0, len(spatial_ids), 500):
+            get_combined_data_batch(spatial_ids[start:start + 500], CACHE_WARM_ZOOM_LEVEL)
+        print(f"Warmed cache with {len(spatial_ids)} spatial IDs")
+
+# Release a worker's resources once it has stopped accepting requests
+# Called when a worker starts draining: ends open change streams so they do not hold worker
+# threads until the graceful timeout. Works on its own thread, so it is safe in signal handlers.
+def begin_shutdown():
+    threading.Thread(target=change_feed.stop, name="spatial-shutdown", daemon=True).start()
+
+def shutdown_worker():
+    change_feed.stop()
+    _fanout_executor.shutdown(wait=True)
+    if TILE_CACHE_ENABLED:
+        # Tiles of writes still queued for the sweeper would otherwise only expire with the TTL
+        tile_cache.flush()
+    close_all_pools()
+    # Final histogram counts for the other workers' /metrics
+    flush_process_metrics()
+
+def _parse_bbox_arg(value):
+    try:
+        bbox = tuple(float(part) for part in value.split(","))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise argparse.ArgumentTypeError("expected minx,miny,maxx,maxy")
+    return bbox
+
+# Command line export: python db_setup/query_spatial_data.py export [--zoom-level N] [--bbox ...] [--output FILE]
+def export_main(argv):
+    parser = argparse.ArgumentParser(prog="query_spatial_data.py export",
+                                     description="Stream combined spatial and attribute records as NDJSON")
+    parser.add_argument("--zoom-level", type=int, help="only export this zoom level")
+    parser.add_argument("--bbox", type=_parse_bbox_arg, help="only export geometry intersecting minx,miny,maxx,maxy")
+    parser.add_argument("--format", choices=GEOMETRY_FORMATS, default=DEFAULT_GEOMETRY_FORMAT,
+                        help="geometry encoding")
+    parser.add_argument("--simplify", help="'auto' or a simplification tolerance (needs --zoom-level for auto)")
+    parser.add_argument("--output", help="file to write to instead of stdout")
+    args = parser.parse_args(argv)
+
+    tolerance = resolve_tolerance(args.simplify, args.zoom_level if args.zoom_level is not None else 25)
+    count = 0
+
+    def counted(records):
+        nonlocal count
+        for record in records:
+            count += 1
+            yield record
+
+    records = iter_export_records(args.zoom_level, args.bbox, args.format, tolerance, raw_attributes=True)
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    started = time.monotonic()
+    try:
+        for chunk in iter_export_ndjson(counted(records)):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+    print(f"Exported {count} records in {time.monotonic() - started:.1f}s", file=sys.stderr)
+
 # Example usage
 def main():
     # Example spatial ID and zoom level
     spatial_id = "example_spatial_id"
     zoom_level = 10
-    
+
     # Query combined data
     combined_data = get_combined_data(spatial_id, zoom_level)
     print("Combined data:")
     print(json.dumps(combined_data, indent=2))
-    
+
     # Example: Update attributes for a spatial ID
     new_attributes = {
         "name": "Example Location",
@@ -155,17 +1472,20 @@ def main():
             "built_year": 2010
         }
     }
-    
+
     success = update_attributes(spatial_id, zoom_level, new_attributes)
     if success:
         print(f"Successfully updated attributes for {spatial_id} at zoom level {zoom_level}")
     else:
         print(f"Failed to update attributes for {spatial_id} at zoom level {zoom_level}")
-    
+
     # Query again to see the updated data
     updated_data = get_combined_data(spatial_id, zoom_level)
     print("\nUpdated combined data:")
     print(json.dumps(updated_data, indent=2))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if sys.argv[1:2] == ["export"]:
+        export_main(sys.argv[2:])
+    else:
+        main()
\ No newline at end of file
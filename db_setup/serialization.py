@@ -0,0 +1,105 @@
+import datetime
+import decimal
+import json
+import os
+import uuid
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON backend: "auto" uses orjson when it is installed, "json" forces the standard library
+JSON_BACKEND = os.environ.get("SPATIAL_JSON_BACKEND", "auto")
+if JSON_BACKEND not in ("auto", "orjson", "json"):
+    raise ValueError(f"Invalid SPATIAL_JSON_BACKEND '{JSON_BACKEND}', expected auto, orjson or json")
+if JSON_BACKEND == "orjson" and orjson is None:
+    raise ImportError("SPATIAL_JSON_BACKEND=orjson but orjson is not installed")
+
+USE_ORJSON = orjson is not None and JSON_BACKEND != "json"
+
+
+class RawJSON:
+    """An already-encoded JSON document that is embedded verbatim when serialized.
+
+    JSONB read only to be forwarded to a client is wrapped in RawJSON instead of
+    being decoded into Python objects and encoded again. Call decode() for the value.
+    """
+
+    __slots__ = ("raw",)
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def decode(self):
+        return loads(self.raw)
+
+    def __eq__(self, other):
+        return isinstance(other, RawJSON) and self.raw == other.raw
+
+    def __hash__(self):
+        return hash(self.raw)
+
+    def __repr__(self):
+        return f"RawJSON({self.raw!r})"
+
+
+def decode_raw(value):
+    """Return value with a top-level RawJSON decoded; other values are returned as is"""
+    return value.decode() if isinstance(value, RawJSON) else value
+
+
+def _default(obj):
+    # Types psycopg2 hands back that neither backend serializes natively
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return bytes(obj).hex()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if USE_ORJSON:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    # orjson.Fragment (orjson 3.9+) embeds raw JSON without parsing it
+    _Fragment = getattr(orjson, "Fragment", None)
+
+    def _orjson_default(obj):
+        if isinstance(obj, RawJSON):
+            return _Fragment(obj.raw) if _Fragment is not None else orjson.loads(obj.raw)
+        return _default(obj)
+
+    def dumps_bytes(obj):
+        """Serialize obj to compact UTF-8 JSON bytes"""
+        return orjson.dumps(obj, default=_orjson_default, option=_ORJSON_OPTIONS)
+
+    def dumps(obj):
+        """Serialize obj to a compact JSON string"""
+        return orjson.dumps(obj, default=_orjson_default, option=_ORJSON_OPTIONS).decode("utf-8")
+
+    def loads(data):
+        return orjson.loads(data)
+
+else:
+    def _json_default(obj):
+        # The standard library cannot splice raw text into its output, so raw documents are decoded
+        if isinstance(obj, RawJSON):
+            return json.loads(obj.raw)
+        if isinstance(obj, (datetime.date, datetime.time)):
+            return obj.isoformat()
+        if isinstance(obj, uuid.UUID):
+            return str(obj)
+        return _default(obj)
+
+    def dumps(obj):
+        """Serialize obj to a compact JSON string"""
+        return json.dumps(obj, default=_json_default, ensure_ascii=False, separators=(",", ":"))
+
+    def dumps_bytes(obj):
+        """Serialize obj to compact UTF-8 JSON bytes"""
+        return dumps(obj).encode("utf-8")
+
+    def loads(data):
+        return json.loads(data)
@@ -0,0 +1,62 @@
+-- Expose the remote bldg_spatial_ids table in spatial_attributes_db through postgres_fdw,
+-- replacing the dblink-based get_combined_spatial_data function.
+--
+-- Run in spatial_attributes_db (PostGIS must be installed there for the geometry type):
+--   psql -d spatial_attributes_db -f db_setup/setup_postgis_fdw.sql
+-- Point it at a local stand-in instead of the remote server, e.g. the benchmark container:
+--   psql -d spatial_bench -v postgis_host=localhost -v postgis_port=5432 -v postgis_db=spatial_bench \
+--        -v postgis_password=postgres -f db_setup/setup_postgis_fdw.sql
+
+\if :{?postgis_host} \else \set postgis_host 1337.tlab.cloud \endif
+\if :{?postgis_port} \else \set postgis_port 1337 \endif
+\if :{?postgis_db} \else \set postgis_db spatial_id_db \endif
+\if :{?postgis_user} \else \set postgis_user postgres \endif
+\if :{?postgis_password} \else \set postgis_password tlab \endif
+
+CREATE EXTENSION IF NOT EXISTS postgis;
+CREATE EXTENSION IF NOT EXISTS postgres_fdw;
+
+-- One server definition: postgres_fdw keeps its connection open for the life of the
+-- local session, so pooled API connections reuse it instead of connecting per call.
+-- Listing postgis lets its operators and functions (e.g. &&) be pushed to the remote side.
+DROP SERVER IF EXISTS spatial_id_server CASCADE;
+CREATE SERVER spatial_id_server FOREIGN DATA WRAPPER postgres_fdw
+    OPTIONS (host :'postgis_host', port :'postgis_port', dbname :'postgis_db',
+             extensions 'postgis', fetch_size '1000', use_remote_estimate 'true');
+
+CREATE USER MAPPING FOR CURRENT_USER SERVER spatial_id_server
+    OPTIONS (user :'postgis_user', password :'postgis_password');
+
+CREATE SCHEMA IF NOT EXISTS remote;
+IMPORT FOREIGN SCHEMA public LIMIT TO (bldg_spatial_ids) FROM SERVER spatial_id_server INTO remote;
+
+-- Replaces the dblink version, which opened a new remote connection on every call
+DROP FUNCTION IF EXISTS get_combined_spatial_data(VARCHAR, INTEGER);
+
+-- Combined data for one spatial ID in a single query; the spatial_id predicate runs remotely
+CREATE OR REPLACE FUNCTION get_combined_spatial_data(p_spatial_id VARCHAR, p_zoom_level INTEGER)
+RETURNS TABLE (
+    spatial_id VARCHAR,
+    geometry GEOMETRY,
+    attributes JSONB,
+    altitude DOUBLE PRECISION
+) AS $$
+    SELECT b.spatial_id, b.geom, sa.attributes, b.altitude::DOUBLE PRECISION
+    FROM remote.bldg_spatial_ids b
+    LEFT JOIN spatial_attributes sa ON sa.spatial_id = b.spatial_id AND sa.zoom_level = p_zoom_level
+    WHERE b.spatial_id = p_spatial_id;
+$$ LANGUAGE sql STABLE;
+
+-- Batch variant: one remote query for all IDs
+CREATE OR REPLACE FUNCTION get_combined_spatial_data_batch(p_spatial_ids VARCHAR[], p_zoom_level INTEGER)
+RETURNS TABLE (
+    spatial_id VARCHAR,
+    geometry GEOMETRY,
+    attributes JSONB,
+    altitude DOUBLE PRECISION
+) AS $$
+    SELECT b.spatial_id, b.geom, sa.attributes, b.altitude::DOUBLE PRECISION
+    FROM remote.bldg_spatial_ids b
+    LEFT JOIN spatial_attributes sa ON sa.spatial_id = b.spatial_id AND sa.zoom_level = p_zoom_level
+    WHERE b.spatial_id = ANY(p_spatial_ids);
+$$ LANGUAGE sql STABLE;
@@ -11,38 +11,26 @@ CREATE TABLE spatial_attributes (
     zoom_level INTEGER NOT NULL,
     attributes JSONB NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Single covering index for (spatial_id, zoom_level) lookups and ON CONFLICT upserts
+    CONSTRAINT spatial_attributes_spatial_id_zoom_key UNIQUE (spatial_id, zoom_level) INCLUDE (updated_at)
 );
 
--- Create indexes for efficient querying
-CREATE INDEX idx_spatial_id ON spatial_attributes(spatial_id);
-CREATE INDEX idx_zoom_level ON spatial_attributes(zoom_level);
-CREATE INDEX idx_spatial_id_zoom ON spatial_attributes(spatial_id, zoom_level);
-
--- Add extension for dblink (to connect to external PostgreSQL databases)
-CREATE EXTENSION dblink;
-
--- Create a function to query data from both databases
-CREATE OR REPLACE FUNCTION get_combined_spatial_data(p_spatial_id VARCHAR, p_zoom_level INTEGER)
-RETURNS TABLE (
-    spatial_id VARCHAR,
-    geometry JSONB,  -- Assuming geometry is stored as JSONB in the result
-    attributes JSONB
-) AS $$
-BEGIN
-    RETURN QUERY
-    SELECT 
-        p_spatial_id,
-        geometry_data.geometry,
-        sa.attributes
-    FROM 
-        dblink('host=1337.tlab.cloud port=1337 dbname=spatial_id_db user=postgres password=tlab',
-               format('SELECT geometry FROM spatial_data WHERE spatial_id = ''%s'' AND zoom_level = %s', 
-                      p_spatial_id, p_zoom_level))
-        AS geometry_data(geometry JSONB)
-    LEFT JOIN spatial_attributes sa ON sa.spatial_id = p_spatial_id AND sa.zoom_level = p_zoom_level;
-END;
-$$ LANGUAGE plpgsql;
+-- Indexed tile keys of hierarchical spatial IDs; see create_spatial_tile_keys.sql
+\ir create_spatial_tile_keys.sql
+
+-- Remote bldg_spatial_ids is exposed as a foreign table (remote.bldg_spatial_ids) and
+-- get_combined_spatial_data is defined on top of it; see setup_postgis_fdw.sql
+\ir setup_postgis_fdw.sql
+
+-- Notify API processes of attribute writes; see create_change_feed_trigger.sql
+\ir create_change_feed_trigger.sql
+
+-- Server-side JSON Merge Patch / JSON Patch; see create_attribute_patch_functions.sql
+\ir create_attribute_patch_functions.sql
+
+-- Child-attribute rollups per parent voxel; see create_attribute_rollups.sql
+\ir create_attribute_rollups.sql
 
 -- Create a sample insert function
 CREATE OR REPLACE FUNCTION add_spatial_attribute(p_spatial_id VARCHAR, p_zoom_level INTEGER, p_attributes JSONB)
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by TTLCache.get when a key is not cached (None is a valid cached value)
+MISS = object()
+
+# Left in place of invalidated entries so in-flight reads cannot re-cache stale data
+_TOMBSTONE = object()
+
+
+class TTLCache:
+    """Bounded, thread-safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, name, max_entries=10000, ttl=60.0):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, expires_at, stored_at)
+        # Time of the last invalidate_all(); like a tombstone on every key
+        self._invalidated_all_at = float("-inf")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return the cached value for key, or MISS"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is _TOMBSTONE:
+                self.misses += 1
+                return MISS
+            value, expires_at, _ = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISS
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, fetched_at=None):
+        """Cache value for key.
+
+        fetched_at is the monotonic time the value was read from the database;
+        if the key was invalidated after that, the value is stale and dropped.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if fetched_at is not None and fetched_at < self._invalidated_all_at:
+                return
+            entry = self._entries.get(key)
+            if (entry is not None and entry[0] is _TOMBSTONE
+                    and fetched_at is not None and fetched_at < entry[2]):
+                return
+            self._entries[key] = (value, now + self.ttl, now)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def invalidate(self, key):
+        """Drop the cached value for key"""
+        now = time.monotonic()
+        with self._lock:
+            self.invalidations += 1
+            # The tombstone only needs to outlive reads already in flight
+            self._entries[key] = (_TOMBSTONE, now + self.ttl, now)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def invalidate_all(self):
+        """Drop every cached value; values read before now are not cached again"""
+        with self._lock:
+            self.invalidations += sum(1 for value, _, _ in self._entries.values() if value is not _TOMBSTONE)
+            self._entries.clear()
+            self._invalidated_all_at = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self):
+        # Called with the lock held
+        while len(self._entries) > self.max_entries:
+            _, (value, _, _) = self._entries.popitem(last=False)
+            if value is not _TOMBSTONE:
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# Cache settings; override through the environment
+CACHE_ENABLED = os.environ.get("SPATIAL_CACHE_ENABLED", "1") not in ("0", "false", "False")
+CACHE_MAX_ENTRIES = int(os.environ.get("SPATIAL_CACHE_MAX_ENTRIES", "10000"))
+GEOMETRY_CACHE_TTL = float(os.environ.get("SPATIAL_CACHE_GEOMETRY_TTL", "3600"))
+ATTRIBUTES_CACHE_TTL = float(os.environ.get("SPATIAL_CACHE_ATTRIBUTES_TTL", "60"))
+# How long geometry stays available to degraded mode after it was last read from PostGIS
+GEOMETRY_FALLBACK_TTL = float(os.environ.get("SPATIAL_CACHE_GEOMETRY_FALLBACK_TTL", "86400"))
+
+# Process-wide caches keyed by (spatial_id, zoom_level): geometry from bldg_spatial_ids
+# rarely changes, attributes from spatial_attributes are edited by MR sessions
+geometry_cache = TTLCache("geometry", CACHE_MAX_ENTRIES, GEOMETRY_CACHE_TTL)
+attributes_cache = TTLCache("attributes", CACHE_MAX_ENTRIES, ATTRIBUTES_CACHE_TTL)
+
+# Last known geometry per geometry_cache key, kept long after geometry_cache expires it and only
+# read while PostGIS is unavailable (degraded mode in query_spatial_data.py)
+geometry_fallback = TTLCache("geometry_fallback", CACHE_MAX_ENTRIES, GEOMETRY_FALLBACK_TTL)
+
+# Last spatial_attributes.updated_at seen by a conditional GET probe, per (spatial_id, zoom_level)
+attributes_versions = TTLCache("attributes_versions", CACHE_MAX_ENTRIES, ATTRIBUTES_CACHE_TTL)
+
+
+# Callbacks run after attributes are written, for caches derived from them (e.g. vector tiles)
+_invalidation_listeners = []
+_invalidate_all_listeners = []
+
+
+def add_invalidation_listener(callback, invalidate_all=None):
+    """Call callback(spatial_id, zoom_level) whenever attributes for that key are written,
+    and invalidate_all() when any attributes may have changed"""
+    _invalidation_listeners.append(callback)
+    if invalidate_all is not None:
+        _invalidate_all_listeners.append(invalidate_all)
+
+
+def invalidate_attributes(spatial_id, zoom_level):
+    """Drop the cached attributes for a key after they were written"""
+    attributes_cache.invalidate((spatial_id, zoom_level))
+    for callback in _invalidation_listeners:
+        try:
+            callback(spatial_id, zoom_level)
+        except Exception as e:
+            print(f"Error in attributes invalidation listener: {e}")
+
+
+def invalidate_all_attributes():
+    """Drop all cached attributes when writes may have been missed (change feed resync)"""
+    attributes_cache.invalidate_all()
+    for callback in _invalidate_all_listeners:
+        try:
+            callback()
+        except Exception as e:
+            print(f"Error in attributes invalidation listener: {e}")
+
+
+def cache_stats():
+    return {
+        "enabled": CACHE_ENABLED,
+        "geometry": geometry_cache.stats(),
+        "attributes": attributes_cache.stats(),
+    }
@@ -0,0 +1,178 @@
+import math
+
+# Spatial IDs are written 'z/f/x/y': zoom level, vertical (floor) index, and the
+# horizontal x/y tile indices of the Web Mercator grid at that zoom level.
+MAX_ZOOM = 25
+
+# Height of the whole vertical range in metres; one voxel is VERTICAL_EXTENT / 2**z tall
+VERTICAL_EXTENT = 2 ** 25
+
+# Bits reserved for the zoom level in the low end of a tile key
+_ZOOM_BITS = 5
+
+
+def _interleave(x, y):
+    """Interleave the bits of x and y into a Morton (Z-order) code"""
+    code = 0
+    for bit in range(MAX_ZOOM):
+        code |= ((x >> bit) & 1) << (2 * bit + 1)
+        code |= ((y >> bit) & 1) << (2 * bit)
+    return code
+
+
+def _deinterleave(code):
+    x = y = 0
+    for bit in range(MAX_ZOOM):
+        x |= ((code >> (2 * bit + 1)) & 1) << bit
+        y |= ((code >> (2 * bit)) & 1) << bit
+    return x, y
+
+
+class SpatialID:
+    """Parsed 'z/f/x/y' spatial ID voxel"""
+
+    __slots__ = ("z", "f", "x", "y")
+
+    def __init__(self, z, f, x, y):
+        if not 0 <= z <= MAX_ZOOM:
+            raise ValueError(f"Zoom level {z} is outside 0..{MAX_ZOOM}")
+        n = 1 << z
+        if not (0 <= x < n and 0 <= y < n):
+            raise ValueError(f"Tile index ({x}, {y}) is outside the grid at zoom {z}")
+        if not -n <= f < n:
+            raise ValueError(f"Floor index {f} is outside the vertical range at zoom {z}")
+        self.z = z
+        self.f = f
+        self.x = x
+        self.y = y
+
+    @classmethod
+    def parse(cls, spatial_id):
+        """Parse a 'z/f/x/y' string; raises ValueError for anything else"""
+        parts = spatial_id.split("/")
+        if len(parts) != 4:
+            raise ValueError(f"Spatial ID '{spatial_id}' is not in z/f/x/y form")
+        try:
+            z, f, x, y = (int(part) for part in parts)
+        except ValueError:
+            raise ValueError(f"Spatial ID '{spatial_id}' has non-integer components") from None
+        return cls(z, f, x, y)
+
+    @classmethod
+    def from_key(cls, key, f=0):
+        """Rebuild the horizontal tile of a key produced by tile_key (floor is not encoded)"""
+        z = key & ((1 << _ZOOM_BITS) - 1)
+        x, y = _deinterleave(key >> _ZOOM_BITS)
+        shift = MAX_ZOOM - z
+        return cls(z, f, x >> shift, y >> shift)
+
+    def as_tuple(self):
+        return (self.z, self.f, self.x, self.y)
+
+    def __str__(self):
+        return f"{self.z}/{self.f}/{self.x}/{self.y}"
+
+    def __repr__(self):
+        return f"SpatialID('{self}')"
+
+    def __eq__(self, other):
+        if not isinstance(other, SpatialID):
+            return NotImplemented
+        return self.as_tuple() == other.as_tuple()
+
+    def __hash__(self):
+        return hash(self.as_tuple())
+
+    # Hierarchy
+
+    def parent(self, levels=1):
+        """Return the enclosing voxel `levels` zoom levels up"""
+        if levels > self.z:
+            raise ValueError(f"Zoom level {self.z} has no ancestor {levels} levels up")
+        # Arithmetic shifts floor towards -inf, which keeps negative floors in the right parent
+        return SpatialID(self.z - levels, self.f >> levels, self.x >> levels, self.y >> levels)
+
+    def ancestors(self):
+        """Yield every ancestor from the direct parent up to zoom level 0"""
+        for levels in range(1, self.z + 1):
+            yield self.parent(levels)
+
+    def children(self):
+        """Return the eight voxels one zoom level down"""
+        if self.z >= MAX_ZOOM:
+            raise ValueError(f"Zoom level {self.z} has no children")
+        return [
+            SpatialID(self.z + 1, 2 * self.f + df, 2 * self.x + dx, 2 * self.y + dy)
+            for df in (0, 1) for dx in (0, 1) for dy in (0, 1)
+        ]
+
+    def neighbours(self, vertical=True):
+        """Return the adjacent voxels at the same zoom level.
+
+        x wraps around the antimeridian; y and f stop at the edge of the grid.
+        With vertical=False only the eight voxels on the same floor are returned.
+        """
+        n = 1 << self.z
+        floor_offsets = (-1, 0, 1) if vertical else (0,)
+        result = []
+        for df in floor_offsets:
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    if df == dx == dy == 0:
+                        continue
+                    f, y = self.f + df, self.y + dy
+                    if not (-n <= f < n and 0 <= y < n):
+                        continue
+                    result.append(SpatialID(self.z, f, (self.x + dx) % n, y))
+        return result
+
+    # Geometry
+
+    def bounds(self):
+        """Return (min_lon, min_lat, max_lon, max_lat) of the tile in WGS84 degrees"""
+        n = 1 << self.z
+
+        def lat(y):
+            return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+        return (self.x / n * 360.0 - 180.0, lat(self.y + 1),
+                (self.x + 1) / n * 360.0 - 180.0, lat(self.y))
+
+    def altitude_range(self):
+        """Return (min_alt, max_alt) of the voxel in metres"""
+        height = VERTICAL_EXTENT / (1 << self.z)
+        return (self.f * height, (self.f + 1) * height)
+
+    # Sortable keys
+
+    def tile_key(self):
+        """Encode the horizontal tile as a sortable 64-bit integer.
+
+        The x/y indices are scaled to MAX_ZOOM and Morton-interleaved, with the
+        zoom level in the low bits, so a tile sorts directly before all of its
+        descendants and they occupy the contiguous range given by key_range().
+        The floor index is not encoded; store it alongside the key.
+        """
+        shift = MAX_ZOOM - self.z
+        return (_interleave(self.x << shift, self.y << shift) << _ZOOM_BITS) | self.z
+
+    def key_range(self):
+        """Return the (low, high) inclusive tile_key bounds of this tile and its descendants"""
+        shift = MAX_ZOOM - self.z
+        base = _interleave(self.x << shift, self.y << shift)
+        span = 1 << (2 * shift)
+        return ((base << _ZOOM_BITS) | self.z, ((base + span) << _ZOOM_BITS) - 1)
+
+    def contains(self, other):
+        """True if other is this voxel or one of its descendants"""
+        if other.z < self.z:
+            return False
+        return other.parent(other.z - self.z) == self if other.z > self.z else other == self
+
+
+def parse_spatial_id(spatial_id):
+    """Return a SpatialID for hierarchical IDs, or None for opaque ones like 'building1'"""
+    try:
+        return SpatialID.parse(spatial_id)
+    except ValueError:
+        return None
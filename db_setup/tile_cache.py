@@ -0,0 +1,265 @@
+import math
+import os
+import threading
+import time
+
+from spatial_cache import (CACHE_MAX_ENTRIES, GEOMETRY_CACHE_TTL, MISS, TTLCache,
+                           add_invalidation_listener)
+from spatial_id import parse_spatial_id
+
+# Settings for the on-disk vector tile cache; override through the environment
+TILE_CACHE_ENABLED = os.environ.get("SPATIAL_TILE_CACHE_ENABLED", "1") not in ("0", "false", "False")
+TILE_CACHE_DIR = os.environ.get(
+    "SPATIAL_TILE_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tile_cache")
+)
+# Tiles a feature draws outside its voxel, and those of opaque spatial IDs whose geometry could
+# not be located (PostGIS unavailable), are only refreshed when they expire
+TILE_CACHE_TTL = float(os.environ.get("SPATIAL_TILE_CACHE_TTL", "300"))
+
+# Deepest tile zoom that can be cached
+MAX_TILE_ZOOM = 25
+
+# ST_AsMVTGeom keeps geometry up to 256/4096 of a tile outside the tile, so a feature near an
+# edge is also drawn in the neighbouring tile
+_TILE_BUFFER = 256 / 4096
+
+# Latitude limit of the Web Mercator tile grid
+_MAX_LATITUDE = 85.0511287798
+
+# Above this many candidate tiles at one zoom, the cached files are listed instead of each
+# candidate being removed
+_DIRECT_REMOVE_LIMIT = 64
+
+# Written into <directory>/<zoom_level>/ with the time of the last invalidation, in nanoseconds,
+# and into <directory>/ when every tile was invalidated
+_INVALIDATED_FILE = ".invalidated"
+
+
+def _tile_ranges(bounds, z):
+    """Return the (x, y) index ranges of the tiles at zoom z that draw WGS84 bounds"""
+    min_lon, min_lat, max_lon, max_lat = bounds
+    n = 1 << z
+
+    def tile_x(lon):
+        return (lon + 180.0) / 360.0 * n
+
+    def tile_y(lat):
+        lat = math.radians(max(-_MAX_LATITUDE, min(_MAX_LATITUDE, lat)))
+        return (1 - math.asinh(math.tan(lat)) / math.pi) / 2 * n
+
+    # Tile y grows southwards
+    xs = range(max(0, math.floor(tile_x(min_lon) - _TILE_BUFFER)),
+               min(n - 1, math.floor(tile_x(max_lon) + _TILE_BUFFER)) + 1)
+    ys = range(max(0, math.floor(tile_y(max_lat) - _TILE_BUFFER)),
+               min(n - 1, math.floor(tile_y(min_lat) + _TILE_BUFFER)) + 1)
+    return xs, ys
+
+
+class TileCache:
+    """Vector tiles stored on disk as <directory>/<zoom_level>/<z>/<x>/<y>.mvt.
+
+    zoom_level is the attributes zoom level the tile's feature properties were
+    built from. Files are shared by every worker process on the host.
+    """
+
+    def __init__(self, directory, ttl=TILE_CACHE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        # locate(spatial_ids) -> {spatial_id: WGS84 (min_lon, min_lat, max_lon, max_lat)} of the
+        # geometry of opaque spatial IDs; set by the database layer through set_bounds_lookup()
+        self.locate = None
+        # Geometry rarely changes, so repeated writes to an opaque spatial ID look its bounds up once
+        self._bounds = TTLCache("tile_bounds", CACHE_MAX_ENTRIES, GEOMETRY_CACHE_TTL)
+        # (spatial_id, zoom_level) keys written since the last sweep. Writes only queue their key;
+        # a background thread per process removes the tiles, so no write waits on the file system
+        # or on a bounds lookup, and keys written together are swept together.
+        self._pending = set()
+        self._pending_ready = threading.Condition()
+        self._sweeper_pid = None
+
+    def _path(self, zoom_level, z, x, y):
+        return os.path.join(self.directory, str(zoom_level), str(z), str(x), f"{y}.mvt")
+
+    def get(self, zoom_level, z, x, y):
+        """Return the cached tile bytes, or None if missing or expired"""
+        path = self._path(zoom_level, z, x, y)
+        try:
+            if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, zoom_level, z, x, y, data, built_at=None):
+        """Store a tile.
+
+        built_at is the time.time_ns() the tile build started; if tiles of zoom_level were
+        invalidated after that, the tile may hold stale attributes and is dropped.
+        """
+        if self._invalidated_since(zoom_level, built_at):
+            return
+        path = self._path(zoom_level, z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file and rename so readers never see a partial tile
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        # An invalidation between the check above and the rename may have missed this file
+        if self._invalidated_since(zoom_level, built_at):
+            self.invalidate_tile(zoom_level, z, x, y)
+
+    def _invalidated_since(self, zoom_level, built_at):
+        if built_at is None:
+            return False
+        for directory in (os.path.join(self.directory, str(zoom_level)), self.directory):
+            try:
+                with open(os.path.join(directory, _INVALIDATED_FILE)) as f:
+                    if int(f.read() or 0) >= built_at:
+                        return True
+            except (OSError, ValueError):
+                pass
+        return False
+
+    def _mark_invalidated(self, zoom_level=None):
+        # Tombstone for builds in flight, shared with every worker through the file system
+        directory = self.directory if zoom_level is None else os.path.join(self.directory, str(zoom_level))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, _INVALIDATED_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(time.time_ns()))
+        os.replace(tmp_path, path)
+
+    def invalidate_tile(self, zoom_level, z, x, y):
+        try:
+            os.remove(self._path(zoom_level, z, x, y))
+        except OSError:
+            pass
+
+    def _cached_tiles(self, zoom_level, z, ranges):
+        """Yield the (x, y) of cached tiles at zoom z inside any of the (xs, ys) ranges"""
+        z_dir = os.path.join(self.directory, str(zoom_level), str(z))
+        try:
+            x_names = os.listdir(z_dir)
+        except OSError:
+            return
+        for x_name in x_names:
+            if not x_name.isdigit():
+                continue
+            x = int(x_name)
+            y_ranges = [ys for xs, ys in ranges if x in xs]
+            if not y_ranges:
+                continue
+            try:
+                names = os.listdir(os.path.join(z_dir, x_name))
+            except OSError:
+                continue
+            for name in names:
+                y_name, extension = os.path.splitext(name)
+                if extension == ".mvt" and y_name.isdigit() and any(int(y_name) in ys for ys in y_ranges):
+                    yield x, int(y_name)
+
+    def _invalidate_ranges(self, zoom_level, z, ranges):
+        if sum(len(xs) * len(ys) for xs, ys in ranges) <= _DIRECT_REMOVE_LIMIT:
+            for x, y in {(x, y) for xs, ys in ranges for x in xs for y in ys}:
+                self.invalidate_tile(zoom_level, z, x, y)
+            return
+        # Wide ranges at deep zooms, or many keys at once: only cached tiles can be stale, and
+        # there are far fewer
+        for x, y in list(self._cached_tiles(zoom_level, z, ranges)):
+            self.invalidate_tile(zoom_level, z, x, y)
+
+    def _feature_bounds(self, spatial_ids):
+        """WGS84 bounds of each spatial ID's geometry; IDs that cannot be located are left out"""
+        bounds = {}
+        missing = []
+        for spatial_id in spatial_ids:
+            # The geometry of a z/f/x/y ID normally lies within its voxel
+            voxel = parse_spatial_id(spatial_id)
+            if voxel is not None:
+                bounds[spatial_id] = voxel.bounds()
+                continue
+            cached = self._bounds.get(spatial_id)
+            if cached is MISS:
+                missing.append(spatial_id)
+            elif cached is not None:
+                bounds[spatial_id] = cached
+        if missing and self.locate is not None:
+            try:
+                located = self.locate(missing)
+            except Exception as e:
+                print(f"Error locating {len(missing)} spatial IDs for tile invalidation: {e}")
+                return bounds
+            for spatial_id in missing:
+                self._bounds.put(spatial_id, located.get(spatial_id))
+            bounds.update((spatial_id, b) for spatial_id, b in located.items() if b is not None)
+        return bounds
+
+    def invalidate_spatial_id(self, spatial_id, zoom_level):
+        """Queue removal of every cached tile, at any tile zoom, that draws the spatial ID's geometry.
+
+        Called on every attribute write, so it only records the key; the tiles are removed
+        shortly after by the background sweeper (see flush()).
+        """
+        with self._pending_ready:
+            self._pending.add((spatial_id, zoom_level))
+            if self._sweeper_pid != os.getpid():
+                # Threads do not survive fork, so every worker process starts its own
+                self._sweeper_pid = os.getpid()
+                threading.Thread(target=self._sweep_forever, name="tile-invalidation", daemon=True).start()
+            self._pending_ready.notify()
+
+    def _sweep_forever(self):
+        while True:
+            with self._pending_ready:
+                while not self._pending:
+                    self._pending_ready.wait()
+            self.flush()
+
+    def flush(self):
+        """Remove the cached tiles of every queued key now"""
+        with self._pending_ready:
+            keys, self._pending = self._pending, set()
+        if not keys:
+            return
+        try:
+            zoom_levels = {zoom_level for _, zoom_level in keys}
+            # Tombstones first: builds that started before them are not cached after the sweep
+            for zoom_level in zoom_levels:
+                self._mark_invalidated(zoom_level)
+            bounds = self._feature_bounds({spatial_id for spatial_id, _ in keys})
+            for zoom_level in zoom_levels:
+                located = [bounds[spatial_id] for spatial_id, level in keys
+                           if level == zoom_level and spatial_id in bounds]
+                if not located:
+                    continue
+                for z in range(MAX_TILE_ZOOM + 1):
+                    self._invalidate_ranges(zoom_level, z, [_tile_ranges(b, z) for b in located])
+        except Exception as e:
+            print(f"Error removing invalidated tiles: {e}")
+
+    def invalidate_all(self):
+        """Remove every cached tile, e.g. after attribute writes may have been missed"""
+        self._mark_invalidated()
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".mvt"):
+                    try:
+                        os.remove(os.path.join(root, name))
+                    except OSError:
+                        pass
+
+
+def set_bounds_lookup(locate):
+    """Use locate(spatial_ids) -> {spatial_id: WGS84 bounds} to find the tiles a write to an
+    opaque spatial ID affects"""
+    tile_cache.locate = locate
+
+
+tile_cache = TileCache(TILE_CACHE_DIR)
+
+if TILE_CACHE_ENABLED:
+    add_invalidation_listener(tile_cache.invalidate_spatial_id, tile_cache.invalidate_all)
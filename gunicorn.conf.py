@@ -0,0 +1,68 @@
+# Gunicorn settings for serving spatial_api in production:
+#   gunicorn -c gunicorn.conf.py "spatial_api:create_app()"
+import multiprocessing
+import os
+import sys
+
+# db_setup modules are imported by their top-level names, like spatial_api does
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_setup"))
+
+bind = os.environ.get("SPATIAL_API_BIND", "0.0.0.0:5000")
+
+# Preforked workers tied to the number of cores; each worker also runs a few
+# threads because most of a request is spent waiting on the remote database
+workers = int(os.environ.get("SPATIAL_API_WORKERS", str(multiprocessing.cpu_count() * 2 + 1)))
+worker_class = "gthread"
+threads = int(os.environ.get("SPATIAL_API_THREADS", "4"))
+
+# Import the app once in the master so workers fork with the code already loaded;
+# connection pools are opened lazily, so nothing database-related is inherited
+preload_app = True
+
+timeout = int(os.environ.get("SPATIAL_API_TIMEOUT", "30"))
+# On SIGTERM workers stop accepting connections and get this long to drain in-flight requests
+graceful_timeout = int(os.environ.get("SPATIAL_API_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    # With SPATIAL_METRICS_DIR set, /metrics sums the workers' files in it; start from zero
+    from metrics import clear_process_metrics
+    clear_process_metrics()
+
+
+def post_fork(server, worker):
+    # Each worker opens its own pools after the fork and warms its cache
+    from db_setup.query_spatial_data import init_worker
+    init_worker()
+    server.log.info(f"Worker {worker.pid} initialized its connection pools")
+
+
+def post_worker_init(worker):
+    # SIGTERM starts the graceful drain. Open change streams never finish on their own, so
+    # they are ended first instead of holding their threads until graceful_timeout.
+    import signal
+    from db_setup.query_spatial_data import begin_shutdown
+    handle_exit = signal.getsignal(signal.SIGTERM)
+
+    def drain(signum, frame):
+        begin_shutdown()
+        handle_exit(signum, frame)
+
+    signal.signal(signal.SIGTERM, drain)
+
+
+def worker_exit(server, worker):
+    # Runs after the worker has drained its requests
+    from db_setup.query_spatial_data import shutdown_worker
+    shutdown_worker()
+    server.log.info(f"Worker {worker.pid} closed its connection pools")
+
+
+def child_exit(server, worker):
+    # Runs in the master; keeps the exited worker's histogram counts in the metrics archive
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
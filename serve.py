@@ -0,0 +1,56 @@
+import os
+import signal
+import sys
+
+from spatial_api import create_app, logger
+from db_setup.query_spatial_data import init_worker, begin_shutdown, shutdown_worker
+
+# Production launcher for the Spatial Data API.
+#
+# On platforms with fork() the app runs under gunicorn with the settings in
+# gunicorn.conf.py (preforked workers, per-worker pools, graceful drain).
+# Elsewhere, e.g. on Windows, it falls back to waitress in a single process.
+
+def serve_with_gunicorn():
+    from gunicorn.app.wsgiapp import WSGIApplication
+
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+    sys.argv = ["gunicorn", "-c", config_path, "spatial_api:create_app()"]
+    WSGIApplication("%(prog)s [OPTIONS] [APP_MODULE]").run()
+
+def serve_with_waitress():
+    from waitress.server import create_server
+
+    host, _, port = os.environ.get("SPATIAL_API_BIND", "0.0.0.0:5000").rpartition(":")
+    threads = int(os.environ.get("SPATIAL_API_THREADS", str((os.cpu_count() or 1) * 4)))
+
+    init_worker()
+    server = create_server(create_app(), host=host, port=int(port), threads=threads)
+
+    def stop(signum, frame):
+        logger.info("Shutting down, waiting for in-flight requests")
+        # End open change streams, which would otherwise keep their threads busy
+        begin_shutdown()
+        server.close()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    logger.info(f"Serving Spatial Data API with waitress on {host}:{port} ({threads} threads)")
+    try:
+        server.run()
+    finally:
+        # Waitress joins its worker threads on close, so requests have finished by now
+        shutdown_worker()
+
+if __name__ == "__main__":
+    try:
+        import gunicorn  # noqa: F401
+        has_gunicorn = hasattr(os, "fork")
+    except ImportError:
+        has_gunicorn = False
+
+    if has_gunicorn:
+        serve_with_gunicorn()
+    else:
+        serve_with_waitress()
@@ -1,11 +1,53 @@
-from flask import Flask, request, jsonify
-import json
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+import base64
+import hashlib
+import itertools
+import math
+import binascii
+import os
 import re
+import sys
 import logging
+import time
 from functools import wraps
-from db_setup.query_spatial_data import query_postgis_data, query_attributes_data, update_attributes, get_combined_data
+from db_setup.query_spatial_data import (get_combined_data, get_combined_data_batch, get_data_version, patch_attributes, get_attribute_rollup,
+                                         query_descendant_attributes,
+                                         RESOLVE_MODES, postgis_record_exists, upsert_attributes,
+                                         postgis_existing_ids, upsert_attributes_batch, query_bbox_data,
+                                         resolve_tolerance, GEOMETRY_FORMATS, DEFAULT_GEOMETRY_FORMAT,
+                                         get_vector_tile, iter_export_records, iter_export_ndjson,
+                                         change_feed, postgis_breaker, breaker_stats)
+# db_setup modules import each other by their top-level names; import them the same way so the
+# app shares their module instances (the serializer that recognizes RawJSON values, the metrics,
+# caches and pools) instead of loading second copies
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db_setup'))
+import serialization
+from circuit_breaker import CircuitOpenError
+from connection_pool import pool_stats
+from metrics import METRICS_ENABLED, timed, observe_request, render_metrics
+from spatial_cache import cache_stats
+from change_feed import Subscription, SHUTDOWN_EVENT, format_sse, CHANGE_FEED_ENABLED, CHANGE_FEED_KEEPALIVE
+from spatial_id import parse_spatial_id
 
-app = Flask(__name__)
+class SpatialJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by db_setup/serialization.py (orjson when installed).
+
+    Raw JSONB documents (RawJSON) are written into responses without being decoded.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return serialization.dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return serialization.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(serialization.dumps_bytes(obj), mimetype=self.mimetype)
+
+# Routes are registered on a blueprint so create_app() can build independent app instances
+api = Blueprint('spatial_api', __name__)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -31,26 +73,324 @@ def require_valid_spatial_id(f):
         return f(spatial_id, *args, **kwargs)
     return decorated_function
 
-@app.route('/')
+ENDPOINTS = {
+    "/api/spatial?bbox=minx,miny,maxx,maxy": "Get spatial data intersecting a bounding box (paginated)",
+    "/api/spatial/<spatial_id>": "Get spatial data by ID (optional format=ewkb|geojson|wkb|quantized, simplify=auto|<tolerance>, resolve=exact|nearest|merge; supports If-None-Match)",
+    "/api/spatial/batch": "Get spatial data for a list of IDs (POST)",
+    "/api/attributes/<spatial_id>": "Update attributes for a spatial ID (POST)",
+    "/api/attributes/<spatial_id>?zoom_level=N": "Apply a JSON Merge Patch or JSON Patch to attributes (PATCH)",
+    "/api/attributes/batch": "Update attributes for many spatial IDs in one transaction (POST)",
+    "/api/rollup/<spatial_id>?zoom_level=N": "Aggregated attributes of the child voxels at zoom_level N",
+    "/api/descendants/<spatial_id>?zoom_level=N": "Attributes of a z/f/x/y voxel and every voxel inside it (paginated)",
+    "/api/cache/stats": "Hit/miss/eviction counters of the combined data cache",
+    "/api/tiles/<z>/<x>/<y>.mvt": "Mapbox Vector Tile of building footprints with attributes",
+    "/api/export": "Stream all combined records as NDJSON (optional zoom_level, bbox, format, simplify)",
+    "/api/changes?spatial_ids=a,b|bbox=minx,miny,maxx,maxy": "Server-Sent Events stream of attribute changes (optional zoom_level)",
+    "/metrics": "Stage latency histograms, pool and cache gauges in Prometheus format"
+}
+
+@api.route('/')
 def index():
     return jsonify({
         "message": "Spatial Data API",
-        "endpoints": {
-            "/api/spatial/<spatial_id>": "Get spatial data by ID",
-            "/api/attributes/<spatial_id>": "Update attributes for a spatial ID (POST)"
-        }
+        "endpoints": ENDPOINTS
     })
 
+# Request timing for /metrics; skipped entirely when metrics are disabled
+@api.before_app_request
+def start_request_timer():
+    if METRICS_ENABLED:
+        g.request_started = time.perf_counter()
+
+@api.after_app_request
+def record_request_duration(response):
+    started = g.get('request_started')
+    if started is not None:
+        observe_request(request.endpoint or 'unmatched', request.method, response.status_code,
+                        time.perf_counter() - started)
+    return response
+
+def serialize(payload):
+    """jsonify a response body, timed as the "serialize" stage"""
+    with timed("serialize"):
+        return jsonify(payload)
+
 # Basic error handler
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(error):
     return jsonify({"error": "Not found"}), 404
 
-@app.errorhandler(500)
+@api.app_errorhandler(500)
 def server_error(error):
     return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/spatial/<path:spatial_id>', methods=['GET'])
+def parse_geometry_options(params, zoom_level):
+    """Read the 'format' and 'simplify' options; raises ValueError if invalid"""
+    geometry_format = params.get('format') or DEFAULT_GEOMETRY_FORMAT
+    if geometry_format not in GEOMETRY_FORMATS:
+        raise ValueError(f"Invalid 'format' parameter, expected one of {', '.join(GEOMETRY_FORMATS)}")
+    try:
+        tolerance = resolve_tolerance(params.get('simplify'), zoom_level)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid 'simplify' parameter, expected 'auto' or a non-negative number") from None
+    return geometry_format, tolerance
+
+def parse_resolve_mode(params):
+    """Read the 'resolve' option; returns None for exact lookups, raises ValueError if invalid"""
+    resolve = params.get('resolve') or 'exact'
+    if resolve not in RESOLVE_MODES:
+        raise ValueError(f"Invalid 'resolve' parameter, expected one of {', '.join(RESOLVE_MODES)}")
+    return None if resolve == 'exact' else resolve
+
+def parse_bbox(value):
+    """Parse 'minx,miny,maxx,maxy' into four floats, or return None if invalid"""
+    try:
+        min_x, min_y, max_x, max_y = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        return None
+    if min_x > max_x or min_y > max_y:
+        return None
+    return min_x, min_y, max_x, max_y
+
+# Pagination cursors are the last spatial ID of a page, encoded so clients treat them as opaque
+def encode_cursor(spatial_id):
+    return base64.urlsafe_b64encode(spatial_id.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    try:
+        return base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+
+# Response builders shared with the asyncio variant in spatial_api_async.py
+def spatial_response(spatial_id, zoom_level, result):
+    response = {
+        "spatial_id": spatial_id,
+        "zoom_level": zoom_level,
+        "geometry": result.get("geometry"),
+        "attributes": result.get("attributes"),
+        "altitude": result.get("altitude")
+    }
+    
+    # Geometry was served from the replica or the last known copy while PostGIS was unavailable
+    if result.get("degraded"):
+        response["degraded"] = True
+
+    # Levels of the zoom hierarchy the attributes were resolved from, nearest first
+    if "attributes_sources" in result:
+        response["attributes_sources"] = result["attributes_sources"]
+
+    # Geometry was found but the attributes lookup failed or timed out
+    if result.get("partial"):
+        response["partial"] = True
+        response["errors"] = result.get("errors")
+    return response
+
+# Conditional GET helpers, shared with the asyncio variant
+def spatial_validators(version, zoom_level, geometry_format, tolerance, resolve=None):
+    """Return (etag, last_modified) for a lookup from get_data_version's result.
+
+    The ETag covers both databases and the requested encoding; Last-Modified is the
+    attributes' updated_at (bldg_spatial_ids has no timestamp) and None without attributes.
+    Resolved lookups also cover the number of levels the attributes came from.
+    """
+    tag = (f"{version['geometry']}:{version['attributes_updated_at']!r}:"
+           f"{zoom_level}:{geometry_format}:{tolerance!r}")
+    if resolve:
+        tag += f":{resolve}:{version.get('attributes_sources')}"
+    return hashlib.sha1(tag.encode('utf-8')).hexdigest(), version['attributes_updated_at']
+
+def is_conditional(req):
+    """True if the request carries an ETag to revalidate, the only case worth a version probe"""
+    return bool(req.if_none_match)
+
+def is_not_modified(req, etag, last_modified):
+    """Evaluate If-None-Match.
+
+    If-Modified-Since is ignored: Last-Modified only dates the attributes, so a geometry
+    change after that time would still be answered 304 (RFC 9110 lets servers skip it).
+    """
+    if req.if_none_match:
+        return req.if_none_match.contains_weak(etag)
+    return False
+
+def result_validators(result, zoom_level, geometry_format, tolerance, resolve=None):
+    """Validators for a full lookup from its result's "version", or None.
+
+    Partial and degraded results must not be revalidated as if they were complete.
+    """
+    if result.get('partial') or result.get('degraded') or not result.get('version'):
+        return None
+    return spatial_validators(result['version'], zoom_level, geometry_format, tolerance, resolve)
+
+def set_cache_headers(response, validators, max_age, exact=True):
+    """Add ETag, Last-Modified and Cache-Control; responses without validators are not stored.
+
+    X-Attributes-Updated-At is only sent for exact lookups (exact=False for resolved ones),
+    whose Last-Modified is the version of the row a PATCH would write.
+    """
+    if validators is None:
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    etag, last_modified = validators
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = int(last_modified)
+        if exact:
+            # Exact version for PATCH ?expected_updated_at=; Last-Modified only has whole seconds
+            response.headers['X-Attributes-Updated-At'] = repr(last_modified)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}, must-revalidate'
+    return response
+
+def batch_lookup_response(results, errors, zoom_level):
+    found = []
+    not_found = []
+    for result in results:
+        if result.get('geometry'):
+            found.append({
+                "spatial_id": result["spatial_id"],
+                "zoom_level": zoom_level,
+                "geometry": result.get("geometry"),
+                "attributes": result.get("attributes"),
+                "altitude": result.get("altitude")
+            })
+            if result.get("degraded"):
+                found[-1]["degraded"] = True
+        else:
+            not_found.append(result["spatial_id"])
+    
+    response = {
+        "zoom_level": zoom_level,
+        "count": len(found),
+        "results": found,
+        "not_found": not_found
+    }
+    if errors:
+        response["partial"] = True
+        response["errors"] = errors
+    return response
+
+def retry_after_header():
+    """Retry-After for a 503, the PostGIS circuit breaker's remaining cooldown in whole seconds"""
+    return {'Retry-After': str(max(1, math.ceil(postgis_breaker.retry_after())))}
+
+def geometry_unavailable(result):
+    """Return (body, headers) for a 503 when a lookup found no geometry because the PostGIS leg failed, else None"""
+    if not (result.get('errors') or {}).get('postgis'):
+        return None
+    body = {"error": "Geometry database is unavailable, try again later", "errors": result['errors']}
+    return body, retry_after_header()
+
+def circuit_open():
+    """Return (body, headers) for a 503 when the PostGIS circuit breaker rejected the call"""
+    return {"error": "Geometry database is unavailable, try again later"}, retry_after_header()
+
+def bbox_response(bbox, zoom_level, records, last_spatial_id):
+    return {
+        "bbox": list(bbox),
+        "zoom_level": zoom_level,
+        "count": len(records),
+        "results": records,
+        "next_cursor": encode_cursor(last_spatial_id) if last_spatial_id else None
+    }
+
+def descendants_response(spatial_id, zoom_level, records, last_spatial_id):
+    return {
+        "spatial_id": spatial_id,
+        "zoom_level": zoom_level,
+        "count": len(records),
+        "results": records,
+        "next_cursor": encode_cursor(last_spatial_id) if last_spatial_id else None
+    }
+
+def validate_attribute_items(items):
+    """Validate batch update items one by one.
+    
+    Returns (reports, valid): reports has a failure report at the index of each
+    invalid item and None elsewhere; valid lists (index, item) pairs to write.
+    """
+    reports = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            reports[index] = {"index": index, "success": False, "error": "Item must be an object"}
+            continue
+        spatial_id = item.get('spatial_id')
+        zoom_level = item.get('zoom_level')
+        attributes = item.get('attributes')
+        error = None
+        if not isinstance(spatial_id, str) or not validate_spatial_id(spatial_id):
+            error = "Invalid spatial ID format"
+        elif not isinstance(zoom_level, int):
+            error = "Missing or invalid 'zoom_level' parameter"
+        elif not attributes or not isinstance(attributes, dict):
+            error = "Missing or invalid 'attributes' parameter"
+        if error:
+            reports[index] = {"index": index, "spatial_id": spatial_id, "zoom_level": zoom_level,
+                              "success": False, "error": error}
+        else:
+            valid.append((index, item))
+    return reports, valid
+
+def select_writable_items(valid, existing, reports):
+    """Keep the items whose spatial ID exists (existing maps zoom_level to a set of IDs)"""
+    writable = []
+    for index, item in valid:
+        if item['spatial_id'] in existing[item['zoom_level']]:
+            writable.append((index, item))
+        else:
+            reports[index] = {"index": index, "spatial_id": item['spatial_id'], "zoom_level": item['zoom_level'],
+                              "success": False, "error": f"Spatial ID '{item['spatial_id']}' not found"}
+    return writable
+
+def batch_update_response(reports, writable, results):
+    for (index, _), result in zip(writable, results):
+        reports[index] = dict(result, index=index)
+    succeeded = sum(1 for report in reports if report["success"])
+    return {
+        "message": f"Updated {succeeded} of {len(reports)} items",
+        "succeeded": succeeded,
+        "failed": len(reports) - succeeded,
+        "results": reports
+    }
+
+@api.route('/api/spatial', methods=['GET'])
+def get_spatial_data_in_bbox():
+    """Get spatial data whose geometry intersects a bounding box"""
+    bbox = parse_bbox(request.args.get('bbox'))
+    if bbox is None:
+        return jsonify({"error": "Missing or invalid 'bbox' parameter, expected minx,miny,maxx,maxy"}), 400
+        
+    zoom_level = request.args.get('zoom_level', default=25, type=int)
+    limit = request.args.get('limit', default=100, type=int)
+    max_batch_size = current_app.config['MAX_BATCH_SIZE']
+    if limit < 1 or limit > max_batch_size:
+        return jsonify({"error": f"Invalid 'limit' parameter, expected 1 to {max_batch_size}"}), 400
+    
+    try:
+        geometry_format, tolerance = parse_geometry_options(request.args, zoom_level)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    after = None
+    if request.args.get('cursor'):
+        after = decode_cursor(request.args['cursor'])
+        if after is None:
+            return jsonify({"error": "Invalid 'cursor' parameter"}), 400
+    
+    try:
+        records, last_spatial_id = query_bbox_data(*bbox, zoom_level, limit=limit, after=after,
+                                                   geometry_format=geometry_format, tolerance=tolerance,
+                                                   raw_attributes=True)
+        return serialize(bbox_response(bbox, zoom_level, records, last_spatial_id))
+    except CircuitOpenError:
+        body, headers = circuit_open()
+        return jsonify(body), 503, headers
+    except Exception as e:
+        current_app.logger.error(f"Error retrieving bounding box data: {str(e)}")
+        return jsonify({"error": "Internal server error while retrieving spatial data"}), 500
+
+@api.route('/api/spatial/<path:spatial_id>', methods=['GET'])
 @require_valid_spatial_id
 def get_spatial_data(spatial_id):
     """Get spatial data by ID from both databases"""
@@ -58,27 +398,119 @@ def get_spatial_data(spatial_id):
         # Get zoom level from query parameters, default to 25 if not provided
         zoom_level = request.args.get('zoom_level', default=25, type=int)
         
+        # Optional geometry encoding and zoom-dependent simplification
+        try:
+            geometry_format, tolerance = parse_geometry_options(request.args, zoom_level)
+            resolve = parse_resolve_mode(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # Conditional GET: a version-only probe answers unchanged data with 304. Plain GETs skip
+        # it and take their validators from the rows the lookup read.
+        max_age = current_app.config['CACHE_MAX_AGE']
+        exact = resolve is None
+        if is_conditional(request):
+            try:
+                version = get_data_version(spatial_id, zoom_level, geometry_format, tolerance, resolve)
+            except Exception as e:
+                current_app.logger.warning(f"Version probe failed, running the full lookup: {str(e)}")
+                version = None
+            if version is not None:
+                validators = spatial_validators(version, zoom_level, geometry_format, tolerance, resolve)
+                if is_not_modified(request, *validators):
+                    return set_cache_headers(Response(status=304), validators, max_age, exact)
+        
         # Use the get_combined_data function to get data from both databases
-        result = get_combined_data(spatial_id, zoom_level)
+        result = get_combined_data(spatial_id, zoom_level, geometry_format, tolerance, raw_attributes=True,
+                                   resolve=resolve)
         
         if not result:
             return jsonify({"error": "Spatial ID not found"}), 404
             
         if not result.get('geometry'):
+            unavailable = geometry_unavailable(result)
+            if unavailable:
+                body, headers = unavailable
+                return jsonify(body), 503, headers
             return jsonify({"error": "No geometry data found for this spatial ID"}), 404
-            
-        return jsonify({
-            "spatial_id": spatial_id,
-            "zoom_level": zoom_level,
-            "geometry": result.get("geometry"),
-            "attributes": result.get("attributes"),
-            "altitude": result.get("altitude")
-        })
+        
+        return set_cache_headers(serialize(spatial_response(spatial_id, zoom_level, result)),
+                                 result_validators(result, zoom_level, geometry_format, tolerance, resolve),
+                                 max_age, exact)
+    except Exception as e:
+        current_app.logger.error(f"Error retrieving spatial data: {str(e)}")
+        return jsonify({"error": "Internal server error while retrieving spatial data"}), 500
+
+@api.route('/api/spatial/batch', methods=['POST'])
+def get_spatial_data_batch():
+    """Get spatial data for many IDs with one query per database"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid JSON format, expected an object"}), 400
+        
+    spatial_ids = data.get('spatial_ids')
+    zoom_level = data.get('zoom_level', 25)
+    
+    if not isinstance(spatial_ids, list) or not spatial_ids:
+        return jsonify({"error": "Missing or invalid 'spatial_ids' parameter, expected a non-empty list"}), 400
+        
+    max_batch_size = current_app.config['MAX_BATCH_SIZE']
+    if len(spatial_ids) > max_batch_size:
+        return jsonify({"error": f"Too many spatial IDs, the maximum batch size is {max_batch_size}"}), 400
+        
+    if not isinstance(zoom_level, int):
+        return jsonify({"error": "Invalid 'zoom_level' parameter, expected an integer"}), 400
+        
+    invalid_ids = [sid for sid in spatial_ids if not isinstance(sid, str) or not validate_spatial_id(sid)]
+    if invalid_ids:
+        return jsonify({"error": "Invalid spatial ID format", "invalid_ids": invalid_ids}), 400
+    
+    try:
+        geometry_format, tolerance = parse_geometry_options(data, zoom_level)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        results, errors = get_combined_data_batch(spatial_ids, zoom_level, geometry_format, tolerance,
+                                                  raw_attributes=True)
+        return serialize(batch_lookup_response(results, errors, zoom_level))
     except Exception as e:
-        app.logger.error(f"Error retrieving spatial data: {str(e)}")
+        current_app.logger.error(f"Error retrieving batch spatial data: {str(e)}")
         return jsonify({"error": "Internal server error while retrieving spatial data"}), 500
 
-@app.route('/api/attributes/<path:spatial_id>', methods=['POST'])
+@api.route('/api/attributes/batch', methods=['POST'])
+def update_spatial_attributes_batch():
+    """Update attributes for many spatial IDs in a single transaction"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list) or not data['items']:
+        return jsonify({"error": "Invalid JSON format, expected an object with a non-empty 'items' list"}), 400
+        
+    items = data['items']
+    max_batch_size = current_app.config['MAX_BATCH_SIZE']
+    if len(items) > max_batch_size:
+        return jsonify({"error": f"Too many items, the maximum batch size is {max_batch_size}"}), 400
+    
+    # Validate every item up front so one bad item does not abort the others
+    reports, valid = validate_attribute_items(items)
+    
+    try:
+        # One existence query per zoom level present in the batch
+        existing = {}
+        for zoom_level in {item['zoom_level'] for _, item in valid}:
+            ids = {item['spatial_id'] for _, item in valid if item['zoom_level'] == zoom_level}
+            existing[zoom_level] = postgis_existing_ids(ids, zoom_level)
+        writable = select_writable_items(valid, existing, reports)
+        results = upsert_attributes_batch([item for _, item in writable])
+    except CircuitOpenError:
+        body, headers = circuit_open()
+        return jsonify(body), 503, headers
+    except Exception as e:
+        current_app.logger.error(f"Error updating attributes in bulk: {str(e)}")
+        return jsonify({"error": "Internal server error while updating attributes"}), 500
+    
+    return serialize(batch_update_response(reports, writable, results))
+
+@api.route('/api/attributes/<path:spatial_id>', methods=['POST'])
 @require_valid_spatial_id
 def update_spatial_attributes(spatial_id):
     """Update attributes for a spatial ID"""
@@ -92,7 +524,7 @@ def update_spatial_attributes(spatial_id):
         if not isinstance(data, dict):
             return jsonify({"error": "Invalid JSON format, expected an object"}), 400
     except Exception as e:
-        app.logger.error(f"Error parsing JSON: {str(e)}")
+        current_app.logger.error(f"Error parsing JSON: {str(e)}")
         return jsonify({"error": "Invalid JSON format in request"}), 400
         
     try:
@@ -104,46 +536,328 @@ def update_spatial_attributes(spatial_id):
         if zoom_level is None:
             return jsonify({"error": "Missing required 'zoom_level' parameter"}), 400
             
+        if not isinstance(zoom_level, int):
+            return jsonify({"error": "Invalid 'zoom_level' parameter, expected an integer"}), 400
+            
         if not attributes or not isinstance(attributes, dict):
             return jsonify({"error": "Missing or invalid 'attributes' parameter"}), 400
         
-        # Check if spatial ID exists before updating
-        existing_data = get_combined_data(spatial_id, zoom_level)
-        if not existing_data:
+        # Check if spatial ID exists before updating; only PostGIS holds the record itself
+        if not postgis_record_exists(spatial_id, zoom_level):
             return jsonify({"error": f"Spatial ID '{spatial_id}' not found"}), 404
             
-        # Update attributes using the update_attributes function
-        success = update_attributes(spatial_id, zoom_level, attributes)
+        # Upsert and build the response from the stored document (RETURNING attributes)
+        updated_attributes = upsert_attributes(spatial_id, zoom_level, attributes)
         
-        if not success:
+        if updated_attributes is None:
             return jsonify({"error": "Failed to update attributes in database"}), 500
-            
-        # Get the updated data to return
-        updated_data = get_combined_data(spatial_id, zoom_level)  # Pass the same zoom_level used for update
         
         return jsonify({
             "message": "Attributes updated successfully",
             "spatial_id": spatial_id,
-            "updated_attributes": updated_data.get("attributes")
+            "updated_attributes": updated_attributes
         })
     except ValueError as e:
         return jsonify({"error": f"Invalid data format: {str(e)}"}), 400
+    except CircuitOpenError:
+        body, headers = circuit_open()
+        return jsonify(body), 503, headers
     except Exception as e:
-        app.logger.error(f"Error updating attributes: {str(e)}")
+        current_app.logger.error(f"Error updating attributes: {str(e)}")
         return jsonify({"error": "Internal server error while updating attributes"}), 500
 
+# Patch formats by request Content-Type
+PATCH_MEDIA_TYPES = {
+    "application/merge-patch+json": "merge",
+    "application/json-patch+json": "json-patch"
+}
+
+# HTTP status for each patch_attributes failure
+PATCH_ERROR_STATUS = {"not_found": 404, "conflict": 409, "patch_failed": 422}
+
+def parse_patch_options(params):
+    """Read the PATCH query parameters zoom_level and expected_updated_at; raises ValueError if invalid"""
+    try:
+        zoom_level = int(params['zoom_level'])
+    except (KeyError, ValueError):
+        raise ValueError("Missing or invalid 'zoom_level' parameter") from None
+    expected_updated_at = None
+    if params.get('expected_updated_at'):
+        try:
+            expected_updated_at = float(params['expected_updated_at'])
+        except ValueError:
+            raise ValueError("Invalid 'expected_updated_at' parameter, expected epoch seconds") from None
+    return zoom_level, expected_updated_at
+
+def patch_response(spatial_id, zoom_level, result, prefer):
+    """Build the (body, status) of a PATCH; the document is only returned with Prefer: return=representation"""
+    if not result["success"]:
+        body = {"error": result["message"]}
+        if "updated_at" in result:
+            body["updated_at"] = result["updated_at"]
+        return body, PATCH_ERROR_STATUS[result["error"]]
+    body = {
+        "message": "Attributes patched successfully",
+        "spatial_id": spatial_id,
+        "zoom_level": zoom_level,
+        "updated_at": result["updated_at"]
+    }
+    if "return=representation" in (prefer or ""):
+        body["updated_attributes"] = result["attributes"]
+    return body, 200
+
+@api.route('/api/attributes/<path:spatial_id>', methods=['PATCH'])
+@require_valid_spatial_id
+def patch_spatial_attributes(spatial_id):
+    """Apply a JSON Merge Patch or JSON Patch to the stored attributes of a spatial ID"""
+    patch_format = PATCH_MEDIA_TYPES.get(request.mimetype)
+    if patch_format is None:
+        return jsonify({"error": f"Unsupported Content-Type, expected {' or '.join(PATCH_MEDIA_TYPES)}"}), 415
+    try:
+        zoom_level, expected_updated_at = parse_patch_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    patch = request.get_json(silent=True)
+    if patch is None:
+        return jsonify({"error": "Missing or invalid JSON patch document"}), 400
+    
+    try:
+        result = patch_attributes(spatial_id, zoom_level, patch, patch_format, expected_updated_at)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error patching attributes: {str(e)}")
+        return jsonify({"error": "Internal server error while updating attributes"}), 500
+    
+    body, status = patch_response(spatial_id, zoom_level, result, request.headers.get('Prefer'))
+    return serialize(body), status
+
+@api.route('/api/rollup/<path:spatial_id>', methods=['GET'])
+@require_valid_spatial_id
+def get_spatial_rollup(spatial_id):
+    """Get the aggregated attributes of the child voxels of a spatial ID"""
+    zoom_level = request.args.get('zoom_level', default=25, type=int)
+    try:
+        rollup = get_attribute_rollup(spatial_id, zoom_level)
+    except Exception as e:
+        current_app.logger.error(f"Error retrieving attribute rollup: {str(e)}")
+        return jsonify({"error": "Internal server error while retrieving attribute rollup"}), 500
+    if rollup is None:
+        return jsonify({"error": "No child attributes found for this spatial ID and zoom level"}), 404
+    return serialize(rollup)
+
+def parse_descendants_options(params, max_batch_size):
+    """Read zoom_level, limit and cursor of a descendants page; raises ValueError if invalid"""
+    zoom_level = params.get('zoom_level', default=25, type=int)
+    limit = params.get('limit', default=100, type=int)
+    if limit < 1 or limit > max_batch_size:
+        raise ValueError(f"Invalid 'limit' parameter, expected 1 to {max_batch_size}")
+
+    after = None
+    if params.get('cursor'):
+        after = decode_cursor(params['cursor'])
+        if after is None or parse_spatial_id(after) is None:
+            raise ValueError("Invalid 'cursor' parameter")
+    return zoom_level, limit, after
+
+@api.route('/api/descendants/<path:spatial_id>', methods=['GET'])
+@require_valid_spatial_id
+def get_spatial_descendants(spatial_id):
+    """Get the attributes of a voxel and every voxel inside it, in tile key order"""
+    if parse_spatial_id(spatial_id) is None:
+        return jsonify({"error": "Only z/f/x/y spatial IDs have descendants"}), 400
+    try:
+        zoom_level, limit, after = parse_descendants_options(request.args, current_app.config['MAX_BATCH_SIZE'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        records, last_spatial_id = query_descendant_attributes(spatial_id, zoom_level, limit=limit, after=after,
+                                                               raw_attributes=True)
+    except Exception as e:
+        current_app.logger.error(f"Error retrieving descendant attributes: {str(e)}")
+        return jsonify({"error": "Internal server error while retrieving descendant attributes"}), 500
+    return serialize(descendants_response(spatial_id, zoom_level, records, last_spatial_id))
+
+def parse_export_options(params):
+    """Read the optional export filters; raises ValueError if invalid"""
+    zoom_level = None
+    if params.get('zoom_level'):
+        try:
+            zoom_level = int(params['zoom_level'])
+        except ValueError:
+            raise ValueError("Invalid 'zoom_level' parameter, expected an integer") from None
+
+    bbox = None
+    if params.get('bbox'):
+        bbox = parse_bbox(params['bbox'])
+        if bbox is None:
+            raise ValueError("Invalid 'bbox' parameter, expected minx,miny,maxx,maxy")
+
+    geometry_format, tolerance = parse_geometry_options(params, zoom_level if zoom_level is not None else 25)
+    return zoom_level, bbox, geometry_format, tolerance
+
+@api.route('/api/export', methods=['GET'])
+def export_spatial_data():
+    """Stream every combined record as newline-delimited JSON"""
+    try:
+        zoom_level, bbox, geometry_format, tolerance = parse_export_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    chunks = iter_export_ndjson(iter_export_records(zoom_level, bbox, geometry_format, tolerance,
+                                                    raw_attributes=True))
+    try:
+        # Start the queries before responding so connection errors still get a proper status
+        first = next(chunks, b"")
+    except CircuitOpenError:
+        body, headers = circuit_open()
+        return jsonify(body), 503, headers
+    except Exception as e:
+        current_app.logger.error(f"Error starting export: {str(e)}")
+        return jsonify({"error": "Internal server error while exporting spatial data"}), 500
+
+    def stream():
+        try:
+            yield from itertools.chain([first], chunks)
+        except Exception as e:
+            # Headers are already sent; the client sees a truncated stream
+            current_app.logger.error(f"Error during export: {str(e)}")
+        finally:
+            chunks.close()
+
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+
+def parse_change_subscription(params, max_ids):
+    """Read the change feed filters: spatial_ids, bbox and zoom_level; raises ValueError if invalid"""
+    spatial_ids = None
+    if params.get('spatial_ids'):
+        spatial_ids = [sid for sid in params['spatial_ids'].split(',') if sid]
+        if len(spatial_ids) > max_ids:
+            raise ValueError(f"Too many spatial IDs, the maximum is {max_ids}")
+        if not all(validate_spatial_id(sid) for sid in spatial_ids):
+            raise ValueError("Invalid spatial ID format")
+
+    bbox = None
+    if params.get('bbox'):
+        bbox = parse_bbox(params['bbox'])
+        if bbox is None:
+            raise ValueError("Invalid 'bbox' parameter, expected minx,miny,maxx,maxy")
+
+    if not spatial_ids and bbox is None:
+        raise ValueError("Subscribe to a comma-separated 'spatial_ids' list, a 'bbox', or both")
+
+    zoom_level = None
+    if params.get('zoom_level'):
+        try:
+            zoom_level = int(params['zoom_level'])
+        except ValueError:
+            raise ValueError("Invalid 'zoom_level' parameter, expected an integer") from None
+    return spatial_ids, bbox, zoom_level
+
+# Streaming responses must reach the client as soon as each event is written
+SSE_HEADERS = {'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'}
+
+@api.route('/api/changes', methods=['GET'])
+def stream_changes():
+    """Push attribute changes for a set of spatial IDs or a bounding box as Server-Sent Events"""
+    if not CHANGE_FEED_ENABLED:
+        return jsonify({"error": "The change feed is disabled"}), 404
+    try:
+        spatial_ids, bbox, zoom_level = parse_change_subscription(request.args, current_app.config['MAX_BATCH_SIZE'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    subscription = change_feed.subscribe(Subscription(spatial_ids, bbox, zoom_level))
+
+    def stream():
+        try:
+            # Ask EventSource clients to reconnect after 5 seconds if the stream drops
+            yield "retry: 5000\n\n"
+            while True:
+                # A keep-alive comment on idle streams also detects disconnected clients
+                event = subscription.get(timeout=CHANGE_FEED_KEEPALIVE)
+                yield format_sse(event)
+                # The worker is shutting down; end the stream so its thread is released
+                if event is SHUTDOWN_EVENT:
+                    break
+        finally:
+            change_feed.unsubscribe(subscription)
+
+    return Response(stream(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@api.route('/api/tiles/<int:z>/<int:x>/<int:y>.mvt', methods=['GET'])
+def get_tile(z, x, y):
+    """Get a Mapbox Vector Tile of the buildings in tile z/x/y"""
+    if not 0 <= z <= 25 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({"error": "Invalid tile coordinates"}), 400
+    zoom_level = request.args.get('zoom_level', default=25, type=int)
+    
+    try:
+        tile = get_vector_tile(z, x, y, zoom_level)
+    except CircuitOpenError:
+        body, headers = circuit_open()
+        return jsonify(body), 503, headers
+    except Exception as e:
+        current_app.logger.error(f"Error building tile {z}/{x}/{y}: {str(e)}")
+        return jsonify({"error": "Internal server error while building tile"}), 500
+    
+    if not tile:
+        return Response(status=204)
+    return Response(tile, mimetype='application/vnd.mapbox-vector-tile')
+
+@api.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Expose cache counters for tuning sizes and TTLs"""
+    return jsonify(cache_stats())
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Expose latency histograms, pool utilization and cache hit ratios to Prometheus"""
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(render_metrics(pool_stats(), cache_stats(), breaker_stats()), mimetype='text/plain; version=0.0.4')
+
 # Global error handler for unexpected exceptions
-@app.errorhandler(Exception)
+@api.app_errorhandler(Exception)
 def handle_exception(e):
     logger.error(f"Unhandled exception: {str(e)}")
     return jsonify({
         "error": "An unexpected error occurred",
-        "details": str(e) if app.debug else "Contact administrator for details"
+        "details": str(e) if current_app.debug else "Contact administrator for details"
     }), 500
 
+def create_app(config=None):
+    """Application factory used by the production launcher (serve.py / gunicorn.conf.py)"""
+    app = Flask(__name__)
+    app.json = SpatialJSONProvider(app)
+    
+    # Maximum number of spatial IDs accepted by the batch endpoints
+    app.config['MAX_BATCH_SIZE'] = int(os.environ.get('SPATIAL_API_MAX_BATCH_SIZE', '500'))
+    # Seconds clients may reuse a lookup before revalidating it with If-None-Match
+    app.config['CACHE_MAX_AGE'] = int(os.environ.get('SPATIAL_API_CACHE_MAX_AGE', '0'))
+    if config:
+        app.config.update(config)
+    
+    app.register_blueprint(api)
+    return app
+
+# Module-level app for the development server and existing imports
+app = create_app()
+
 if __name__ == '__main__':
     logger.info("Starting Spatial Data API on port 5000")
     logger.info("Available endpoints:")
+    logger.info("  - GET  /api/spatial?bbox=minx,miny,maxx,maxy: Get spatial data in a bounding box")
     logger.info("  - GET  /api/spatial/<spatial_id>: Get spatial data by ID")
+    logger.info("  - POST /api/spatial/batch: Get spatial data for a list of IDs")
     logger.info("  - POST /api/attributes/<spatial_id>: Update attributes for a spatial ID")
+    logger.info("  - PATCH /api/attributes/<spatial_id>: Patch attributes for a spatial ID")
+    logger.info("  - POST /api/attributes/batch: Update attributes for many spatial IDs")
+    logger.info("  - GET  /api/cache/stats: Cache hit/miss/eviction counters")
+    logger.info("  - GET  /api/tiles/<z>/<x>/<y>.mvt: Mapbox Vector Tile")
+    logger.info("  - GET  /api/export: Stream all combined records as NDJSON")
+    logger.info("  - GET  /api/changes: Server-Sent Events stream of attribute changes")
+    logger.info("  - GET  /metrics: Prometheus metrics")
     app.run(debug=True, port=5000)
\ No newline at end of file
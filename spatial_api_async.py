@@ -0,0 +1,465 @@
+import asyncio
+import logging
+import os
+import time
+from functools import wraps
+
+from quart import Quart, Response, g, request, jsonify
+from quart.json.provider import DefaultJSONProvider
+
+from db_setup import async_query_spatial_data as db
+from db_setup.query_spatial_data import get_vector_tile, iter_export_records, iter_export_ndjson, change_feed, breaker_stats
+# Validation and response builders are shared with the Flask app so both serve identical shapes
+from spatial_api import (ENDPOINTS, validate_spatial_id, parse_geometry_options, parse_bbox, decode_cursor,
+                         spatial_response, batch_lookup_response, bbox_response, validate_attribute_items,
+                         select_writable_items, batch_update_response, parse_export_options,
+                         spatial_validators, is_conditional, is_not_modified, result_validators,
+                         set_cache_headers, parse_change_subscription,
+                         SSE_HEADERS, PATCH_MEDIA_TYPES, parse_patch_options, patch_response, parse_resolve_mode,
+                         geometry_unavailable, circuit_open, parse_descendants_options, descendants_response)
+# Top-level db_setup modules, shared with the DB layer like in spatial_api.py
+import serialization
+from circuit_breaker import CircuitOpenError
+from metrics import METRICS_ENABLED, timed, observe_request, render_metrics, flush_process_metrics
+from spatial_cache import cache_stats
+from change_feed import AsyncSubscription, SHUTDOWN_EVENT, format_sse, CHANGE_FEED_ENABLED, CHANGE_FEED_KEEPALIVE
+from spatial_id import parse_spatial_id
+
+# Asyncio variant of the Spatial Data API: same routes and responses as spatial_api.py,
+# served by an ASGI server with asyncpg pools, e.g.
+#   hypercorn spatial_api_async:app --bind 0.0.0.0:5000
+app = Quart(__name__)
+
+
+class SpatialJSONProvider(DefaultJSONProvider):
+    """Quart counterpart of spatial_api.SpatialJSONProvider"""
+
+    def dumps(self, obj, **kwargs):
+        return serialization.dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return serialization.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(serialization.dumps_bytes(obj), mimetype=self.mimetype)
+
+
+app.json = SpatialJSONProvider(app)
+
+# Maximum number of spatial IDs accepted by the batch endpoints
+app.config['MAX_BATCH_SIZE'] = int(os.environ.get('SPATIAL_API_MAX_BATCH_SIZE', '500'))
+app.config['CACHE_MAX_AGE'] = int(os.environ.get('SPATIAL_API_CACHE_MAX_AGE', '0'))
+
+logger = logging.getLogger(__name__)
+
+@app.before_serving
+async def open_pools():
+    await db.init_pools()
+    change_feed.start()
+
+@app.after_serving
+async def close_pools():
+    # Joining the listener thread blocks, so keep it off the event loop
+    await asyncio.to_thread(change_feed.stop)
+    await db.close_pools()
+    flush_process_metrics()
+
+@app.before_request
+async def start_request_timer():
+    if METRICS_ENABLED:
+        g.request_started = time.perf_counter()
+
+@app.after_request
+async def record_request_duration(response):
+    started = g.get('request_started')
+    if started is not None:
+        observe_request(request.endpoint or 'unmatched', request.method, response.status_code,
+                        time.perf_counter() - started)
+    return response
+
+def serialize(payload):
+    """jsonify a response body, timed as the "serialize" stage"""
+    with timed("serialize"):
+        return jsonify(payload)
+
+# Decorator for validating spatial ID
+def require_valid_spatial_id(f):
+    @wraps(f)
+    async def decorated_function(spatial_id, *args, **kwargs):
+        if not validate_spatial_id(spatial_id):
+            return jsonify({"error": "Invalid spatial ID format"}), 400
+        return await f(spatial_id, *args, **kwargs)
+    return decorated_function
+
+@app.route('/')
+async def index():
+    return jsonify({
+        "message": "Spatial Data API",
+        "endpoints": ENDPOINTS
+    })
+
+@app.errorhandler(404)
+async def not_found(error):
+    return jsonify({"error": "Not found"}), 404
+
+@app.errorhandler(500)
+async def server_error(error):
+    return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/api/spatial', methods=['GET'])
+async def get_spatial_data_in_bbox():
+    """Get spatial data whose geometry intersects a bounding box"""
+    bbox = parse_bbox(request.args.get('bbox'))
+    if bbox is None:
+        return jsonify({"error": "Missing or invalid 'bbox' parameter, expected minx,miny,maxx,maxy"}), 400
+
+    zoom_level = request.args.get('zoom_level', default=25, type=int)
+    limit = request.args.get('limit', default=100, type=int)
+    max_batch_size = app.config['MAX_BATCH_SIZE']
+    if limit < 1 or limit > max_batch_size:
+        return jsonify({"error": f"Invalid 'limit' parameter, expected 1 to {max_batch_size}"}), 400
+
+    try:
+        geometry_format, tolerance = parse_geometry_options(request.args, zoom_level)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    after = None
+    if request.args.get('cursor'):
+        after = decode_cursor(request.args['cursor'])
+        if after is None:
+            return jsonify({"error": "Invalid 'cursor' parameter"}), 400
+
+    try:
+        records, last_spatial_id = await db.query_bbox_data(*bbox, zoom_level, limit=limit, after=after,
+                                                            geometry_format=geometry_format, tolerance=tolerance,
+                                                            raw_attributes=True)
+        return serialize(bbox_response(bbox, zoom_level, records, last_spatial_id))
+    except CircuitOpenError:
+        body, headers = circuit_open()
+        return jsonify(body), 503, headers
+    except Exception as e:
+        app.logger.error(f"Error retrieving bounding box data: {str(e)}")
+        return jsonify({"error": "Internal server error while retrieving spatial data"}), 500
+
+@app.route('/api/spatial/<path:spatial_id>', methods=['GET'])
+@require_valid_spatial_id
+async def get_spatial_data(spatial_id):
+    """Get spatial data by ID from both databases"""
+    try:
+        zoom_level = request.args.get('zoom_level', default=25, type=int)
+
+        try:
+            geometry_format, tolerance = parse_geometry_options(request.args, zoom_level)
+            resolve = parse_resolve_mode(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        max_age = app.config['CACHE_MAX_AGE']
+        exact = resolve is None
+        if is_conditional(request):
+            try:
+                version = await db.get_data_version(spatial_id, zoom_level, geometry_format, tolerance, resolve)
+            except Exception as e:
+                app.logger.warning(f"Version probe failed, running the full lookup: {str(e)}")
+                version = None
+            if version is not None:
+                validators = spatial_validators(version, zoom_level, geometry_format, tolerance, resolve)
+                if is_not_modified(request, *validators):
+                    return set_cache_headers(Response("", status=304), validators, max_age, exact)
+
+        result = await db.get_combined_data(spatial_id, zoom_level, geometry_format, tolerance, raw_attributes=True,
+                                            resolve=resolve)
+
+        if not result.get('geometry'):
+            unavailable = geometry_unavailable(result)
+            if unavailable:
+                body, headers = unavailable
+                return jsonify(body), 503, headers
+            return jsonify({"error": "No geometry data found for this spatial ID"}), 404
+
+        return set_cache_headers(serialize(spatial_response(spatial_id, zoom_level, result)),
+                                 result_validators(result, zoom_level, geometry_format, tolerance, resolve),
+                                 max_age, exact)
+    except Exception as e:
+        app.logger.error(f"Error retrieving spatial data: {str(e)}")
+        return jsonify({"error": "Internal server error while retrieving spatial data"}), 500
+
+@app.route('/api/spatial/batch', methods=['POST'])
+async def get_spatial_data_batch():
+    """Get spatial data for many IDs with one query per database"""
+    data = await request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid JSON format, expected an object"}), 400
+
+    spatial_ids = data.get('spatial_ids')
+    zoom_level = data.get('zoom_level', 25)
+
+    if not isinstance(spatial_ids, list) or not spatial_ids:
+        return jsonify({"error": "Missing or invalid 'spatial_ids' parameter, expected a non-empty list"}), 400
+
+    max_batch_size = app.config['MAX_BATCH_SIZE']
+    if len(spatial_ids) > max_batch_size:
+        return jsonify({"error": f"Too many spatial IDs, the maximum batch size is {max_batch_size}"}), 400
+
+    if not isinstance(zoom_level, int):
+        return jsonify({"error": "Invalid 'zoom_level' parameter, expected an integer"}), 400
+
+    invalid_ids = [sid for sid in spatial_ids if not isinstance(sid, str) or not validate_spatial_id(sid)]
+    if invalid_ids:
+        return jsonify({"error": "Invalid spatial ID format", "invalid_ids": invalid_ids}), 400
+
+    try:
+        geometry_format, tolerance = parse_geometry_options(data, zoom_level)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        results, errors = await db.get_combined_data_batch(spatial_ids, zoom_level, geometry_format, tolerance,
+                                                           raw_attributes=True)
+        return serialize(batch_lookup_response(results, errors, zoom_level))
+    except Exception as e:
+        app.logger.error(f"Error retrieving batch spatial data: {str(e)}")
+        return jsonify({"error": "Internal server error while retrieving spatial data"}), 500
+
+@app.route('/api/attributes/batch', methods=['POST'])
+async def update_spatial_attributes_batch():
+    """Update attributes for many spatial IDs in a single transaction"""
+    data = await request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list) or not data['items']:
+        return jsonify({"error": "Invalid JSON format, expected an object with a non-empty 'items' list"}), 400
+
+    items = data['items']
+    max_batch_size = app.config['MAX_BATCH_SIZE']
+    if len(items) > max_batch_size:
+        return jsonify({"error": f"Too many items, the maximum batch size is {max_batch_size}"}), 400
+
+    reports, valid = validate_attribute_items(items)
+
+    try:
+        # One existence query per zoom level, all running concurrently
+        zoom_levels = list({item['zoom_level'] for _, item in valid})
+        found = await asyncio.gather(*(
+            db.postgis_existing_ids({item['spatial_id'] for _, item in valid if item['zoom_level'] == zoom_level},
+                                    zoom_level)
+            for zoom_level in zoom_levels
+        ))
+        writable = select_writable_items(valid, dict(zip(zoom_levels, found)), reports)
+        results = await db.upsert_attributes_batch([item for _, item in writable])
+    except CircuitOpenError:
+        body, headers = circuit_open()
+        return jsonify(body), 503, headers
+    except Exception as e:
+        app.logger.error(f"Error updating attributes in bulk: {str(e)}")
+        return jsonify({"error": "Internal server error while updating attributes"}), 500
+
+    return serialize(batch_update_response(reports, writable, results))
+
+@app.route('/api/attributes/<path:spatial_id>', methods=['POST'])
+@require_valid_spatial_id
+async def update_spatial_attributes(spatial_id):
+    """Update attributes for a spatial ID"""
+    data = await request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Missing JSON data in request"}), 400
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid JSON format, expected an object"}), 400
+
+    zoom_level = data.get('zoom_level')
+    attributes = data.get('attributes')
+
+    if zoom_level is None:
+        return jsonify({"error": "Missing required 'zoom_level' parameter"}), 400
+
+    if not isinstance(zoom_level, int):
+        return jsonify({"error": "Invalid 'zoom_level' parameter, expected an integer"}), 400
+
+    if not attributes or not isinstance(attributes, dict):
+        return jsonify({"error": "Missing or invalid 'attributes' parameter"}), 400
+
+    try:
+        if not await db.postgis_record_exists(spatial_id, zoom_level):
+            return jsonify({"error": f"Spatial ID '{spatial_id}' not found"}), 404
+
+        updated_attributes = await db.upsert_attributes(spatial_id, zoom_level, attributes, raw=True)
+
+        return jsonify({
+            "message": "Attributes updated successfully",
+            "spatial_id": spatial_id,
+            "updated_attributes": updated_attributes
+        })
+    except CircuitOpenError:
+        body, headers = circuit_open()
+        return jsonify(body), 503, headers
+    except Exception as e:
+        app.logger.error(f"Error updating attributes: {str(e)}")
+        return jsonify({"error": "Internal server error while updating attributes"}), 500
+
+@app.route('/api/attributes/<path:spatial_id>', methods=['PATCH'])
+@require_valid_spatial_id
+async def patch_spatial_attributes(spatial_id):
+    """Apply a JSON Merge Patch or JSON Patch to the stored attributes of a spatial ID"""
+    patch_format = PATCH_MEDIA_TYPES.get(request.mimetype)
+    if patch_format is None:
+        return jsonify({"error": f"Unsupported Content-Type, expected {' or '.join(PATCH_MEDIA_TYPES)}"}), 415
+    try:
+        zoom_level, expected_updated_at = parse_patch_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    patch = await request.get_json(silent=True)
+    if patch is None:
+        return jsonify({"error": "Missing or invalid JSON patch document"}), 400
+
+    try:
+        result = await db.patch_attributes(spatial_id, zoom_level, patch, patch_format, expected_updated_at)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Error patching attributes: {str(e)}")
+        return jsonify({"error": "Internal server error while updating attributes"}), 500
+
+    body, status = patch_response(spatial_id, zoom_level, result, request.headers.get('Prefer'))
+    return serialize(body), status
+
+@app.route('/api/rollup/<path:spatial_id>', methods=['GET'])
+@require_valid_spatial_id
+async def get_spatial_rollup(spatial_id):
+    """Get the aggregated attributes of the child voxels of a spatial ID"""
+    zoom_level = request.args.get('zoom_level', default=25, type=int)
+    try:
+        rollup = await db.get_attribute_rollup(spatial_id, zoom_level)
+    except Exception as e:
+        app.logger.error(f"Error retrieving attribute rollup: {str(e)}")
+        return jsonify({"error": "Internal server error while retrieving attribute rollup"}), 500
+    if rollup is None:
+        return jsonify({"error": "No child attributes found for this spatial ID and zoom level"}), 404
+    return serialize(rollup)
+
+@app.route('/api/descendants/<path:spatial_id>', methods=['GET'])
+@require_valid_spatial_id
+async def get_spatial_descendants(spatial_id):
+    """Get the attributes of a voxel and every voxel inside it, in tile key order"""
+    if parse_spatial_id(spatial_id) is None:
+        return jsonify({"error": "Only z/f/x/y spatial IDs have descendants"}), 400
+    try:
+        zoom_level, limit, after = parse_descendants_options(request.args, app.config['MAX_BATCH_SIZE'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        records, last_spatial_id = await db.query_descendant_attributes(spatial_id, zoom_level, limit=limit,
+                                                                        after=after, raw_attributes=True)
+    except Exception as e:
+        app.logger.error(f"Error retrieving descendant attributes: {str(e)}")
+        return jsonify({"error": "Internal server error while retrieving descendant attributes"}), 500
+    return serialize(descendants_response(spatial_id, zoom_level, records, last_spatial_id))
+
+@app.route('/api/export', methods=['GET'])
+async def export_spatial_data():
+    """Stream every combined record as newline-delimited JSON"""
+    try:
+        zoom_level, bbox, geometry_format, tolerance = parse_export_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # The export reuses the psycopg2 named-cursor path, advanced one chunk at a time on a worker thread
+    chunks = iter_export_ndjson(iter_export_records(zoom_level, bbox, geometry_format, tolerance,
+                                                    raw_attributes=True))
+    try:
+        first = await asyncio.to_thread(next, chunks, b"")
+    except CircuitOpenError:
+        body, headers = circuit_open()
+        return jsonify(body), 503, headers
+    except Exception as e:
+        app.logger.error(f"Error starting export: {str(e)}")
+        return jsonify({"error": "Internal server error while exporting spatial data"}), 500
+
+    async def stream():
+        try:
+            yield first
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        except Exception as e:
+            app.logger.error(f"Error during export: {str(e)}")
+        finally:
+            await asyncio.to_thread(chunks.close)
+
+    return Response(stream(), mimetype='application/x-ndjson')
+
+@app.route('/api/changes', methods=['GET'])
+async def stream_changes():
+    """Push attribute changes for a set of spatial IDs or a bounding box as Server-Sent Events"""
+    if not CHANGE_FEED_ENABLED:
+        return jsonify({"error": "The change feed is disabled"}), 404
+    try:
+        spatial_ids, bbox, zoom_level = parse_change_subscription(request.args, app.config['MAX_BATCH_SIZE'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    subscription = change_feed.subscribe(AsyncSubscription(spatial_ids, bbox, zoom_level))
+
+    async def stream():
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                event = await subscription.get(CHANGE_FEED_KEEPALIVE)
+                yield format_sse(event).encode('utf-8')
+                if event is SHUTDOWN_EVENT:
+                    break
+        finally:
+            change_feed.unsubscribe(subscription)
+
+    response = Response(stream(), mimetype='text/event-stream', headers=SSE_HEADERS)
+    # Event streams stay open for as long as the client is subscribed
+    response.timeout = None
+    return response
+
+@app.route('/api/tiles/<int:z>/<int:x>/<int:y>.mvt', methods=['GET'])
+async def get_tile(z, x, y):
+    """Get a Mapbox Vector Tile of the buildings in tile z/x/y"""
+    if not 0 <= z <= 25 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({"error": "Invalid tile coordinates"}), 400
+    zoom_level = request.args.get('zoom_level', default=25, type=int)
+
+    try:
+        # Tiles are mostly served from the disk cache; builds reuse the psycopg2 path on a worker thread
+        tile = await asyncio.to_thread(get_vector_tile, z, x, y, zoom_level)
+    except CircuitOpenError:
+        body, headers = circuit_open()
+        return jsonify(body), 503, headers
+    except Exception as e:
+        app.logger.error(f"Error building tile {z}/{x}/{y}: {str(e)}")
+        return jsonify({"error": "Internal server error while building tile"}), 500
+
+    if not tile:
+        return Response(status=204)
+    return Response(tile, mimetype='application/vnd.mapbox-vector-tile')
+
+@app.route('/api/cache/stats', methods=['GET'])
+async def get_cache_stats():
+    """Expose cache counters for tuning sizes and TTLs"""
+    return jsonify(cache_stats())
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    """Expose latency histograms, pool utilization and cache hit ratios to Prometheus"""
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(render_metrics(db.pool_stats(), cache_stats(), breaker_stats()), mimetype='text/plain; version=0.0.4')
+
+@app.errorhandler(Exception)
+async def handle_exception(e):
+    logger.error(f"Unhandled exception: {str(e)}")
+    return jsonify({
+        "error": "An unexpected error occurred",
+        "details": str(e) if app.debug else "Contact administrator for details"
+    }), 500
+
+if __name__ == '__main__':
+    logger.info("Starting asyncio Spatial Data API on port 5000")
+    app.run(port=5000)
@@ -66,6 +66,93 @@ def test_update_attributes():
     print(f"\nInvalid data test - Status Code: {response.status_code}")
     print(f"Error: {response.text}")
 
+def test_conditional_get():
+    """Test If-None-Match revalidation of GET /api/spatial/<spatial_id>"""
+    print("\n=== Testing conditional GET /api/spatial/<spatial_id> ===")
+    
+    spatial_id = "25/29/29801113/13210757"
+    response = requests.get(f"{BASE_URL}/api/spatial/{spatial_id}")
+    etag = response.headers.get("ETag")
+    print(f"Status Code: {response.status_code}, ETag: {etag}, "
+          f"Last-Modified: {response.headers.get('Last-Modified')}, "
+          f"Cache-Control: {response.headers.get('Cache-Control')}")
+    if not etag:
+        print("Error: no ETag in the response")
+        return
+    
+    # Unchanged data is answered with 304 and an empty body
+    response = requests.get(f"{BASE_URL}/api/spatial/{spatial_id}", headers={"If-None-Match": etag})
+    print(f"Revalidation - Status Code: {response.status_code} (expected 304), body: {len(response.content)} bytes")
+    
+    # A different encoding is a different representation with its own ETag
+    response = requests.get(f"{BASE_URL}/api/spatial/{spatial_id}", params={"format": "geojson"},
+                            headers={"If-None-Match": etag})
+    print(f"Other format - Status Code: {response.status_code} (expected 200)")
+
+def test_change_feed():
+    """Test that an attribute update is pushed on GET /api/changes"""
+    print("\n=== Testing GET /api/changes (Server-Sent Events) ===")
+    
+    spatial_id = "25/29/29801113/13210757"
+    with requests.get(f"{BASE_URL}/api/changes", params={"spatial_ids": spatial_id},
+                      stream=True, timeout=30) as stream:
+        print(f"Status Code: {stream.status_code}, Content-Type: {stream.headers.get('Content-Type')}")
+        if stream.status_code != 200:
+            print(f"Error: {stream.text}")
+            return
+        
+        requests.post(f"{BASE_URL}/api/attributes/{spatial_id}",
+                      json={"zoom_level": 5, "attributes": {"name": "Change feed test"}})
+        
+        # Print lines until the first change event has been received
+        for line in stream.iter_lines(decode_unicode=True):
+            print(line)
+            if line.startswith("data:") and spatial_id in line:
+                break
+
+def test_patch_attributes():
+    """Test the PATCH /api/attributes/<spatial_id> endpoint"""
+    print("\n=== Testing PATCH /api/attributes/<spatial_id> endpoint ===")
+    
+    spatial_id = "25/29/29801113/13210757"
+    url = f"{BASE_URL}/api/attributes/{spatial_id}"
+    response = requests.patch(url, params={"zoom_level": 5}, data=json.dumps({"test_value": 43, "description": None}),
+                              headers={"Content-Type": "application/merge-patch+json",
+                                       "Prefer": "return=representation"})
+    print(f"Merge patch - Status Code: {response.status_code}")
+    print(json.dumps(response.json(), indent=2))
+    if response.status_code != 200:
+        return
+    updated_at = response.json()["updated_at"]
+    
+    operations = [{"op": "test", "path": "/test_value", "value": 43},
+                  {"op": "replace", "path": "/name", "value": "Patched Location"}]
+    response = requests.patch(url, params={"zoom_level": 5, "expected_updated_at": updated_at},
+                              data=json.dumps(operations), headers={"Content-Type": "application/json-patch+json"})
+    print(f"JSON Patch - Status Code: {response.status_code}")
+    
+    # The version used above is now stale
+    response = requests.patch(url, params={"zoom_level": 5, "expected_updated_at": updated_at},
+                              data=json.dumps({"test_value": 44}), headers={"Content-Type": "application/merge-patch+json"})
+    print(f"Stale version - Status Code: {response.status_code} (expected 409)")
+
+def test_attribute_resolution():
+    """Test resolve=nearest|merge on GET /api/spatial/<spatial_id> and GET /api/rollup/<spatial_id>"""
+    print("\n=== Testing zoom-level fallback and rollups ===")
+    
+    # Attributes are stored at zoom level 5; a zoom level 25 lookup falls back to them
+    spatial_id = "25/29/29801113/13210757"
+    for resolve in ("exact", "nearest", "merge"):
+        response = requests.get(f"{BASE_URL}/api/spatial/{spatial_id}", params={"zoom_level": 25, "resolve": resolve})
+        body = response.json()
+        print(f"resolve={resolve} - Status Code: {response.status_code}, "
+              f"attributes: {body.get('attributes') is not None}, sources: {body.get('attributes_sources')}")
+    
+    # The parent voxel's rollup covers its children stored at zoom level 5
+    response = requests.get(f"{BASE_URL}/api/rollup/24/14/14900556/6605378", params={"zoom_level": 5})
+    print(f"Rollup - Status Code: {response.status_code}")
+    print(json.dumps(response.json(), indent=2))
+
 if __name__ == "__main__":
     print("Testing Spatial Data API endpoints...")
     
@@ -78,4 +165,16 @@ if __name__ == "__main__":
     test_get_spatial_data()
     
     # Test the update attributes endpoint
-    test_update_attributes()
\ No newline at end of file
+    test_update_attributes()
+    
+    # Test the patch endpoint
+    test_patch_attributes()
+    
+    # Test conditional requests
+    test_conditional_get()
+    
+    # Test the change feed
+    test_change_feed()
+    
+    # Test zoom-level fallback and rollups
+    test_attribute_resolution()
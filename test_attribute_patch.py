@@ -0,0 +1,95 @@
+import sys
+import os
+
+# Add the db_setup directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'db_setup'))
+
+import query_spatial_data
+from query_spatial_data import _normalize_json_patch, _patch_update_query, patch_attributes
+
+def _rejected(operations):
+    try:
+        _normalize_json_patch(operations)
+    except ValueError as e:
+        return str(e)
+    raise AssertionError(f"{operations!r} was accepted")
+
+def test_normalizes_every_op():
+    """Pointers become key arrays, and only the members each op uses are kept"""
+    patch = [
+        {"op": "add", "path": "/tags/0", "value": "mr"},
+        {"op": "remove", "path": "/draft", "value": "ignored"},
+        {"op": "replace", "path": "/height", "value": None},
+        {"op": "move", "from": "/old", "path": "/new"},
+        {"op": "copy", "from": "/a/b", "path": "/c"},
+        {"op": "test", "path": "/height", "value": 12.5},
+    ]
+    assert _normalize_json_patch(patch) == [
+        {"op": "add", "path": ["tags", "0"], "value": "mr"},
+        {"op": "remove", "path": ["draft"]},
+        {"op": "replace", "path": ["height"], "value": None},
+        {"op": "move", "path": ["new"], "from": ["old"]},
+        {"op": "copy", "path": ["c"], "from": ["a", "b"]},
+        {"op": "test", "path": ["height"], "value": 12.5},
+    ]
+
+def test_pointer_escapes():
+    """~1 decodes to '/' and ~0 to '~', in that order, so '~01' stays the literal key '~1'"""
+    normalized = _normalize_json_patch([{"op": "add", "path": "/a~1b/c~0d/~01/", "value": 1}])
+    assert normalized[0]["path"] == ["a/b", "c~d", "~1", ""], normalized
+
+def test_rejects_invalid_operations():
+    """Unknown ops, bad pointers and missing members are reported with the operation's index"""
+    assert "non-empty array" in _rejected([])
+    assert "non-empty array" in _rejected({"op": "add", "path": "/a", "value": 1})
+    assert "Operation 0" in _rejected(["add"])
+    assert "Operation 1" in _rejected([{"op": "test", "path": "/a", "value": 1}, {"op": "merge", "path": "/a"}])
+    assert "Operation 0" in _rejected([{"path": "/a", "value": 1}])
+    assert "JSON pointer" in _rejected([{"op": "remove", "path": ""}])
+    assert "JSON pointer" in _rejected([{"op": "remove", "path": "a"}])
+    assert "JSON pointer" in _rejected([{"op": "remove"}])
+    assert "JSON pointer" in _rejected([{"op": "copy", "path": "/a"}])
+    assert "requires a 'value'" in _rejected([{"op": "replace", "path": "/a"}])
+    assert "into itself" in _rejected([{"op": "move", "from": "/a", "path": "/a/b"}])
+    # Moving to a sibling with a common prefix is fine
+    _normalize_json_patch([{"op": "move", "from": "/a", "path": "/ab"}])
+
+def test_update_query():
+    """Merge patches without nested objects or nulls use a plain top-level merge"""
+    query, document = _patch_update_query("merge", {"height": 12})
+    assert "attributes || %s::jsonb" in query and document == {"height": 12}
+    query, document = _patch_update_query("merge", {"roof": {"color": "red"}, "draft": None})
+    assert "jsonb_merge_patch(attributes, %s::jsonb)" in query
+    query, document = _patch_update_query("json-patch", [{"op": "remove", "path": "/draft"}])
+    assert "jsonb_apply_patch(attributes, %s::jsonb)" in query
+    assert document == [{"op": "remove", "path": ["draft"]}]
+
+def test_invalid_patch_never_reaches_the_database():
+    """patch_attributes raises ValueError before taking a connection"""
+    def no_pool():
+        raise AssertionError("a connection was requested")
+
+    attributes_pool = query_spatial_data.attributes_pool
+    query_spatial_data.attributes_pool = no_pool
+    try:
+        for patch_format, patch in (("json-patch", [{"op": "increment", "path": "/a"}]),
+                                    ("json-patch", [{"op": "add", "path": "a", "value": 1}]),
+                                    ("merge", ["not", "an", "object"]),
+                                    ("xml-patch", {"a": 1})):
+            try:
+                patch_attributes("25/0/0/0", 25, patch, patch_format)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError(f"{patch_format} patch {patch!r} was accepted")
+    finally:
+        query_spatial_data.attributes_pool = attributes_pool
+
+if __name__ == "__main__":
+    print("Testing attribute patch validation...")
+    test_normalizes_every_op()
+    test_pointer_escapes()
+    test_rejects_invalid_operations()
+    test_update_query()
+    test_invalid_patch_never_reaches_the_database()
+    print("All attribute patch tests passed")
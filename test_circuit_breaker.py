@@ -0,0 +1,155 @@
+import sys
+import os
+import time
+
+# Add the db_setup directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'db_setup'))
+
+from circuit_breaker import CLOSED, OPEN, HALF_OPEN, CircuitBreaker, CircuitOpenError
+
+class Unreachable(Exception):
+    pass
+
+def _fail(breaker, error=None):
+    """Run one guarded call that raises error (Unreachable by default)"""
+    try:
+        with breaker.guard():
+            raise error or Unreachable("connection refused")
+    except CircuitOpenError:
+        raise
+    except Exception:
+        pass
+
+def _rejected(breaker):
+    try:
+        with breaker.guard():
+            pass
+    except CircuitOpenError:
+        return True
+    return False
+
+def test_opens_after_threshold():
+    """Consecutive failures open the circuit at the threshold, and a success in between resets the count"""
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    _fail(breaker)
+    _fail(breaker)
+    with breaker.guard():
+        pass
+    assert breaker.stats()["consecutive_failures"] == 0
+
+    for _ in range(2):
+        _fail(breaker)
+    assert breaker.state == CLOSED
+    _fail(breaker)
+    assert breaker.state == OPEN
+    assert breaker.opened_total == 1
+
+    # Open: calls are rejected without running the block
+    ran = []
+    try:
+        with breaker.guard():
+            ran.append(True)
+    except CircuitOpenError:
+        pass
+    else:
+        raise AssertionError("call went through an open circuit")
+    assert not ran
+    assert breaker.rejected_total == 1
+
+def test_is_failure_predicate():
+    """Exceptions the predicate rejects mean the dependency answered and count as successes"""
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60,
+                             is_failure=lambda e: isinstance(e, Unreachable))
+    _fail(breaker, ValueError("syntax error"))
+    assert breaker.state == CLOSED
+    # guard() can override the breaker's predicate per call
+    try:
+        with breaker.guard(is_failure=lambda e: isinstance(e, KeyError)):
+            raise KeyError("driver-specific failure")
+    except KeyError:
+        pass
+    assert breaker.state == OPEN
+
+def test_half_open_probe_closes():
+    """After the cooldown one probe goes through while others are rejected; its success closes the circuit"""
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    _fail(breaker)
+    assert breaker.state == OPEN
+    time.sleep(0.06)
+    assert breaker.state == HALF_OPEN
+
+    with breaker.guard():
+        # The only probe slot is taken
+        assert _rejected(breaker)
+    assert breaker.state == CLOSED
+    assert not _rejected(breaker)
+
+def test_half_open_probe_reopens():
+    """A failed probe reopens the circuit at once and restarts the cooldown"""
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=0.05)
+    for _ in range(3):
+        _fail(breaker)
+    time.sleep(0.06)
+    _fail(breaker)
+    assert breaker.state == OPEN
+    assert breaker.opened_total == 2
+    assert breaker.retry_after() > 0.02
+
+def test_abandoned_probe_frees_its_slot():
+    """A probe cut short (e.g. a cancelled task) gives no verdict and lets the next call probe"""
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    _fail(breaker)
+    time.sleep(0.06)
+    try:
+        with breaker.guard():
+            raise KeyboardInterrupt
+    except KeyboardInterrupt:
+        pass
+    assert breaker.state == HALF_OPEN
+    with breaker.guard():
+        pass
+    assert breaker.state == CLOSED
+
+def test_retry_after():
+    """retry_after() counts down the cooldown of an open circuit and is 0 otherwise"""
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.2)
+    assert breaker.retry_after() == 0.0
+    _fail(breaker)
+    first = breaker.retry_after()
+    assert 0.1 < first <= 0.2, first
+    time.sleep(0.05)
+    assert breaker.retry_after() < first
+    time.sleep(0.2)
+    assert breaker.retry_after() == 0.0
+    assert breaker.state == HALF_OPEN
+
+def test_record_failure():
+    """Failures observed outside guard() (a caller timing out) count the same way"""
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    breaker.record_failure(TimeoutError("leg timed out"))
+    breaker.record_failure(TimeoutError("leg timed out"))
+    stats = breaker.stats()
+    assert stats["state"] == OPEN
+    assert stats["last_error"] == "leg timed out"
+
+def test_rejects_bad_settings():
+    """A threshold or probe count below 1 is a configuration error"""
+    for kwargs in ({"failure_threshold": 0}, {"half_open_max_calls": 0}):
+        try:
+            CircuitBreaker("test", **kwargs)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"{kwargs} was accepted")
+
+if __name__ == "__main__":
+    print("Testing the circuit breaker...")
+    test_opens_after_threshold()
+    test_is_failure_predicate()
+    test_half_open_probe_closes()
+    test_half_open_probe_reopens()
+    test_abandoned_probe_frees_its_slot()
+    test_retry_after()
+    test_record_failure()
+    test_rejects_bad_settings()
+    print("All circuit breaker tests passed")
@@ -0,0 +1,85 @@
+import sys
+import os
+
+# Add the db_setup directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'db_setup'))
+
+from query_spatial_data import _merge_export_rows
+
+def _merged(postgis_rows, attribute_rows, zoom_level=None):
+    return [(record["spatial_id"], record["zoom_level"], record["geometry"], record["attributes"])
+            for record in _merge_export_rows(postgis_rows, attribute_rows, zoom_level)]
+
+def test_ids_only_in_postgis():
+    """Geometry without attributes is exported with null attributes at the requested zoom level"""
+    postgis_rows = [("a", None, "geom-a", 10.0), ("b", None, "geom-b", None)]
+    assert _merged(postgis_rows, [], 25) == [("a", 25, "geom-a", None), ("b", 25, "geom-b", None)]
+    assert _merged(postgis_rows, [], None) == [("a", None, "geom-a", None), ("b", None, "geom-b", None)]
+
+    record = next(_merge_export_rows(postgis_rows, [], 25))
+    assert record == {"spatial_id": "a", "zoom_level": 25, "geometry": "geom-a", "attributes": None, "altitude": 10.0}
+
+def test_ids_only_in_attributes():
+    """Attributes without geometry are skipped, before, between and after the PostGIS IDs"""
+    attribute_rows = [("0", 25, {"n": 0}), ("b", 25, {"n": 1}), ("c", 25, {"n": 2}), ("z", 25, {"n": 3})]
+    assert _merged([], attribute_rows) == []
+    assert _merged([("b", None, "geom-b", None)], attribute_rows) == [("b", 25, "geom-b", {"n": 1})]
+
+def test_interleaved_runs():
+    """Runs of IDs on either side are merge-joined, and zoom levels of one ID stay together"""
+    postgis_rows = [
+        ("10/0/1/1", None, "g1", None),
+        ("10/0/1/2", None, "g2", None),
+        ("10/0/1/3", None, "g3", None),
+        ("10/0/2/1", None, "g4", None),
+        ("12/0/0/0", None, "g5", None),
+    ]
+    attribute_rows = [
+        ("10/0/0/9", 10, {"orphan": True}),
+        ("10/0/1/1", 10, {"level": 10}),
+        ("10/0/1/1", 25, {"level": 25}),
+        ("10/0/1/25", 10, {"orphan": True}),
+        ("10/0/1/3", 10, {"level": 10}),
+        ("11/0/0/0", 11, {"orphan": True}),
+        ("12/0/0/0", 12, {"level": 12}),
+    ]
+    assert _merged(postgis_rows, attribute_rows, 10) == [
+        ("10/0/1/1", 10, "g1", {"level": 10}),
+        ("10/0/1/1", 25, "g1", {"level": 25}),
+        ("10/0/1/2", 10, "g2", None),
+        ("10/0/1/3", 10, "g3", {"level": 10}),
+        ("10/0/2/1", 10, "g4", None),
+        ("12/0/0/0", 12, "g5", {"level": 12}),
+    ]
+
+def test_postgis_zoom_column():
+    """With a zoom column each geometry row only takes the attributes of its own zoom level"""
+    postgis_rows = [("a", 10, "a10", None), ("a", 25, "a25", None), ("b", 25, "b25", None)]
+    attribute_rows = [("a", 10, {"z": 10}), ("a", 11, {"z": 11}), ("b", 10, {"z": 10})]
+    assert _merged(postgis_rows, attribute_rows) == [
+        ("a", 10, "a10", {"z": 10}),
+        ("a", 25, "a25", None),
+        ("b", 25, "b25", None),
+    ]
+
+def test_streams_lazily():
+    """Rows are consumed as records are produced, not read up front"""
+    consumed = []
+
+    def postgis_rows():
+        for spatial_id in ("a", "b", "c"):
+            consumed.append(spatial_id)
+            yield (spatial_id, None, "geom", None)
+
+    records = _merge_export_rows(postgis_rows(), iter([("a", 25, {})]), 25)
+    assert next(records)["spatial_id"] == "a"
+    assert consumed == ["a"]
+
+if __name__ == "__main__":
+    print("Testing the export merge join...")
+    test_ids_only_in_postgis()
+    test_ids_only_in_attributes()
+    test_interleaved_runs()
+    test_postgis_zoom_column()
+    test_streams_lazily()
+    print("All export merge tests passed")
@@ -0,0 +1,106 @@
+import base64
+import sys
+import os
+
+# Add the db_setup directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'db_setup'))
+
+from geometry_encoding import (COORDINATE_PRECISION, DEFAULT_GEOMETRY_FORMAT, GEOMETRY_FORMATS, decode_geometry,
+                               geometry_sql, quantize_geojson, simplify_tolerance)
+
+SQUARE = {"type": "Polygon", "coordinates": [[[139.7671234, 35.6812345], [139.7672234, 35.6812345],
+                                              [139.7672234, 35.6813345], [139.7671234, 35.6812345]]]}
+
+def _dequantize(positions, scale):
+    """Running sum of a delta-encoded position list, back to coordinates"""
+    x = y = 0
+    decoded = []
+    for dx, dy in positions:
+        x += dx
+        y += dy
+        decoded.append([x / scale, y / scale])
+    return decoded
+
+def test_quantize_rounding():
+    """Coordinates round to the nearest step, and the first position of each ring stays absolute"""
+    point = quantize_geojson({"type": "Point", "coordinates": [139.76712346, -35.68123449]})
+    assert point == {"type": "Point", "scale": 10 ** 7, "coordinates": [1397671235, -356812345]}, point
+
+    polygon = quantize_geojson(SQUARE)
+    ring = polygon["coordinates"][0]
+    assert ring[0] == [1397671234, 356812345]
+    assert ring[1:] == [[1000, 0], [0, 1000], [-1000, -1000]], ring
+    for decoded, original in zip(_dequantize(ring, polygon["scale"]), SQUARE["coordinates"][0]):
+        assert all(abs(d - o) < 0.5e-7 for d, o in zip(decoded, original)), (decoded, original)
+
+def test_quantize_precision():
+    """precision sets the scale; coarser grids merge nearby coordinates"""
+    line = quantize_geojson({"type": "LineString", "coordinates": [[1.234, 5.678], [1.236, 5.678]]}, precision=2)
+    assert line == {"type": "LineString", "scale": 100, "coordinates": [[123, 568], [1, 0]]}, line
+
+def test_quantize_nested_geometries():
+    """Multi-geometries encode each ring separately and collections recurse"""
+    multi = {"type": "MultiPolygon", "coordinates": [SQUARE["coordinates"], SQUARE["coordinates"]]}
+    quantized = quantize_geojson(multi)
+    assert quantized["coordinates"][0] == quantized["coordinates"][1] == quantize_geojson(SQUARE)["coordinates"]
+
+    collection = quantize_geojson({"type": "GeometryCollection", "geometries": [SQUARE, multi]}, precision=3)
+    assert collection["scale"] == 1000
+    assert [part["type"] for part in collection["geometries"]] == ["Polygon", "MultiPolygon"]
+    assert collection["geometries"][0] == quantize_geojson(SQUARE, precision=3)
+
+def test_geometry_sql():
+    """Each format selects the matching PostGIS expression, simplified only when a tolerance is given"""
+    assert DEFAULT_GEOMETRY_FORMAT in GEOMETRY_FORMATS
+    expected = {
+        "ewkb": "geom",
+        "geojson": f"ST_AsGeoJSON(geom, {COORDINATE_PRECISION})",
+        "wkb": "ST_AsBinary(geom)",
+        "quantized": f"ST_AsGeoJSON(geom, {COORDINATE_PRECISION})",
+    }
+    assert set(expected) == set(GEOMETRY_FORMATS)
+    for geometry_format, sql in expected.items():
+        assert geometry_sql(geometry_format) == (sql, ())
+        assert geometry_sql(geometry_format, tolerance=0) == (sql, ())
+
+        simplified = sql.replace("geom", "ST_SimplifyPreserveTopology(b.geom, %s)")
+        assert geometry_sql(geometry_format, tolerance=0.5, column="b.geom") == (simplified, (0.5,))
+
+    try:
+        geometry_sql("svg")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("unknown format was accepted")
+
+def test_decode_geometry():
+    """Column values decode into each format's JSON form, and NULL geometry stays None"""
+    text = '{"type":"Point","coordinates":[139.7671234,35.6812345]}'
+    assert decode_geometry(text, "geojson") == {"type": "Point", "coordinates": [139.7671234, 35.6812345]}
+    assert decode_geometry(text, "quantized") == {"type": "Point", "scale": 10 ** 7,
+                                                  "coordinates": [1397671234, 356812345]}
+
+    wkb = bytes.fromhex("0101000000000000000000f03f0000000000000040")
+    encoded = decode_geometry(memoryview(wkb), "wkb")
+    assert base64.b64decode(encoded) == wkb
+    hex_ewkb = "0101000020E6100000000000000000F03F0000000000000040"
+    assert decode_geometry(hex_ewkb, "ewkb") == hex_ewkb
+    for geometry_format in GEOMETRY_FORMATS:
+        assert decode_geometry(None, geometry_format) is None
+
+def test_simplify_tolerance():
+    """The tolerance is one tile pixel, halving with each zoom level"""
+    assert simplify_tolerance(0) == 360.0 / 256
+    assert simplify_tolerance(1) == simplify_tolerance(0) / 2
+    assert simplify_tolerance(10, 3857) == 40075016.685578488 / (256 << 10)
+    assert simplify_tolerance(-1) == simplify_tolerance(0)
+
+if __name__ == "__main__":
+    print("Testing geometry encodings...")
+    test_quantize_rounding()
+    test_quantize_precision()
+    test_quantize_nested_geometries()
+    test_geometry_sql()
+    test_decode_geometry()
+    test_simplify_tolerance()
+    print("All geometry encoding tests passed")
@@ -0,0 +1,77 @@
+import sys
+import os
+import json
+
+# Add the db_setup directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'db_setup'))
+
+from query_spatial_data import connect_to_attributes_db
+
+COVERING_INDEX = "spatial_attributes_spatial_id_zoom_key"
+
+def explain(cursor, query, params):
+    """Return the top plan node of EXPLAIN (FORMAT JSON) for a query"""
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+def find_scan(plan):
+    """Find the first node in a plan tree that reads an index, else the first scan"""
+    if "Index Name" in plan:
+        return plan
+    for child in plan.get("Plans", []):
+        scan = find_scan(child)
+        if scan and "Index Name" in scan:
+            return scan
+    return plan if plan["Node Type"].endswith("Scan") else None
+
+def check_plans():
+    conn = connect_to_attributes_db()
+    assert conn, "Failed to connect to the attributes database"
+
+    try:
+        cursor = conn.cursor()
+        # The test tables are tiny, so keep the planner from preferring a sequential scan
+        cursor.execute("SET enable_seqscan = off")
+
+        spatial_id = "25/29/29801113/13210757"
+        zoom_level = 5
+
+        # Attribute lookups go through the covering index
+        plan = explain(cursor, """SELECT attributes FROM spatial_attributes
+                                  WHERE spatial_id = %s AND zoom_level = %s""", (spatial_id, zoom_level))
+        scan = find_scan(plan)
+        print(f"Attribute lookup: {scan['Node Type']} using {scan.get('Index Name')}")
+        assert scan["Node Type"] in ("Index Scan", "Index Only Scan"), scan["Node Type"]
+        assert scan.get("Index Name") == COVERING_INDEX, scan.get("Index Name")
+
+        # Version checks never touch the heap
+        plan = explain(cursor, """SELECT updated_at FROM spatial_attributes
+                                  WHERE spatial_id = %s AND zoom_level = %s""", (spatial_id, zoom_level))
+        scan = find_scan(plan)
+        print(f"Version lookup: {scan['Node Type']} using {scan.get('Index Name')}")
+        assert scan["Node Type"] == "Index Only Scan", scan["Node Type"]
+        assert scan.get("Index Name") == COVERING_INDEX, scan.get("Index Name")
+
+        # Batch lookups use the same index
+        plan = explain(cursor, """SELECT spatial_id, attributes FROM spatial_attributes
+                                  WHERE spatial_id = ANY(%s) AND zoom_level = %s""",
+                       ([spatial_id, "test123"], zoom_level))
+        scan = find_scan(plan)
+        print(f"Batch lookup: {scan['Node Type']} using {scan.get('Index Name')}")
+        assert scan.get("Index Name") == COVERING_INDEX, scan.get("Index Name")
+
+        cursor.close()
+    finally:
+        conn.rollback()
+        conn.close()
+
+def test_index_usage():
+    check_plans()
+
+if __name__ == "__main__":
+    print("Checking index usage on spatial_attributes...")
+    check_plans()
+    print("All lookups use the covering index")
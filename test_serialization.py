@@ -0,0 +1,79 @@
+import asyncio
+import importlib
+import sys
+import os
+
+import pytest
+
+# Add the db_setup directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'db_setup'))
+
+import serialization
+from serialization import RawJSON, decode_raw
+
+# Stored JSONB text as PostgreSQL returns it: compact apart from the space after ':' and ','
+STORED = '{"name": "Building A", "height": 12.5, "tags": ["mr", "bldg"], "note": "\\u65e5\\u672c"}'
+# The same document as every backend writes it
+COMPACT = '{"name":"Building A","height":12.5,"tags":["mr","bldg"],"note":"日本"}'
+
+def _payload(raw):
+    return {"spatial_id": "25/29/29801113/13210757", "attributes": RawJSON(raw), "partial": False}
+
+def _expected(raw):
+    return '{"spatial_id":"25/29/29801113/13210757","attributes":' + raw + ',"partial":false}'
+
+def test_raw_json_embedded_verbatim():
+    """A compact raw document comes out of dumps()/dumps_bytes() byte for byte with every backend"""
+    assert serialization.dumps(_payload(COMPACT)) == _expected(COMPACT)
+    assert serialization.dumps_bytes(_payload(COMPACT)) == _expected(COMPACT).encode("utf-8")
+    # Nested inside lists too, as in batch responses
+    assert serialization.dumps([RawJSON(COMPACT), RawJSON("null")]) == f"[{COMPACT},null]"
+
+def test_raw_json_not_reencoded_with_fragment():
+    """With orjson.Fragment the stored text is spliced in as is, whitespace and escapes included"""
+    if not (serialization.USE_ORJSON and serialization._Fragment is not None):
+        pytest.skip("needs orjson 3.9+ (orjson.Fragment)")
+    assert serialization.dumps(_payload(STORED)) == _expected(STORED)
+
+def test_decode_raw():
+    """decode_raw() decodes RawJSON and leaves other values alone"""
+    assert decode_raw(RawJSON(STORED)) == serialization.loads(COMPACT)
+    assert decode_raw({"a": 1}) == {"a": 1}
+    assert decode_raw(None) is None
+    assert RawJSON(STORED) == RawJSON(STORED) and RawJSON(STORED) != RawJSON(COMPACT)
+
+def _import_app(module):
+    # The apps need flask/quart and the database drivers, which a bare checkout may not have
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        pytest.skip(f"{module} needs {e.name}")
+
+def test_flask_json_provider():
+    """Flask's JSON provider writes RawJSON exactly as serialization.dumps does"""
+    spatial_api = _import_app("spatial_api")
+    app = spatial_api.create_app()
+    payload = _payload(COMPACT)
+    assert app.json.dumps(payload) == serialization.dumps(payload) == _expected(COMPACT)
+    with app.app_context():
+        response = app.json.response(payload)
+    assert response.get_data() == serialization.dumps_bytes(payload)
+
+def test_quart_json_provider():
+    """Quart's JSON provider writes RawJSON exactly as serialization.dumps does"""
+    spatial_api_async = _import_app("spatial_api_async")
+    app = spatial_api_async.app
+    payload = _payload(COMPACT)
+    assert app.json.dumps(payload) == serialization.dumps(payload) == _expected(COMPACT)
+    response = app.json.response(payload)
+    assert asyncio.run(response.get_data()) == serialization.dumps_bytes(payload)
+
+if __name__ == "__main__":
+    print("Testing JSON serialization...")
+    for test in (test_raw_json_embedded_verbatim, test_raw_json_not_reencoded_with_fragment, test_decode_raw,
+                 test_flask_json_provider, test_quart_json_provider):
+        try:
+            test()
+        except pytest.skip.Exception as e:
+            print(f"Skipped {test.__name__}: {e}")
+    print("All serialization tests passed")
@@ -0,0 +1,112 @@
+import sys
+import os
+import time
+
+# Add the db_setup directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'db_setup'))
+
+import spatial_cache
+from spatial_cache import MISS, TTLCache
+
+def test_get_and_expiry():
+    """Cached values are returned until their TTL passes, then count as expired misses"""
+    cache = TTLCache("test", max_entries=10, ttl=0.05)
+    assert cache.get("a") is MISS
+    cache.put("a", None)
+    assert cache.get("a") is None  # None is a valid cached value
+    time.sleep(0.06)
+    assert cache.get("a") is MISS
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expirations"]) == (1, 2, 1), stats
+    assert stats["size"] == 0
+
+def test_lru_eviction():
+    """Past max_entries the least recently used entry goes, and a get counts as a use"""
+    cache = TTLCache("test", max_entries=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is MISS
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_tombstones():
+    """A value read before an invalidation is not cached again; one read after it is"""
+    cache = TTLCache("test", max_entries=10, ttl=60)
+    cache.put("a", "old")
+    fetched_before = time.monotonic()
+    cache.invalidate("a")
+    assert cache.get("a") is MISS
+
+    cache.put("a", "stale", fetched_at=fetched_before)
+    assert cache.get("a") is MISS
+    cache.put("a", "fresh", fetched_at=time.monotonic())
+    assert cache.get("a") == "fresh"
+    assert cache.stats()["invalidations"] == 1
+
+def test_tombstones_are_not_evictions():
+    """Tombstones take slots but pushing them out is not counted as evicting a value"""
+    cache = TTLCache("test", max_entries=1, ttl=60)
+    cache.invalidate("a")
+    cache.put("b", 2)
+    assert cache.stats()["evictions"] == 0
+    cache.put("c", 3)
+    assert cache.stats()["evictions"] == 1
+
+def test_invalidate_all():
+    """invalidate_all() drops everything and rejects values read before it"""
+    cache = TTLCache("test", max_entries=10, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    fetched_before = time.monotonic()
+    cache.invalidate_all()
+    assert cache.get("a") is MISS and cache.get("b") is MISS
+    cache.put("a", 1, fetched_at=fetched_before)
+    assert cache.get("a") is MISS
+    cache.put("a", 1, fetched_at=time.monotonic())
+    assert cache.get("a") == 1
+    assert cache.stats()["invalidations"] == 2
+
+def test_invalidation_listeners():
+    """invalidate_attributes() drops the cached attributes and notifies every listener, even if one fails"""
+    calls = []
+
+    def broken(spatial_id, zoom_level):
+        raise RuntimeError("listener failed")
+
+    def record(spatial_id, zoom_level):
+        calls.append((spatial_id, zoom_level))
+
+    def record_all():
+        calls.append("all")
+
+    listeners = list(spatial_cache._invalidation_listeners)
+    all_listeners = list(spatial_cache._invalidate_all_listeners)
+    try:
+        spatial_cache.add_invalidation_listener(broken)
+        spatial_cache.add_invalidation_listener(record, record_all)
+        key = ("25/0/0/0", 25)
+        spatial_cache.attributes_cache.put(key, {"height": 10})
+
+        spatial_cache.invalidate_attributes(*key)
+        assert spatial_cache.attributes_cache.get(key) is MISS
+        assert calls == [key], calls
+
+        spatial_cache.invalidate_all_attributes()
+        assert calls == [key, "all"], calls
+    finally:
+        spatial_cache._invalidation_listeners[:] = listeners
+        spatial_cache._invalidate_all_listeners[:] = all_listeners
+        spatial_cache.attributes_cache.clear()
+
+if __name__ == "__main__":
+    print("Testing the spatial data cache...")
+    test_get_and_expiry()
+    test_lru_eviction()
+    test_tombstones()
+    test_tombstones_are_not_evictions()
+    test_invalidate_all()
+    test_invalidation_listeners()
+    print("All spatial cache tests passed")
@@ -0,0 +1,103 @@
+import sys
+import os
+
+# Add the db_setup directory to the Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'db_setup'))
+
+from spatial_id import MAX_ZOOM, SpatialID, parse_spatial_id
+
+def test_round_trip():
+    """Parsing and formatting a z/f/x/y ID gives back the same string"""
+    for spatial_id in ("25/29/29801113/13210757", "0/0/0/0", "0/-1/0/0", "5/-32/31/0", "12/-3/4095/17"):
+        voxel = SpatialID.parse(spatial_id)
+        assert str(voxel) == spatial_id, str(voxel)
+        assert SpatialID.parse(str(voxel)) == voxel
+        assert SpatialID(*voxel.as_tuple()) == voxel
+        assert parse_spatial_id(spatial_id) == voxel
+
+def test_parent_and_children():
+    """Every child's parent is the voxel it came from, and ancestors run up to zoom 0"""
+    voxel = SpatialID.parse("25/29/29801113/13210757")
+    parent = voxel.parent()
+    assert str(parent) == "24/14/14900556/6605378", str(parent)
+    assert voxel in parent.children()
+    assert parent.contains(voxel) and not voxel.contains(parent)
+    assert voxel.parent(3) == parent.parent(2)
+
+    ancestors = list(voxel.ancestors())
+    assert len(ancestors) == voxel.z
+    assert ancestors[0] == parent
+    assert str(ancestors[-1]) == "0/0/0/0", str(ancestors[-1])
+
+    children = parent.children()
+    assert len(set(children)) == 8
+    for child in children:
+        assert child.z == parent.z + 1
+        assert child.parent() == parent
+        assert parent.contains(child)
+
+def test_negative_floors():
+    """Negative floors round towards -inf, so they stay below the ground plane when going up"""
+    voxel = SpatialID.parse("3/-1/5/2")
+    assert str(voxel.parent()) == "2/-1/2/1", str(voxel.parent())
+    for child in voxel.children():
+        assert child.f in (-2, -1)
+        assert child.parent() == voxel
+
+def test_hierarchy_edges():
+    """Zoom 0 has no parent and MAX_ZOOM has no children"""
+    for call in (lambda: SpatialID(0, 0, 0, 0).parent(),
+                 lambda: SpatialID(3, 0, 1, 1).parent(4),
+                 lambda: SpatialID(MAX_ZOOM, 0, 0, 0).children()):
+        try:
+            call()
+        except ValueError:
+            continue
+        raise AssertionError("expected ValueError")
+
+def test_rejects_bad_input():
+    """Malformed strings and out-of-range components raise ValueError; parse_spatial_id returns None"""
+    for spatial_id in ("building1", "", "25/29/29801113", "25/29/29801113/13210757/1", "a/b/c/d",
+                       "26/0/0/0", "-1/0/0/0", "2/0/4/0", "2/0/0/-1", "2/4/0/0", "2/-5/0/0", "1.5/0/0/0"):
+        try:
+            SpatialID.parse(spatial_id)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"{spatial_id!r} was accepted")
+        assert parse_spatial_id(spatial_id) is None
+
+def test_tile_keys():
+    """Keys round-trip, and a tile and its descendants fill key_range() while other tiles fall outside"""
+    voxel = SpatialID.parse("12/-3/3638/1612")
+    key = voxel.tile_key()
+    assert SpatialID.from_key(key, voxel.f) == voxel
+    assert SpatialID(MAX_ZOOM, 0, 2 ** MAX_ZOOM - 1, 2 ** MAX_ZOOM - 1).tile_key() < 2 ** 63
+
+    low, high = voxel.key_range()
+    assert low == key
+    first_child, last_child = voxel.children()[0], voxel.children()[-1]
+    deepest = SpatialID(MAX_ZOOM, 0, 3639 * 2 ** 13 - 1, 1613 * 2 ** 13 - 1)
+    for other in (first_child, last_child, last_child.children()[-1], deepest):
+        assert low <= other.tile_key() <= high, str(other)
+
+    neighbours = voxel.neighbours(vertical=False)
+    for other in [voxel.parent(), voxel.parent(12)] + neighbours + [n.children()[0] for n in neighbours]:
+        assert not low <= other.tile_key() <= high, str(other)
+
+    # The four horizontal children sort after their parent, in disjoint ranges that end where it ends
+    ranges = sorted({child.key_range() for child in voxel.children()})
+    assert len(ranges) == 4
+    assert ranges[0][0] > key and ranges[-1][1] == high
+    for before, after in zip(ranges, ranges[1:]):
+        assert before[1] < after[0]
+
+if __name__ == "__main__":
+    print("Testing spatial ID parsing and hierarchy...")
+    test_round_trip()
+    test_parent_and_children()
+    test_negative_floors()
+    test_hierarchy_edges()
+    test_rejects_bad_input()
+    test_tile_keys()
+    print("All spatial ID tests passed")